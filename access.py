@@ -1,38 +1,310 @@
 import os
+import mmap
+import marshal
+import stat
+import time
+import threading
 import commands
 
+# scandir() lets us list a directory and learn which entries are
+# directories (from the d_type returned by readdir()) without a separate
+# stat() per entry. It's in the os module as of Python 3.5, and available
+# as the "scandir" module for older Pythons. If neither is available,
+# FilePath.scandir() falls back to listdir() plus isdir().
+
+try:
+	from os import scandir as _scandir
+except ImportError:
+	try:
+		from scandir import scandir as _scandir
+	except ImportError:
+		_scandir = None
+
+def _maplines(a):
+	# Yields the lines of open file a, using mmap. Empty files can't be
+	# mapped, so they yield nothing.
+	size = os.fstat(a.fileno()).st_size
+	if size == 0:
+		return
+	m = mmap.mmap(a.fileno(),size,access=mmap.ACCESS_READ)
+	try:
+		readline = m.readline
+		line = readline()
+		while line:
+			yield line
+			line = readline()
+	finally:
+		m.close()
+
+def _plain(name):
+	# Returns True if name is a relative path with no empty, "." or ".."
+	# components and no trailing slash, so that joining it to a
+	# normalized path gives a normalized path. (Names starting with "."
+	# are conservatively treated as not plain.)
+	return name != "" and name[0] != "/" and name[-1] != "/" and "//" not in name and "/." not in name and name[0] != "."
+
+# A StatCache remembers the results of stat() calls and directory listings,
+# so that repeated existence and type checks of the same paths -- which is
+# most of what probing a Portage tree consists of -- are answered from memory.
+# Listing a directory with FilePath.scandir() or listdir() fills the cache
+# for every entry in it: afterwards, exists() and isdir() on any child are
+# answered without a syscall, including for children that don't exist.
+#
+# The cache is off by default. Turn it on like this:
+#
+# >>> FilePath.statcache = StatCache(ttl=5)
+#
+# Entries older than ttl seconds are discarded (with ttl=None, they are kept
+# until invalidated.) Code that knows the filesystem has changed, such as
+# after a sync, should call invalidate() to forget everything, or
+# invalidate(diskpath) to forget a single path.
+#
+# A StatCache is shared by the DirectoryScanner threads (see scanner.py), so
+# changes to it are made under a lock. Lookups and syscalls are not.
+
+class StatCache(object):
+
+	def __repr__(self):
+		return "StatCache(ttl=%s)" % self.ttl
+
+	def __init__(self,ttl=None):
+		self.ttl = ttl
+		self._lock = threading.Lock()
+		# diskpath -> ( time, value ), where value is an os.stat()
+		# result, None for a missing path, or True/False (is a
+		# directory) for an entry only seen in a directory listing:
+		self._stats = {}
+		# diskpath -> ( time, { name : isdir } )
+		self._dirs = {}
+
+	def invalidate(self,diskpath=None):
+		self._lock.acquire()
+		try:
+			if diskpath == None:
+				self._stats = {}
+				self._dirs = {}
+				return
+			self._stats.pop(diskpath,None)
+			self._dirs.pop(diskpath,None)
+			self._dirs.pop(os.path.dirname(diskpath),None)
+		finally:
+			self._lock.release()
+
+	def _get(self,cache,diskpath):
+		# Returns the cached entry for diskpath, or None.
+		entry = cache.get(diskpath)
+		if entry == None:
+			return None
+		if self.ttl != None and time.time() - entry[0] >= self.ttl:
+			self._lock.acquire()
+			try:
+				# another thread may have replaced or expired it:
+				if cache.get(diskpath) is entry:
+					del cache[diskpath]
+			finally:
+				self._lock.release()
+			return None
+		return entry
+
+	def _listed(self,diskpath):
+		# Returns True or False if the parent directory of diskpath has
+		# been listed (i.e. whether diskpath is in it), otherwise None.
+		parent, name = os.path.split(diskpath)
+		entry = self._get(self._dirs,parent)
+		if entry == None:
+			return None
+		return name in entry[1]
+
+	def stat(self,diskpath):
+		entry = self._get(self._stats,diskpath)
+		if entry != None and type(entry[1]) != bool:
+			return entry[1]
+		if entry == None and self._listed(diskpath) == False:
+			return None
+		try:
+			st = os.stat(diskpath)
+		except OSError:
+			st = None
+		self._lock.acquire()
+		try:
+			self._stats[diskpath] = ( time.time(), st )
+		finally:
+			self._lock.release()
+		return st
+
+	def exists(self,diskpath):
+		entry = self._get(self._stats,diskpath)
+		if entry != None:
+			return entry[1] != None
+		if self._listed(diskpath) == False:
+			return False
+		return self.stat(diskpath) != None
+
+	def isdir(self,diskpath):
+		entry = self._get(self._stats,diskpath)
+		if entry != None:
+			if type(entry[1]) == bool:
+				return entry[1]
+			return entry[1] != None and stat.S_ISDIR(entry[1].st_mode)
+		if self._listed(diskpath) == False:
+			return False
+		st = self.stat(diskpath)
+		return st != None and stat.S_ISDIR(st.st_mode)
+
+	def scandir(self,diskpath):
+		# Returns a cached list of ( name, isdir ) tuples for directory
+		# diskpath, or None if it hasn't been listed.
+		entry = self._get(self._dirs,diskpath)
+		if entry == None:
+			return None
+		return entry[1].items()
+
+	def fill(self,diskpath,entries):
+		# Records the listing of directory diskpath, where entries is a
+		# list of ( name, isdir ) tuples.
+		now = time.time()
+		self._lock.acquire()
+		try:
+			self._dirs[diskpath] = ( now, dict(entries) )
+			for name, isdir in entries:
+				child = os.path.join(diskpath,name)
+				entry = self._stats.get(child)
+				if entry == None or ( self.ttl != None and now - entry[0] >= self.ttl ):
+					self._stats[child] = ( now, isdir )
+		finally:
+			self._lock.release()
+
 class FilePath(object):
 
+	# Directory walks create a FilePath for every entry they look at, so
+	# FilePaths are kept small and cheap: they use __slots__, diskpath
+	# and the hash are computed once, on first use, and adjpath() joins
+	# plain child names without normalizing the path.
+
+	__slots__ = ( "_path", "_base_path", "_diskpath", "_hash" )
+
+	# See StatCache, above.
+
+	statcache = None
+
+	# contentstamps is True for FilePath classes whose stamp() identifies
+	# a directory's contents without relying on mtimes, such as GitPath.
+
+	contentstamps = False
+
 	def grabfile(self):
 		# grabfile() is a simple helper method that grabs the contents
-		# of a typical portage configuration file, minus any lines
-		# beginning with "#", and returns each line as an item in a
-		# list. Newlines are stripped. This helper function looks at
-		# the repository base_path, not any overlays.  If a directory
-		# is specified, the contents of the directory are concatenated
-		# and returned.
-		out=[]	
-		if not self.exists():
-			return out
-		scan = set()
+		# of a typical portage configuration file, minus blank lines
+		# and any lines beginning with "#", and returns each line as an
+		# item in a list. Leading and trailing whitespace is stripped.
+		# This helper function looks at the repository base_path, not
+		# any overlays. If a directory is specified, the contents of
+		# the directory are concatenated and returned (see itergrab().)
+		return list(self.itergrab())
+
+	def itergrab(self,usemmap=False):
+
+		# Like grabfile(), but yields lines one at a time as they are
+		# read, so a caller looking for a single entry can stop early
+		# without reading the rest of the file. For a directory, the
+		# files in it are read in sorted order, skipping hidden files,
+		# subdirectories and backup files ending in "~".
+		#
+		# With usemmap=True, each file is memory-mapped and lines are
+		# read directly out of the mapping rather than through a file
+		# read buffer, which saves memory for large files such as
+		# use.local.desc.
+
 		if self.isdir():
-			scan = scan | self.contents()
+			for name, isdir in sorted(self.scandir()):
+				if isdir or name[0] == "." or name[-1] == "~":
+					continue
+				for line in self.adjpath(name)._itergrab(usemmap):
+					yield line
 		else:
-			scan.add(self)
-		for path in scan:
-			a=path.open("r")
-			for line in a:
-				if len(line) and line[0] != "#":
-					out.append(line[:-1])
+			for line in self._itergrab(usemmap):
+				yield line
+
+	def _itergrab(self,usemmap):
+		try:
+			a = self.open("r")
+		except IOError:
+			return
+		try:
+			if usemmap:
+				lines = _maplines(a)
+			else:
+				lines = a
+			for line in lines:
+				line = line.strip()
+				if line and line[0] != "#":
+					yield line
+		finally:
 			a.close()
-		return out
-	
+
 	def open(self, mode):
 		return open(self.diskpath, mode)
 
+	def atomicwrite(self,data):
+		# Replaces the file with data by writing a temporary file next to
+		# it and renaming it into place, so that concurrent readers see
+		# either the old file or the new one, never a partial file.
+		tmp = "%s.%d.tmp" % ( self.diskpath, os.getpid() )
+		a = open(tmp,"wb")
+		try:
+			a.write(data)
+		finally:
+			a.close()
+		os.rename(tmp,self.diskpath)
+		if self.statcache != None:
+			self.statcache.invalidate(self.diskpath)
+
+	def loadmarshal(self,version):
+		# Returns the dictionary stored in the file by savemarshal(), or
+		# None if the file is missing, unreadable or truncated, or was
+		# saved with a different version.
+		try:
+			a = self.open("rb")
+			try:
+				data = marshal.load(a)
+			finally:
+				a.close()
+		except (IOError, EOFError, ValueError, TypeError):
+			return None
+		if type(data) != dict or data.get("version") != version:
+			return None
+		return data
+
+	def savemarshal(self,version,data):
+		# Atomically writes dictionary data to the file in marshal format,
+		# tagged with version (see loadmarshal().)
+		data = dict(data)
+		data["version"] = version
+		self.atomicwrite(marshal.dumps(data))
+
 	def listdir(self):
+		if self.statcache != None:
+			return set(name for name, isdir in self.scandir())
 		return set(os.listdir(self.diskpath))
 
+	def scandir(self):
+		# Returns a list of (name, isdir) tuples for the contents of
+		# this directory.
+		diskpath = self.diskpath
+		if self.statcache != None:
+			out = self.statcache.scandir(diskpath)
+			if out != None:
+				return out
+		if _scandir == None:
+			out = []
+			for name in os.listdir(diskpath):
+				out.append(( name, os.path.isdir(os.path.join(diskpath,name)) ))
+		else:
+			out = [ ( entry.name, entry.is_dir() ) for entry in _scandir(diskpath) ]
+		if self.statcache != None:
+			self.statcache.fill(diskpath,out)
+		return out
+
 	def generate(self,cls,repository,func = None,filter = None):
 		files = self.listdir()
 		if func:
@@ -42,20 +314,59 @@ class FilePath(object):
 		return set( cls(file,repository=repository) for file in files )
 
 	def exists(self):
+		if self.statcache != None:
+			return self.statcache.exists(self.diskpath)
 		return os.path.exists(self.diskpath)
 
 	def isdir(self):
+		if self.statcache != None:
+			return self.statcache.isdir(self.diskpath)
 		return os.path.isdir(self.diskpath)
 
+	def stat(self):
+		# Returns the os.stat() result for this path, or None if the
+		# path does not exist.
+		if self.statcache != None:
+			return self.statcache.stat(self.diskpath)
+		try:
+			return os.stat(self.diskpath)
+		except OSError:
+			return None
+
+	def stamp(self):
+		# Returns a value that changes whenever the contents of this
+		# path change: the mtime and size of a file, or for a directory,
+		# of the directory and each file in it. Returns None if the path
+		# does not exist.
+		st = self.stat()
+		if st == None:
+			return None
+		out = [ ( st.st_mtime, st.st_size ) ]
+		if stat.S_ISDIR(st.st_mode):
+			for name in sorted(self.listdir()):
+				cst = self.adjpath(name).stat()
+				if cst != None:
+					out.append(( name, cst.st_mtime, cst.st_size ))
+		return tuple(out)
+
 	def __init__(self,path,base_path="/"):
 		self._path = path
 		self._base_path = base_path
+		self._diskpath = None
+		self._hash = None
 
 	def __eq__(self,other):
+		if not isinstance(other,FilePath):
+			return False
 		return self.diskpath == other.diskpath
 
+	def __ne__(self,other):
+		return not self.__eq__(other)
+
 	def __hash__(self):
-		return hash(self.diskpath)
+		if self._hash == None:
+			self._hash = hash(self.diskpath)
+		return self._hash
 
 	def __repr__(self):
 		return "FilePath(base_path=%s,%s)" % ( self.base_path, self.path )
@@ -73,14 +384,35 @@ class FilePath(object):
 		return self._base_path
 
 	def __add__(self,other):
+		if _plain(other):
+			return self._child(other)
 		return FilePath(os.path.join(self.path,other),base_path=self.base_path)
 
 	@property
 	def diskpath(self):
-		return os.path.normpath("%s/%s" % ( self.base_path,self.path))
+		if self._diskpath == None:
+			self._diskpath = os.path.normpath("%s/%s" % ( self.base_path,self.path))
+		return self._diskpath
+
+	def _child(self,name):
+		# Returns a FilePath for name inside this path, where name is a
+		# relative path that needs no normalization (see _plain().)
+		path = self._path
+		if path == "" or path == ".":
+			out = FilePath(name,base_path=self._base_path)
+		elif path[-1] == "/":
+			return FilePath(os.path.normpath(os.path.join(path, name)),base_path=self._base_path)
+		else:
+			out = FilePath(path + "/" + name,base_path=self._base_path)
+		if self._diskpath != None:
+			if self._diskpath == "/":
+				out._diskpath = "/" + name
+			else:
+				out._diskpath = self._diskpath + "/" + name
+		return out
 
 	def follow(self):
-		if not os.path.issym(self.diskpath):
+		if not os.path.islink(self.diskpath):
 			return self
 		else:
 			return self.adjpath("..").adjpath(os.readlink(self.diskpath))
@@ -100,22 +432,26 @@ class FilePath(object):
 		# foo.adjpath("/foo") would return an absolute path "/foo.
 		# The path root for the new path is the same as this path.
 
-		if os.path.isabs(change):
+		if _plain(change):
+			return self._child(change)
+		elif os.path.isabs(change):
 			return FilePath(change,base_path=self.base_path)
 		else:
 			return FilePath(os.path.normpath(os.path.join(self.path, change)),base_path=self.base_path)
 
 	def collapse_files(self,paths):
-		pass
+
+		# Reads each FilePath in paths, in order, and returns a dictionary
+		# mapping the first word of each line to a list of the remaining
+		# words. Later files override earlier ones. (See profile.py for
+		# the incremental collapse functions used for profile files.)
+
 		out = {}
-		for file in paths:
-			if self.exists(file):
-				f=self.open(file,"r")	
-				for line in f:
-					items = line.split()
-					if len(items) and item[0][0] != "#":
-						out[item[0]] = items[1:]
-				f.close()
+		for path in paths:
+			for line in path.grabfile():
+				items = line.split()
+				if len(items) and items[0][0] != "#":
+					out[items[0]] = items[1:]
 		return out
 
 
@@ -9,6 +9,8 @@
 # illegal, and may result in civil or criminal liability.
 
 import re
+import atexit
+import hashlib
 
 class ConfigFile(object):
 
@@ -79,87 +81,61 @@ class ConfigFile(object):
 		else:
 			return ""
 		
-	_valid_varname = re.compile("\A[a-zA-Z_]\w+$")
-		
 	def keys(self,recurse=True):
+		# Returns each defined variable name once, even if it is
+		# defined at several levels.
 		keys = []
 		if self.data == None:
 			self._read()
 		keys.extend(self.data.keys())
 		if recurse and self.parent:
-			keys.extend(self.parent.keys(recurse))
+			seen = set(keys)
+			for key in self.parent.keys(recurse):
+				if key not in seen:
+					seen.add(key)
+					keys.append(key)
 		return keys
 
-	def getExpansion(self,vardata):
-		pos = 0
-		while pos < len(vardata):
-			
-			# quickly scan for all normal text, and yield it
-			# back to the caller when we reach the end of
-			# string or the first special character:
-			
-			pos2 = pos 
-			while pos2 < len(vardata):
-				if vardata[pos2] in [ "$", "\\" ]:
-					break
-				else:	
-					pos2 += 1
-		
-			# return "normal" string data to caller:
-			if pos != pos2:
-				yield vardata[pos:pos2]
-
-			# update pos to reflect our current position:
+	def chain(self):
+		# Returns this ConfigFile and its parents, bottom-most parent
+		# first.
+		chain = []
+		cfg = self
+		while cfg != None:
+			if cfg in chain:
+				raise ValueError("%s is its own parent" % cfg)
+			chain.append(cfg)
+			cfg = cfg.parent
+		chain.reverse()
+		return chain
 
-			pos = pos2
+	def flatten(self):
+		# Returns a FlatConfig for this ConfigFile - see below.
+		return FlatConfig(self)
 
-			# At this point, we are either at end of string, or
-			# we have found a "special" character that requires
-			# further processing... if we're at end, stop:
+	def expand(self,parts,recurse=True):
 
-			if pos >= len(vardata):
-				break
+		# Expands a list of parts returned by tokenize(), looking up
+		# variables in this ConfigFile and (if recurse is True) its
+		# parents. Undefined variables expand to "".
 
-			if vardata[pos:pos+2] == "${":
-				# variable - scan for end...
-				pos2 = pos + 2
-				while vardata[pos2] != "}":
-					pos2 += 1
-					if pos2 >= len(vardata):
-						# unterminated variable
-						print "unterminated VAR"
-						return
-				varname = vardata[pos+2:pos2]
-				yield [varname]
-				pos = pos2 + 1
-			elif vardata[pos:pos+2] == "\\\\":
-				yield "\\\\"
-				pos += 2
-			elif vardata[pos:pos+2] == '\\"':
-				yield '"'
-				pos += 2
-			elif vardata[pos:pos+2] == '\\$':
-				yield '$'
-				pos += 2
-			else:
-				yield vardata[pos]
-				pos += 1
-
-	def expand_var(self,vardata,stack=[],recurse=True):
-		out = ""
-		for part in self.getExpansion(vardata):
-			if type(part) == type([]):
+		out = []
+		for part in parts:
+			if type(part) == tuple:
 				varname = part[0]
 				if varname in self.data:
-					out += self.expand_var(self.data[varname],stack[:].append(varname))
+					out.append(self.data[varname])
 				elif recurse and self.parent and self.parent.has_key(varname):
-					out += self.expand_var(self.parent[varname],stack[:].append(varname))
-				else:
-					continue
+					out.append(self.parent[varname])
 			else:
-				out += part
-		return out
-	
+				out.append(part)
+		return "".join(out)
+
+	def expand_var(self,vardata,recurse=True):
+		if self.data == None:
+			self._read()
+		return self.expand(tokenize(vardata),recurse)
+
 	def __contains__(self,key):
 		if self.data == None:
 			self._read()
@@ -180,63 +156,305 @@ class ConfigFile(object):
 
 	def _read(self):
 
-		a = open(self.path.diskpath,"r")
-		lines = a.readlines()
-		a.close()
-		
+		# Variables are expanded in the order they are defined, and the
+		# expanded value is stored. A reference to a variable always
+		# substitutes its already-expanded value, so FOO="${FOO} bar"
+		# refers to the previous value of FOO, and text produced by an
+		# escape such as "\${FOO}" is never expanded again. This means
+		# that variable references can't form a cycle.
+
 		self.data = {}
+		items, self.errors = parse_file(self.path)
+		for varname, parts in items:
+			self.data[varname] = self.expand(parts)
+
+_assignment = re.compile(r"^([^=]*)=(.*)$")
+_valid_varname = re.compile(r"\A[a-zA-Z_]\w*$")
+_token = re.compile(r'\$\{(\w+)\}|\\(["$\\])|([^$\\]+)|(.)',re.S)
+
+def tokenize(vardata):
+
+	# This is a single-pass tokenizer for variable data. It returns a list
+	# of parts, where each part is either a literal string or a 1-tuple
+	# containing the name of a variable to expand:
+	#
+	# >>> tokenize('${CFLAGS} -I\\"foo\\"')
+	# [('CFLAGS',), ' -I"foo"']
+	#
+	# Adjacent literal text is merged. "${" without a valid variable name
+	# and closing "}" is kept as literal text.
+
+	parts = []
+	text = []
+	for match in _token.finditer(vardata):
+		varname, escaped, literal, other = match.groups()
+		if varname != None:
+			if text:
+				parts.append("".join(text))
+				text = []
+			parts.append(( varname, ))
+		elif escaped != None:
+			text.append(escaped)
+		elif literal != None:
+			text.append(literal)
+		else:
+			text.append(other)
+	if text:
+		parts.append("".join(text))
+	return parts
 
-		lpos = 0
-		while lpos < len(lines):
-			line = lines[lpos][:-1].lstrip()
-			if line == "\n" or len(line) == 0 or line[0] == "#":
-				lpos += 1
-				continue
-			equals = line.find('=')
-			if equals == -1:
-				print "ERROR no variable def"
-				# TODO raise exception - no variable definition
-				pass
-			varname = line[0:equals]
-			
-			if line[equals:equals+2] != '="':
-				# single line variable with no quotes
-				self.data[varname] = self.expand_var(line[equals+1:])
-				lpos += 1
-				continue
-			
-			vardata = line[equals+2:]
-
-			if self._valid_varname.match(varname) == None:
-				# TODO raise exception - invalid variable name
-				print "invalid var name"
-				lpos += 1
-				continue
-
-			accum = ""
-			while vardata.rstrip()[-1] != '"':
-				# look at successive lines until trailing "'" is found:
-				# trailing backslash support:
-				if vardata[-1] == "\\":
-					vardata = vardata[:-1]
-				accum += vardata
-				lpos += 1
-				if lpos >= len(lines):
-					# TODO: error, no end quote, got to end of file
-					print "NO END QUOTE for",varname
-					pass
-
-				# for new vardata, remove trailing newline and any whitespace on the left, prepend a " "
-				# this ensures that the 'foo bar oni' example above has one space between each word...
-
-				vardata = " " + lines[lpos][:-1].lstrip()
-
-				# keep looking...
-			accum += vardata.rstrip()[:-1]
-
-			self.data[varname] = self.expand_var(accum)
-			lpos +=1
+def parse(contents,errors=None):
+
+	# Parses the contents of a configuration file, and returns a list of
+	# ( varname, parts ) tuples, in the order they are defined, where parts
+	# is the list returned by tokenize() for the variable data. If a list
+	# is passed as errors, a ( line number, message ) tuple is appended
+	# for each line that can't be parsed.
+
+	out = []
+	lines = contents.split("\n")
+	lpos = 0
+	while lpos < len(lines):
+		line = lines[lpos].lstrip()
+		lpos += 1
+		if len(line) == 0 or line[0] == "#":
+			continue
+		match = _assignment.match(line)
+		if match == None:
+			if errors != None:
+				errors.append(( lpos, "no variable definition" ))
+			continue
+		varname, vardata = match.groups()
+		if _valid_varname.match(varname) == None:
+			if errors != None:
+				errors.append(( lpos, "invalid variable name %s" % varname ))
+			continue
+		if vardata[:1] != '"':
+			# single line variable with no quotes
+			out.append(( varname, tokenize(vardata.rstrip()) ))
 			continue
+		vardata = vardata[1:]
+		accum = []
+		while vardata.rstrip()[-1:] != '"':
+			# look at successive lines until trailing '"' is found,
+			# with trailing backslash support:
+			if vardata[-1:] == "\\":
+				vardata = vardata[:-1]
+			accum.append(vardata)
+			if lpos >= len(lines):
+				break
+			# for new vardata, remove any whitespace on the left, prepend a " "
+			# this ensures that the 'foo bar oni' example above has one space between each word...
+			vardata = " " + lines[lpos].lstrip()
+			lpos += 1
+		else:
+			accum.append(vardata.rstrip()[:-1])
+			out.append(( varname, tokenize("".join(accum)) ))
+			continue
+		if errors != None:
+			errors.append(( lpos, "no end quote for %s" % varname ))
+	return out
+
+# Parsed files are cached by disk path, along with the file's stamp, so that
+# ConfigFiles for the same file with different parents share the parse.
+
+_parsed = {}
+
+class ParseCache(object):
+
+	# ParseCache is an optional, persistent cache of parse() results, so
+	# that a new process can skip parsing make.globals, make.conf and the
+	# profile make.defaults files if they haven't changed since the last
+	# process that parsed them. It is stored in a single marshal-format
+	# file, laid out like this:
+	#
+	# { "version" : 1, "files" : { diskpath : [ stamp, sha1, items, errors ] } }
+	#
+	# where items and errors are what parse() returned. An entry is used
+	# as-is if the file's stamp (mtime and size) is unchanged. Otherwise
+	# the file is read, and if its SHA1 matches, the parse is still reused
+	# (this covers a file that was touched or copied without being
+	# changed) and only the stamp is updated.
+	#
+	# Enable it like this:
+	#
+	# >>> use_parse_cache(FilePath("/var/cache/funports/config.cache"))
+	#
+	# after which parse_file() will consult it, and it is saved at exit.
+
+	version = 1
+
+	def __repr__(self):
+		return "ParseCache(%s)" % self.path.diskpath
+
+	def __init__(self,path):
+		# self.path is a FilePath pointing to the cache file itself.
+		self.path = path
+		self.dirty = False
+		self._files = None
+
+	def _load(self):
+		self._files = {}
+		data = self.path.loadmarshal(self.version)
+		if data != None:
+			self._files = data["files"]
+		elif self.path.exists():
+			# unreadable, truncated or old cache - start from scratch:
+			self.dirty = True
+
+	def parse(self,path,stamp):
+
+		# Returns a tuple of parse() results and errors for FilePath path,
+		# whose current stamp is stamp, parsing it only if neither the
+		# stamp nor the contents match the cached entry.
+
+		if self._files == None:
+			self._load()
+		entry = self._files.get(path.diskpath)
+		if entry != None and entry[0] == stamp:
+			return entry[2], entry[3]
+		a = path.open("r")
+		try:
+			contents = a.read()
+		finally:
+			a.close()
+		digest = hashlib.sha1(contents).digest()
+		if entry != None and entry[1] == digest:
+			entry[0] = stamp
+		else:
+			errors = []
+			entry = self._files[path.diskpath] = [ stamp, digest, parse(contents,errors), errors ]
+		self.dirty = True
+		return entry[2], entry[3]
+
+	def invalidate(self):
+		self._files = {}
+		self.dirty = True
+
+	def save(self):
+
+		# Writes the cache back to disk if anything changed, using a
+		# temporary file and a rename so that concurrent readers never
+		# see a partial cache (see FilePath.atomicwrite().)
+
+		if not self.dirty or self._files == None:
+			return
+		self.path.savemarshal(self.version,{ "files" : self._files })
+		self.dirty = False
+
+_parsecache = None
+
+def use_parse_cache(path):
+
+	# Makes parse_file() use a ParseCache stored at FilePath path, which
+	# is saved when the process exits. Pass None to stop using it.
+
+	global _parsecache
+	if _parsecache != None:
+		_parsecache.save()
+	if path != None:
+		_parsecache = ParseCache(path)
+	else:
+		_parsecache = None
+	return _parsecache
+
+def _save_parse_cache():
+	if _parsecache != None:
+		try:
+			_parsecache.save()
+		except (IOError, OSError):
+			pass
+
+atexit.register(_save_parse_cache)
+
+def parse_file(path):
+
+	# Returns a tuple of parse() results and errors for FilePath path,
+	# re-parsing the file only if it has changed since it was last parsed.
+
+	stamp = path.stamp()
+	cached = _parsed.get(path.diskpath)
+	if cached != None and cached[0] == stamp:
+		return cached[1:]
+	if _parsecache != None:
+		items, errors = _parsecache.parse(path,stamp)
+		cached = _parsed[path.diskpath] = ( stamp, items, errors )
+		return cached[1:]
+	a = path.open("r")
+	try:
+		contents = a.read()
+	finally:
+		a.close()
+	errors = []
+	cached = _parsed[path.diskpath] = ( stamp, parse(contents,errors), errors )
+	return cached[1:]
+
+class FlatConfig(object):
+
+	# A FlatConfig is a flattened view of a ConfigFile and all of its
+	# parents. Looking up a variable in a ConfigFile walks the parent
+	# chain, so instead, FlatConfig resolves the whole chain once into a
+	# single dictionary, where a variable defined by a child overrides the
+	# same variable defined by a parent. Reading a variable is then a
+	# single dict lookup:
+	#
+	# >>> flat = a.flatten()
+	# >>> flat["USE"]
+	#
+	# Call refresh() to check whether any file in the chain has changed.
+	# If one has, it is re-read, along with every ConfigFile above it
+	# (their values may have been expanded using the changed file,) and
+	# the dictionary is rebuilt.
+
+	def __repr__(self):
+		return "FlatConfig(%s)" % self.config
+
+	def __init__(self,config):
+		self.config = config
+		self._stamps = None
+		self._data = {}
+		self.refresh()
+
+	def refresh(self):
+
+		# Returns True if the flattened data was rebuilt.
+
+		chain = self.config.chain()
+		stamps = [ cfg.path.stamp() for cfg in chain ]
+		if stamps == self._stamps:
+			return False
+		if self._stamps != None:
+			pos = 0
+			while pos < len(chain) and pos < len(self._stamps) and stamps[pos] == self._stamps[pos]:
+				pos += 1
+			for cfg in chain[pos:]:
+				cfg.data = None
+		data = {}
+		for cfg in chain:
+			if cfg.data == None:
+				cfg._read()
+			data.update(cfg.data)
+		self._data = data
+		self._stamps = stamps
+		return True
+
+	def __getitem__(self,key):
+		return self._data.get(key,"")
+
+	def get(self,key,default=None):
+		return self._data.get(key,default)
+
+	def __contains__(self,key):
+		return key in self._data
+
+	def has_key(self,key):
+		return key in self._data
+
+	def keys(self):
+		return self._data.keys()
+
+	def items(self):
+		return self._data.items()
 
 if __name__ == "__main__":
 	from access import *
@@ -0,0 +1,320 @@
+#!/usr/bin/python2
+
+# Copyright 2010 Daniel Robbins, Funtoo Technologies, LLC.
+#
+# FUNTOO TECHNOLOGIES INTERNAL SOURCE CODE
+# ALPHA - DO NOT RELEASE - NOT FOR DISTRIBUTION
+#
+# The unauthorized reproduction or distribution of this copyrighted work is
+# illegal, and may result in civil or criminal liability.
+
+import os
+import re
+import json
+import urllib2
+
+from portsmod import *
+
+# This module implements the "contents" descriptor from
+# glep-0062-drobbins.txt. A descriptor maps each section of a repository to
+# where and how it is stored, so that each section can use the storage that
+# suits how it is accessed -- ebuild listings from disk, metadata from
+# SQLite, licenses fetched on demand:
+#
+# {
+#	"defaults" : { "format" : "pms-0" },
+#	"catpkg" : { "local" : "/%(cat)s/%(pkg)s", "format" : "classic" },
+#	"eclass" : { "local" : "/eclass" },
+#	"profiles" : { "local" : "/profiles" },
+#	"cache" : {
+#		"core" : { "local" : "/metadata/sqlite/core.sqlite", "format" : "funtoo/sqlite-1.0:pkgs",
+#			"remote" : "http://pkg.funtoo.org/%(repo)s/slurry", "protocol" : "changeset-slurry" },
+#		"desc" : { "local" : "/metadata/sqlite/desc.sqlite", "format" : "funtoo/sqlite-1.0:desc" }
+#	},
+#	"licenses" : { "remote" : "http://pkg.funtoo.org/%(repo)s/licenses/%(license)s", "protocol" : "HTTP-REST/raw-1.0" }
+# }
+#
+# The descriptor is read as strict JSON. Settings in "defaults" apply to
+# every section, nested sections such as "cache" are flattened to
+# "cache.core" and "cache.desc", and "%(repo)s" in a location expands to
+# the repository name (from profiles/repo_name.) Local locations are
+# relative to the repository root; the part of a local location from the
+# first "%(" on only describes the layout inside the section.
+#
+# Use it like this:
+#
+# >>> a = PortageRepository(FilePath("/usr/portage"),contents=FilePath("/usr/portage/metadata/contents.json"))
+# >>> a.getMetadata(PkgAtom("sys-apps/portage-2.1"))
+# >>> a.sections["licenses"].get("GPL-2")
+#
+# Sections that aren't mentioned in the descriptor keep their classic
+# layout. Each section is bound by the function registered for it in
+# binders, below, which raises ValueError for a format or protocol it
+# doesn't support; more can be registered.
+
+class ContentsDescriptor(object):
+
+	def __repr__(self):
+		return "ContentsDescriptor(%s)" % ",".join(sorted(self.sections.keys()))
+
+	def __init__(self,data):
+		# data is the decoded descriptor, a dictionary.
+		defaults = data.get("defaults",{})
+		self.sections = {}
+		for name, section in data.items():
+			if name in ( "defaults", "globals" ) or type(section) != dict:
+				continue
+			if "local" in section or "remote" in section or "path" in section:
+				self.sections[str(name)] = self._section(defaults,section)
+			else:
+				for sub, subsection in section.items():
+					if type(subsection) == dict:
+						self.sections["%s.%s" % ( name, sub )] = self._section(defaults,subsection)
+
+	def _section(self,defaults,section):
+		out = {}
+		for source in ( defaults, section ):
+			for key, value in source.items():
+				if type(value) == unicode:
+					value = value.encode("utf-8")
+				out[str(key)] = value
+		# "path" is an older spelling of "local":
+		if "path" in out and "local" not in out:
+			out["local"] = out["path"]
+		return out
+
+	@classmethod
+	def load(cls,path):
+		# Reads a descriptor from FilePath path.
+		a = path.open("r")
+		try:
+			return cls(json.load(a))
+		finally:
+			a.close()
+
+	def bind(self,repo):
+
+		# Binds the sections of PortageRepository repo to their backends.
+		# The cache is bound first, since binding ebuild listings to
+		# SQLite relies on it.
+
+		names = sorted(self.sections.keys(),key=lambda name: ( not name.startswith("cache"), name ))
+		for name in names:
+			binder = binders.get(name)
+			if binder == None:
+				binder = binders.get(name.split(".",1)[0])
+			if binder == None:
+				binder = bind_files
+			binder(repo,name,self.sections[name],self)
+
+def repo_name(repo):
+	# Returns the name of repository repo, from profiles/repo_name, or the
+	# name of its directory.
+	for line in repo.paths["profiles"].adjpath("repo_name").grabfile():
+		return line
+	return os.path.basename(repo.path.diskpath)
+
+def _expand(repo,location):
+	# Expands "%(repo)s" in location, leaving other variables alone.
+	vars = { "repo" : repo_name(repo) }
+	return re.sub(r"%\((\w+)\)s",lambda match: vars.get(match.group(1),match.group(0)),location)
+
+def local_path(repo,section):
+	# Returns the FilePath of the local location of section, or None.
+	local = section.get("local")
+	if local == None:
+		return None
+	local = _expand(repo,local).split("%(",1)[0].strip("/")
+	if not local:
+		return repo.path
+	return repo.path.adjpath(local)
+
+def _unsupported(name,section):
+	return ValueError("%s: unsupported %s" % ( name, section.get("protocol") or section.get("format") ))
+
+class LocalFiles(object):
+
+	# Backend for sections of plain files stored on disk, such as
+	# licenses or news items.
+
+	def __repr__(self):
+		return "LocalFiles(%s)" % self.path.diskpath
+
+	def __init__(self,path):
+		self.path = path
+
+	def list(self):
+		if not self.path.isdir():
+			return []
+		return sorted(self.path.listdir())
+
+	def get(self,name):
+		# Returns the contents of file name, or None if it doesn't exist.
+		try:
+			a = self.path.adjpath(name).open("r")
+		except IOError:
+			return None
+		try:
+			return a.read()
+		finally:
+			a.close()
+
+class RemoteFiles(object):
+
+	# Backend for sections of plain files fetched over HTTP when they are
+	# first requested ("HTTP-REST/raw-1.0".) url is a template with one
+	# variable (i.e. "%(license)s") for the file name. Fetched files are
+	# kept in memory.
+
+	def __repr__(self):
+		return "RemoteFiles(%s)" % self.url
+
+	def __init__(self,url,timeout=30):
+		self.url = url
+		self.timeout = timeout
+		self._files = {}
+
+	def list(self):
+		# Remote sections can't be listed, only fetched.
+		return sorted(self._files.keys())
+
+	def get(self,name):
+		if name in self._files:
+			return self._files[name]
+		url = re.sub(r"%\((\w+)\)s",lambda match: urllib2.quote(name),self.url)
+		try:
+			a = urllib2.urlopen(url,timeout=self.timeout)
+		except urllib2.HTTPError, e:
+			if e.code == 404:
+				return None
+			raise
+		try:
+			data = self._files[name] = a.read()
+		finally:
+			a.close()
+		return data
+
+def bind_files(repo,name,section,descriptor):
+
+	# Binds a section of plain files (news, licenses, advisories, and
+	# anything not otherwise known) to repo.sections[name].
+
+	path = local_path(repo,section)
+	if path != None:
+		repo.paths[name] = path
+		repo.sections[name] = LocalFiles(path)
+	elif section.get("protocol") in ( None, "HTTP-REST/raw-1.0" ) and "remote" in section:
+		repo.sections[name] = RemoteFiles(_expand(repo,section["remote"]))
+	else:
+		raise _unsupported(name,section)
+
+def bind_catpkg(repo,name,section,descriptor):
+
+	# Ebuild listings. The classic layout must be at the root of the
+	# repository. With an SQLite format, the ebuilds that exist are those
+	# in the metadata cache (see sqliterepo.py), so the cache must also
+	# be bound to SQLite. The same goes for a "HTTP-REST/bundle-1.0"
+	# remote, which also provides the eclasses. Eclasses and package
+	# files are then fetched on demand through a BundleBackend,
+	# repo.bundles, into a BlobCache (see fetcher.py) at "blobs" (default
+	# "/metadata/blobs") holding up to "blob-size" bytes.
+
+	fmt = section.get("format","pms-0")
+	if section.get("protocol") == "HTTP-REST/bundle-1.0" and "remote" in section:
+		import fetcher, slurry
+		if getattr(repo,"cache",None) == None:
+			raise ValueError("%s: the %s protocol requires an SQLite cache section" % ( name, section["protocol"] ))
+		blobs = local_path(repo,{ "local" : section.get("blobs","/metadata/blobs") })
+		url = _expand(repo,section["remote"]).split("%(",1)[0].rstrip("/")
+		repo.fetcher = fetcher.BundleFetcher(slurry.HTTPTransport(url),fetcher.BlobCache(blobs,int(section.get("blob-size",64*1024*1024))))
+		repo.bundles = fetcher.BundleBackend(repo,repo.fetcher)
+		adapter = repo.atom_map[EClassAtom]
+		adapter.has = repo.bundles.has_eclass
+		adapter.list = repo.bundles.eclass_list
+		adapter.iter = repo.bundles.eclass_iter
+		repo.getFile = repo.bundles.getFile
+		repo.getEbuild = repo.bundles.getEbuild
+		repo.getEClass = repo.bundles.getEClass
+		repo.materialize = repo.bundles.materialize
+		fmt = "funtoo/sqlite"
+	if fmt.startswith("funtoo/sqlite"):
+		if getattr(repo,"cache",None) == None:
+			raise ValueError("%s: the %s format requires an SQLite cache section" % ( name, fmt ))
+		# repo.backend was set up when the cache was bound:
+		for otype, prefix in ( ( CatPkg, "catpkg" ), ( PkgAtom, "pkgatom" ) ):
+			adapter = repo.atom_map[otype]
+			adapter.has = getattr(repo.backend,"has_" + prefix)
+			adapter.iter = getattr(repo.backend,prefix + "_iter")
+			adapter.list = getattr(repo.backend,prefix + "_list")
+	elif fmt in ( "pms-0", "classic" ) and "remote" not in section:
+		path = local_path(repo,section)
+		if path != None and path != repo.path:
+			raise ValueError("%s: ebuilds must be at the root of the repository" % name)
+	else:
+		raise _unsupported(name,section)
+
+def bind_eclass(repo,name,section,descriptor):
+	path = local_path(repo,section)
+	if path == None:
+		raise _unsupported(name,section)
+	repo.paths["eclass_dir"] = path
+
+def bind_profiles(repo,name,section,descriptor):
+	path = local_path(repo,section)
+	if path == None:
+		raise _unsupported(name,section)
+	repo.paths["profiles"] = path
+	for key in ( "categories", "info_pkgs", "info_vars" ):
+		repo.paths[key] = path.adjpath(key)
+
+def bind_cache(repo,name,section,descriptor):
+
+	# The metadata cache: either a classic flat list cache directory, or
+	# the SQLite core and desc bundles, which are bound together when the
+	# core section is bound. The SQLite bundles are reached through an
+	# SQLiteBackend, repo.backend (see sqliterepo.py.) An SQLite cache
+	# with a "changeset-slurry" remote also gets a SlurrySync as repo.sync
+	# (see slurry.py); the remote is the URL of the published slurry
+	# directory. There is no protocol for fetching a desc bundle, so it
+	# must have a local location.
+
+	fmt = section.get("format","pms-0")
+	if fmt in ( "pms-0", "classic", "flat" ):
+		path = local_path(repo,section)
+		if path == None:
+			raise _unsupported(name,section)
+		repo.paths["metadata_cache"] = path
+	elif fmt.startswith("funtoo/sqlite"):
+		if name == "cache.desc" or fmt.endswith(":desc"):
+			# bound along with the core bundle, which sorts first:
+			if local_path(repo,section) == None:
+				raise ValueError("%s: a desc bundle needs a local location" % name)
+			if getattr(repo,"cache",None) == None:
+				raise ValueError("%s: a desc bundle requires an SQLite core section" % name)
+			return
+		import sqliterepo
+		core = local_path(repo,section)
+		if core == None:
+			core = repo.path.adjpath("metadata/sqlite/core.sqlite")
+		desc = None
+		if "cache.desc" in descriptor.sections:
+			desc = local_path(repo,descriptor.sections["cache.desc"])
+		repo.cache = sqliterepo.SQLiteMetadataCache(core,desc)
+		repo.backend = sqliterepo.SQLiteBackend(repo,repo.cache)
+		repo._metadata = repo.backend.metadata
+		repo._store_metadata = repo.backend.store_metadata
+		repo._flush_metadata = repo.backend.flush_metadata
+		if section.get("protocol") == "changeset-slurry" and "remote" in section:
+			import slurry
+			repo.sync = slurry.SlurrySync(repo.cache,slurry.HTTPTransport(_expand(repo,section["remote"])))
+		elif "remote" in section:
+			raise _unsupported(name,section)
+	else:
+		raise _unsupported(name,section)
+
+binders = {
+	"catpkg" : bind_catpkg,
+	"eclass" : bind_eclass,
+	"profiles" : bind_profiles,
+	"cache" : bind_cache,
+}
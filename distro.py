@@ -1,6 +1,8 @@
-from ports import *
-from profile import PortageProfile
+from access import *
+from portsmod import *
+from profile import PortageProfile, ProfileSnapshot
 from configfile import ConfigFile
+from filter import MaskFilterGroup, UnmaskFilterGroup, MultiFilterGroup
 import os
 
 
@@ -22,15 +24,25 @@ class DistroAdapter(object):
 	# DistroAdapter will take care of caching where possible to reduce IO and
 	# computation when querying the tree.
 
-	def __init__(self,path):
+	# Specifying "snapshot=FilePath(...)" to __init__() will load the
+	# profile from a ProfileSnapshot (see profile.py) if it is still
+	# fresh, and otherwise resolve the profile and write a new snapshot.
+
+	def __init__(self,path,snapshot=None):
 
 		self.path = path
+		if snapshot != None:
+			self.snapshot = ProfileSnapshot(snapshot)
+		else:
+			self.snapshot = None
 		self._global_config = None
 		self._general_config = None
 		self._complete_config = None
+		self._flat_config = None
 		self._config = None
 		self._profile = None
 		self._portdir = None
+		self._filtergroup = None
 
 	@property 
 	def portdir(self):
@@ -72,7 +84,13 @@ class DistroAdapter(object):
 				profpath = self.path.adjpath("/etc/make.profile").follow()
 				profpath = profpath.rebase("profiles")
 
-			self._profile = PortageProfile(profpath)
+			if self.snapshot != None:
+				self._profile = self.snapshot.load(profpath)
+				if self._profile == None:
+					self._profile = PortageProfile(profpath)
+					self.snapshot.save(self._profile)
+			else:
+				self._profile = PortageProfile(profpath)
 
 		return self._profile
 
@@ -130,7 +148,7 @@ class DistroAdapter(object):
 			# children, including cascading profile make.defaults
 			# files...
 
-			cfglist = self.profile["make.defaults"] #returns list of files from cascaded profile
+			cfglist = list(self.profile["make.defaults"]) #returns list of files from cascaded profile
 			cfglist.append(self.path.adjpath("/etc/make.conf"))
 
 			# Create a stack of ConfigFile objects, each pointing
@@ -150,6 +168,45 @@ class DistroAdapter(object):
 
 		return self._complete_config
 
+	@property
+	def flat_config(self):
+
+		# This is a FlatConfig (see configfile.py) of the complete
+		# config above: every variable resolved into one dictionary,
+		# for code that reads lots of variables. Each access to this
+		# property checks whether any of the configuration files has
+		# changed, so if you are reading variables in a loop, hold on
+		# to the FlatConfig rather than accessing the property each
+		# time.
+
+		if self._flat_config == None:
+			self._flat_config = self.complete_config.flatten()
+		else:
+			self._flat_config.refresh()
+		return self._flat_config
+
+	@property
+	def filterGroup(self):
+
+		# This is a MultiFilterGroup that decides which packages are
+		# visible on this root filesystem. In order of precedence:
+		# /etc/portage/package.unmask, /etc/portage/package.mask, the
+		# package.unmask files of the cascaded profile, and finally
+		# the tree's profiles/package.mask followed by the package.mask
+		# files of the cascaded profile (these are read as one stack, so
+		# a profile can use "-<dep>" to drop an entry from the tree.)
+
+		if self._filtergroup == None:
+			masks = [ self.portdir.path.adjpath("profiles/package.mask") ]
+			masks.extend(self.profile["package.mask"])
+			self._filtergroup = MultiFilterGroup((
+				UnmaskFilterGroup(self.path.adjpath("/etc/portage/package.unmask")),
+				MaskFilterGroup(self.path.adjpath("/etc/portage/package.mask")),
+				UnmaskFilterGroup(self.profile["package.unmask"]),
+				MaskFilterGroup(masks)
+			))
+		return self._filtergroup
+
 
 if __name__ == "__main__":
 
@@ -177,17 +234,3 @@ if __name__ == "__main__":
 	print "============"
 	print
 	print a.portdir
-
-"""
-	@property
-	def filterGroup(self):
-		if self._filtergroup == None:
-			b=UnmaskFilterGroup("/etc/portage/package.unmask")
-			a=MaskFilterGroup("/etc/portage/package.mask")
-			d=UnmaskFilterGroup("/usr/portage/profiles/package.unmask")
-			c=MaskFilterGroup("/usr/portage/profiles/package.mask")
-			# recurse into profile.....
-		self._filtergroup=MultiFilterGroup((b,a,d,c))
-		return self._filtergroup
-
-"""
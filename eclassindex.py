@@ -0,0 +1,235 @@
+#!/usr/bin/python2
+
+# Copyright 2010 Daniel Robbins, Funtoo Technologies, LLC.
+#
+# FUNTOO TECHNOLOGIES INTERNAL SOURCE CODE
+# ALPHA - DO NOT RELEASE - NOT FOR DISTRIBUTION
+#
+# The unauthorized reproduction or distribution of this copyrighted work is
+# illegal, and may result in civil or criminal liability.
+
+import re
+
+from portsmod import *
+
+# EClassIndex records which eclasses each ebuild inherits (from the
+# INHERITED metadata) and which eclasses each eclass inherits (from the
+# "inherit" lines in the eclass itself), so that when some eclasses
+# change, the ebuilds whose metadata may be affected can be found without
+# looking at every ebuild in the tree:
+#
+# >>> idx = EClassIndex(repo,FilePath("/var/cache/funports/eclass.idx"))
+# >>> changed = idx.changed()
+# >>> MetadataRegenerator(repo,index=idx).run(idx.affected(changed))
+# >>> idx.refresh(changed)
+# >>> idx.save()
+#
+# Eclasses are resolved across the repository's eclass overlays, the same
+# way getRef() does, so an overlay eclass that starts or stops shadowing
+# one in the main tree counts as a change. The index is stored in a
+# single marshal-format file, laid out like this:
+#
+# { "version" : 1,
+#   "ebuilds" : { "cat/pf" : [ eclass, ... ] },
+#   "eclasses" : { eclass : [ diskpath, stamp, [ eclass, ... ] ] } }
+#
+# where each eclass entry records where the eclass was found, its stamp
+# at the time, and the eclasses it inherits.
+
+_inherit = re.compile(r"^\s*inherit\s+([^#;&|]*)",re.M)
+
+class EClassIndex(object):
+
+	version = 1
+
+	def __repr__(self):
+		return "EClassIndex(%s)" % self.repo
+
+	def __init__(self,repo,path=None):
+		# repo is the PortageRepository whose ebuilds are indexed. path
+		# is a FilePath for the index file; without it, the index is
+		# only kept in memory.
+		self.repo = repo
+		self.path = path
+		self.dirty = False
+		self._ebuilds = None
+
+	def _load(self):
+		self._ebuilds = {}
+		self._eclasses = {}
+		if self.path != None:
+			data = self.path.loadmarshal(self.version)
+			if data != None:
+				self._ebuilds = data["ebuilds"]
+				self._eclasses = data["eclasses"]
+			elif self.path.exists():
+				self.dirty = True
+		# reverse edges: eclass -> "cat/pf" keys, and eclass -> eclasses
+		# that inherit it.
+		self._users = {}
+		for key, eclasses in self._ebuilds.items():
+			for name in eclasses:
+				self._users.setdefault(name,set()).add(key)
+		self._link()
+
+	def _link(self):
+		self._children = {}
+		for name, entry in self._eclasses.items():
+			for parent in entry[2]:
+				self._children.setdefault(parent,set()).add(name)
+
+	def _check(self):
+		if self._ebuilds == None:
+			self._load()
+
+	def set(self,pkgatom,eclasses):
+
+		# Records that PkgAtom pkgatom inherits the eclasses in list
+		# eclasses (i.e. INHERITED.split()), or forgets pkgatom if
+		# eclasses is None.
+
+		self._check()
+		key = "%s/%s" % ( pkgatom.cat, pkgatom.pf )
+		for name in self._ebuilds.pop(key,[]):
+			users = self._users.get(name)
+			if users != None:
+				users.discard(key)
+		if eclasses != None:
+			self._ebuilds[key] = list(eclasses)
+			for name in eclasses:
+				self._users.setdefault(name,set()).add(key)
+		self.dirty = True
+
+	def build(self,recurse=False):
+
+		# Indexes the INHERITED metadata of every ebuild in the
+		# repository (including those of its overlays if recurse is
+		# True), then every eclass they use. Returns the number of
+		# ebuilds indexed.
+
+		self._check()
+		self._ebuilds = {}
+		self._users = {}
+		count = 0
+		for pkgatom in self.repo.iterList(PkgAtom,recurse=recurse):
+			if recurse:
+				data = self.repo.getMetadata(pkgatom,["INHERITED"])
+			else:
+				data = self.repo._metadata(pkgatom,["INHERITED"])
+			if data != None:
+				self.set(pkgatom,data["INHERITED"].split())
+				count += 1
+		self.refresh()
+		return count
+
+	def _resolve(self,name):
+		# Returns the FilePath of the eclass called name, as resolved
+		# across the eclass overlays, or None.
+		ref = self.repo.getRef(EClassAtom(name))
+		if ref == None:
+			return None
+		return ref.repo.paths["eclass_dir"].adjpath("%s.eclass" % name)
+
+	def _entry(self,name):
+		# Returns a fresh eclass entry for the eclass called name.
+		path = self._resolve(name)
+		if path == None:
+			return [ None, None, [] ]
+		inherits = []
+		try:
+			a = path.open("r")
+			try:
+				for match in _inherit.finditer(a.read()):
+					for parent in match.group(1).split():
+						if "$" not in parent and parent not in inherits:
+							inherits.append(parent)
+			finally:
+				a.close()
+		except IOError:
+			pass
+		return [ path.diskpath, path.stamp(), inherits ]
+
+	def refresh(self,names=None):
+
+		# Re-reads the eclasses in names (by default, every eclass used
+		# by an indexed ebuild or eclass), recording where each one is
+		# found, its stamp and what it inherits.
+
+		self._check()
+		if names == None:
+			names = set(self._users.keys()) | set(self._eclasses.keys())
+		todo = list(names)
+		seen = set()
+		while todo:
+			name = todo.pop()
+			if name in seen:
+				continue
+			seen.add(name)
+			entry = self._eclasses[name] = self._entry(name)
+			todo.extend(parent for parent in entry[2] if parent not in self._eclasses)
+		self._link()
+		self.dirty = True
+
+	def changed(self):
+
+		# Returns the names of eclasses that have changed since they were
+		# last refreshed: edited, added, removed, or now found in a
+		# different eclass overlay. This takes one lookup and stat() per
+		# eclass, not per ebuild.
+
+		self._check()
+		out = []
+		for name in set(self._users.keys()) | set(self._eclasses.keys()):
+			entry = self._eclasses.get(name)
+			path = self._resolve(name)
+			if path == None:
+				current = [ None, None ]
+			else:
+				current = [ path.diskpath, path.stamp() ]
+			if entry == None or entry[:2] != current:
+				out.append(name)
+		return sorted(out)
+
+	def inherits(self,name):
+		# Returns the eclasses that the eclass called name inherits.
+		self._check()
+		entry = self._eclasses.get(name)
+		if entry == None:
+			return []
+		return list(entry[2])
+
+	def inheritedBy(self,name):
+		# Returns the eclasses that inherit the eclass called name.
+		self._check()
+		return sorted(self._children.get(name,()))
+
+	def affected(self,names):
+
+		# Returns a list of the PkgAtoms whose metadata may be affected by
+		# a change to any of the eclasses in names: the ebuilds that
+		# inherit them, or inherit an eclass that inherits them, and so
+		# on. The cost is proportional to the number of eclasses and
+		# ebuilds involved.
+
+		self._check()
+		todo = list(names)
+		seen = set()
+		keys = set()
+		while todo:
+			name = todo.pop()
+			if name in seen:
+				continue
+			seen.add(name)
+			keys.update(self._users.get(name,()))
+			todo.extend(self._children.get(name,()))
+		return [ PkgAtom(key) for key in sorted(keys) ]
+
+	def save(self):
+
+		# Writes the index back to disk if anything changed (see
+		# FilePath.savemarshal().)
+
+		if not self.dirty or self.path == None or self._ebuilds == None:
+			return
+		self.path.savemarshal(self.version,{ "ebuilds" : self._ebuilds, "eclasses" : self._eclasses })
+		self.dirty = False
@@ -0,0 +1,401 @@
+#!/usr/bin/python2
+
+# Copyright 2010 Daniel Robbins, Funtoo Technologies, LLC.
+#
+# FUNTOO TECHNOLOGIES INTERNAL SOURCE CODE
+# ALPHA - DO NOT RELEASE - NOT FOR DISTRIBUTION
+#
+# The unauthorized reproduction or distribution of this copyrighted work is
+# illegal, and may result in civil or criminal liability.
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+from access import FilePath
+from portsmod import *
+from sqliterepo import SQLitePortageRepository
+
+# This module implements the rest of the immutable tree described at the end
+# of portsmod.py: a repository that ships only its metadata (see
+# sqliterepo.py) plus profiles, and fetches ebuilds, eclasses and the other
+# files of a package from a remote server the first time they are needed,
+# "just like a source file". This is the "HTTP-REST/bundle-1.0" protocol of
+# the catpkg section in glep-0062-drobbins.txt.
+#
+# The server side is a directory, served over HTTP as-is (or used directly
+# through a DirectoryTransport), laid out like this:
+#
+# <cat>/<pkg>/manifest	JSON { filename : sha1 } of every file of the package
+# eclass/manifest	JSON { "<name>.eclass" : sha1 }
+# objects/ab/cdef...	the file with SHA1 abcdef..., stored by content
+#
+# publish_bundles() creates it from a classic tree. Files are content
+# addressed, so the client keeps them in a BlobCache by SHA1, verifying
+# each one as it is fetched, and unchanged files are never fetched again
+# even after the tree is updated.
+#
+# Transports are objects with a fetch(name) method that returns the
+# contents of name, or None if it doesn't exist. DirectoryTransport and
+# HTTPTransport from slurry.py both work.
+
+class FetchError(Exception):
+	pass
+
+class BlobCache(object):
+
+	# BlobCache is a size-bounded, least-recently-used cache of files on
+	# disk, named by the SHA1 of their contents. Each file is verified
+	# against its SHA1 when it is added and when it is read, so a corrupt
+	# or truncated file is discarded rather than used. When the total size
+	# of the cache exceeds maxsize bytes, the least recently used files
+	# are removed. Use is recorded in each file's mtime, so the LRU order
+	# survives between processes.
+
+	def __repr__(self):
+		return "BlobCache(%s,maxsize=%s)" % ( self.path.diskpath, self.maxsize )
+
+	def __init__(self,path,maxsize=64*1024*1024):
+		# path is a FilePath pointing to the cache directory, which is
+		# created if necessary.
+		self.path = path
+		self.maxsize = maxsize
+		self._lock = threading.Lock()
+		self._index = None
+		self._size = 0
+
+	def _load(self):
+		# Builds the in-memory index of sha1 -> [ size, last used ].
+		self._index = {}
+		self._size = 0
+		if not self.path.isdir():
+			os.makedirs(self.path.diskpath)
+		for name in os.listdir(self.path.diskpath):
+			if len(name) != 40:
+				continue
+			try:
+				st = os.stat(os.path.join(self.path.diskpath,name))
+			except OSError:
+				continue
+			self._index[name] = [ st.st_size, st.st_mtime ]
+			self._size += st.st_size
+
+	def _file(self,sha1):
+		return os.path.join(self.path.diskpath,sha1)
+
+	def _forget(self,sha1):
+		entry = self._index.pop(sha1,None)
+		if entry != None:
+			self._size -= entry[0]
+		try:
+			os.unlink(self._file(sha1))
+		except OSError:
+			pass
+
+	def __contains__(self,sha1):
+		self._lock.acquire()
+		try:
+			if self._index == None:
+				self._load()
+			return sha1 in self._index
+		finally:
+			self._lock.release()
+
+	def __len__(self):
+		self._lock.acquire()
+		try:
+			if self._index == None:
+				self._load()
+			return len(self._index)
+		finally:
+			self._lock.release()
+
+	@property
+	def size(self):
+		self._lock.acquire()
+		try:
+			if self._index == None:
+				self._load()
+			return self._size
+		finally:
+			self._lock.release()
+
+	def get(self,sha1):
+
+		# Returns the contents of the file with SHA1 sha1, or None if it
+		# isn't cached (or fails verification.)
+
+		self._lock.acquire()
+		try:
+			if self._index == None:
+				self._load()
+			if sha1 not in self._index:
+				return None
+			try:
+				a = open(self._file(sha1),"rb")
+				try:
+					data = a.read()
+				finally:
+					a.close()
+			except IOError:
+				data = None
+			if data == None or hashlib.sha1(data).hexdigest() != sha1:
+				self._forget(sha1)
+				return None
+			now = time.time()
+			self._index[sha1][1] = now
+			try:
+				os.utime(self._file(sha1),( now, now ))
+			except OSError:
+				pass
+			return data
+		finally:
+			self._lock.release()
+
+	def put(self,sha1,data):
+
+		# Adds data to the cache under sha1, raising FetchError if the
+		# SHA1 of data doesn't match. Files larger than the whole cache
+		# are not stored.
+
+		if hashlib.sha1(data).hexdigest() != sha1:
+			raise FetchError("SHA1 mismatch for %s" % sha1)
+		self._lock.acquire()
+		try:
+			if self._index == None:
+				self._load()
+			if sha1 in self._index or len(data) > self.maxsize:
+				return
+			self.path.adjpath(sha1).atomicwrite(data)
+			self._index[sha1] = [ len(data), time.time() ]
+			self._size += len(data)
+			self._evict()
+		finally:
+			self._lock.release()
+
+	def _evict(self):
+		if self._size <= self.maxsize:
+			return
+		for sha1, entry in sorted(self._index.items(),key=lambda item: item[1][1]):
+			self._forget(sha1)
+			if self._size <= self.maxsize:
+				return
+
+class BundleFetcher(object):
+
+	# BundleFetcher fetches the files of packages and eclasses through a
+	# transport, using a BlobCache. Manifests are fetched once per
+	# BundleFetcher; call invalidate() after the tree has been updated.
+
+	def __repr__(self):
+		return "BundleFetcher(%s,%s)" % ( self.transport, self.blobs )
+
+	def __init__(self,transport,blobs):
+		self.transport = transport
+		self.blobs = blobs
+		self._manifests = {}
+
+	def invalidate(self):
+		self._manifests = {}
+
+	def manifest(self,key):
+
+		# Returns the manifest for key (i.e. "sys-apps/portage" or
+		# "eclass") as a dictionary of filename -> sha1, or an empty
+		# dictionary if there is none.
+
+		manifest = self._manifests.get(key)
+		if manifest == None:
+			data = self.transport.fetch("%s/manifest" % key)
+			if data == None:
+				manifest = {}
+			else:
+				manifest = dict(( str(name), str(sha1) ) for name, sha1 in json.loads(data).items())
+			self._manifests[key] = manifest
+		return manifest
+
+	def blob(self,sha1):
+		# Returns the file with SHA1 sha1, fetching it if it isn't cached.
+		data = self.blobs.get(sha1)
+		if data == None:
+			data = self.transport.fetch("objects/%s/%s" % ( sha1[:2], sha1[2:] ))
+			if data == None:
+				raise FetchError("object %s not found on %s" % ( sha1, self.transport ))
+			self.blobs.put(sha1,data)
+		return data
+
+	def get(self,key,name):
+		# Returns the contents of file name from manifest key, or None if
+		# it isn't in the manifest.
+		sha1 = self.manifest(key).get(name)
+		if sha1 == None:
+			return None
+		return self.blob(sha1)
+
+	def materialize(self,key,dest):
+
+		# Writes every file of manifest key below FilePath dest (as a
+		# package directory, for ebuild.sh), and returns dest. Names
+		# come from the server, so FetchError is raised before anything
+		# is written if any of them would land outside dest.
+
+		manifest = self.manifest(key)
+		for name in manifest.keys():
+			parts = name.split("/")
+			if name.startswith("/") or "" in parts or "." in parts or ".." in parts:
+				raise FetchError("bad file name in manifest %s: %r" % ( key, name ))
+		for name, sha1 in sorted(manifest.items()):
+			path = dest.adjpath(name)
+			parent = os.path.dirname(path.diskpath)
+			if not os.path.isdir(parent):
+				os.makedirs(parent)
+			a = open(path.diskpath,"wb")
+			try:
+				a.write(self.blob(sha1))
+			finally:
+				a.close()
+		return dest
+
+class BundleBackend(object):
+
+	# BundleBackend answers eclass lookups for a PortageRepository from
+	# the eclass manifest of a BundleFetcher, and fetches ebuilds, eclasses
+	# and package files on demand. It is used by RemotePortageRepository,
+	# below, and when a contents descriptor binds the catpkg section to
+	# the "HTTP-REST/bundle-1.0" protocol (see contents.py.)
+
+	def __repr__(self):
+		return "BundleBackend(%s)" % self.fetcher
+
+	def __init__(self,repo,fetcher):
+		self.repo = repo
+		self.fetcher = fetcher
+
+	def has_eclass(self,arg,**args):
+		if "%s.eclass" % arg.atom in self.fetcher.manifest("eclass"):
+			return self.repo._eclass_path(arg)
+
+	def eclass_list(self):
+		return [ EClassAtom(name[:-7]) for name in self.fetcher.manifest("eclass").keys() if name[-7:] == ".eclass" ]
+
+	def eclass_iter(self,eclasses=None):
+		if eclasses == None:
+			for eclass in self.eclass_list():
+				yield eclass
+			return
+		for eclass in eclasses:
+			if not isinstance(eclass,EClassAtom):
+				eclass = EClassAtom(eclass)
+			if self.has_eclass(eclass) != None:
+				yield eclass
+
+	def getFile(self,catpkg,name):
+		# Returns the contents of file name (i.e. "metadata.xml" or
+		# "files/foo.patch") of CatPkg catpkg, or None.
+		return self.fetcher.get(catpkg.catpkg,name)
+
+	def getEbuild(self,pkgatom):
+		return self.fetcher.get("%s/%s" % ( pkgatom.cat, pkgatom.p ),"%s.ebuild" % pkgatom.pf)
+
+	def getEClass(self,eclass):
+		return self.fetcher.get("eclass","%s.eclass" % eclass.atom)
+
+	def materialize(self,catpkg,dest):
+		# Writes the package directory of CatPkg catpkg to FilePath dest.
+		return self.fetcher.materialize(catpkg.catpkg,dest)
+
+class RemotePortageRepository(SQLitePortageRepository):
+
+	# A PortageRepository whose ebuild listings and metadata come from the
+	# SQLite metadata bundles, and whose ebuilds, eclasses and other
+	# package files are fetched on demand:
+	#
+	# >>> fetcher = BundleFetcher(HTTPTransport("http://pkg.funtoo.org/funtoo"),BlobCache(FilePath("/var/cache/funports/blobs")))
+	# >>> a = RemotePortageRepository(FilePath("/usr/portage"),fetcher=fetcher)
+	# >>> a.getEbuild(PkgAtom("sys-apps/portage-2.1"))
+	#
+	# Only profiles and the metadata bundles need to be present locally.
+
+	def __repr__(self):
+		return "RemotePortageRepository(%s)" % self.path.diskpath
+
+	def __init__(self,path,**args):
+		self.fetcher = args["fetcher"]
+		self.bundles = BundleBackend(self,self.fetcher)
+		SQLitePortageRepository.__init__(self,path,**args)
+
+	def _has_eclass(self,arg,**args):
+		return self.bundles.has_eclass(arg)
+
+	def _eclass_list(self):
+		return self.bundles.eclass_list()
+
+	def getFile(self,catpkg,name):
+		return self.bundles.getFile(catpkg,name)
+
+	def getEbuild(self,pkgatom):
+		return self.bundles.getEbuild(pkgatom)
+
+	def getEClass(self,eclass):
+		return self.bundles.getEClass(eclass)
+
+	def materialize(self,catpkg,dest):
+		return self.bundles.materialize(catpkg,dest)
+
+def publish_bundles(repo,dest):
+
+	# Publishes the ebuilds and eclasses of classic PortageRepository
+	# repo (not including overlays) to FilePath dest, in the layout
+	# described at the top of this file. Returns the number of objects
+	# written; objects that already exist are skipped.
+
+	written = [ 0 ]
+
+	def store(path):
+		a = path.open("rb")
+		try:
+			data = a.read()
+		finally:
+			a.close()
+		sha1 = hashlib.sha1(data).hexdigest()
+		obj = dest.adjpath("objects/%s/%s" % ( sha1[:2], sha1[2:] ))
+		if not obj.exists():
+			write(obj,data)
+			written[0] += 1
+		return sha1
+
+	def write(path,data):
+		parent = os.path.dirname(path.diskpath)
+		if not os.path.isdir(parent):
+			os.makedirs(parent)
+		path.atomicwrite(data)
+
+	def walk(path,prefix=""):
+		for name, isdir in sorted(path.scandir()):
+			if isdir:
+				for item in walk(path.adjpath(name),prefix + name + "/"):
+					yield item
+			else:
+				yield prefix + name, path.adjpath(name)
+
+	for catpkg in repo.iterList(CatPkg,recurse=False):
+		pkgdir = repo.path.adjpath(catpkg.catpkg)
+		manifest = dict(( name, store(path) ) for name, path in walk(pkgdir))
+		write(dest.adjpath("%s/manifest" % catpkg.catpkg),json.dumps(manifest,indent=1,sort_keys=True))
+	eclass_dir = repo.paths["eclass_dir"]
+	manifest = {}
+	if eclass_dir.isdir():
+		for name, isdir in eclass_dir.scandir():
+			if not isdir and name[-7:] == ".eclass":
+				manifest[name] = store(eclass_dir.adjpath(name))
+	write(dest.adjpath("eclass/manifest"),json.dumps(manifest,indent=1,sort_keys=True))
+	return written[0]
+
+if __name__ == "__main__":
+	import sys
+	if len(sys.argv) != 3:
+		print "usage: fetcher.py <tree> <dest>"
+		sys.exit(1)
+	print publish_bundles(PortageRepository(FilePath(os.path.abspath(sys.argv[1]))),FilePath(os.path.abspath(sys.argv[2]))), "objects written"
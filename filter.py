@@ -1,26 +1,297 @@
+import time
 
-class PkgAtomFilter(object):
+from portsmod import PkgAtomFilter
+from profile import collapse_incremental
 
-	# Generic object
+# This module implements package masking. package.mask and package.unmask
+# entries are compiled into PkgAtomFilters once, when they are added to a
+# FilterGroup, and the FilterGroup indexes them by catpkg. Testing an atom
+# then costs one dict lookup plus the handful of filters that apply to
+# that atom's catpkg, rather than a scan of every mask entry.
 
-class Level1PkgAtomFilter(object):
+class Level1PkgAtomFilter(PkgAtomFilter):
 
 	# Level1 means the filter can be applied based on version alone (no SLOT or other metadata)
 	# and does not require a repository reference. Faster and simpler.
 
-class Level2PkgAtomFilter(object):
+	def __init__(self,depstring):
+		PkgAtomFilter.__init__(self,depstring)
+		if self.slot != None or self.repo != None:
+			raise ValueError("%s requires slot or repository metadata" % depstring)
+
+class Level2PkgAtomFilter(PkgAtomFilter):
 
 	# Level2 means the filter can be applied but requires accessing metadata and/or Distro root
 	# to look at distro-specific configuration. Slower and more complex.
 
+	# slotfunc is a callable that returns the slot of a PkgAtom (typically
+	# by looking at repository metadata), or None if it is unknown. It is
+	# only called for atoms that don't carry slot key data.
+
+	def __init__(self,depstring,slotfunc=None):
+		PkgAtomFilter.__init__(self,depstring)
+		self.slotfunc = slotfunc
+
+	def slotOf(self,atom):
+		slot = atom.keys.get("slot")
+		if slot == None and self.slotfunc != None:
+			slot = self.slotfunc(atom)
+		return slot
+
+def compile_filter(depstring,slotfunc=None):
+
+	# Returns a Level1PkgAtomFilter or a Level2PkgAtomFilter for depstring,
+	# depending on whether it needs slot or repository metadata.
+
+	if ":" in depstring:
+		return Level2PkgAtomFilter(depstring,slotfunc)
+	return Level1PkgAtomFilter(depstring)
+
 class FilterGroup(object):
-	
+
 	# a collection of filters, such as from a package.mask file. Can also be heirarchically linked
 	# with other filters.
 
+	# Use it like this:
+	#
+	# >>> g = FilterGroup(FilePath("/usr/portage/profiles/package.mask").grabfile())
+	# >>> visible, masked = g.apply(repo.getList(PkgAtom,[CatPkg("sys-apps/portage")]))
+	#
+	# Invalid entries are skipped, and recorded in self.invalid.
+
+	# self.mask specifies what a match means when the group is stacked in a
+	# MultiFilterGroup: True for "masked", False for "unmasked".
+
+	mask = True
+
+	def __repr__(self):
+		return "FilterGroup(%s filters)" % len(self)
+
+	def __init__(self,depstrings=None,slotfunc=None):
+		self.slotfunc = slotfunc
+		self.clear()
+		if depstrings != None:
+			for depstring in depstrings:
+				self.add(depstring)
+
+	def clear(self):
+		self.invalid = []
+		self._len = 0
+		self._index = {}
+
+	def catpkgs(self):
+		# Returns the ( cat, p ) keys of all catpkgs with filters.
+		return set(self._index.keys())
+
+	def reload(self):
+		# Groups that are read from files override this to re-read them if
+		# they have changed. Returns None if nothing changed, otherwise the
+		# set of ( cat, p ) keys whose filters may have changed.
+		return None
+
+	def __len__(self):
+		return self._len
+
+	def add(self,depstring):
+
+		# Compiles depstring and adds it to the group. Blank lines and
+		# comments are ignored. Returns the new filter, or None.
+
+		depstring = depstring.strip()
+		if not depstring or depstring[0] == "#":
+			return None
+		try:
+			filter = compile_filter(depstring,self.slotfunc)
+		except ValueError:
+			self.invalid.append(depstring)
+			return None
+		key = ( filter.cat, filter.p )
+		if key in self._index:
+			self._index[key].append(filter)
+		else:
+			self._index[key] = [ filter ]
+		self._len += 1
+		return filter
+
+	def filters(self,catpkg):
+		# Returns the list of filters that apply to catpkg (i.e.
+		# "sys-apps/portage".)
+		return self._index.get(tuple(catpkg.split("/",1)),[])
+
+	def match(self,atom):
+
+		# Returns True if any filter in this group matches atom.
+
+		filters = self._index.get(( atom.cat, atom.p ))
+		if filters == None:
+			return False
+		for filter in filters:
+			if filter.match(atom):
+				return True
+		return False
+
+	def apply(self,pkgatomset):
+
+		# Like PkgAtomFilter.apply(), returns a tuple of two sets: the
+		# visible (not matched) and masked (matched) PkgAtoms.
+
+		visible = set()
+		masked = set()
+		for atom in pkgatomset:
+			if self.match(atom):
+				masked.add(atom)
+			else:
+				visible.add(atom)
+		return visible, masked
+
+class FileFilterGroup(FilterGroup):
+
+	# A FilterGroup read from one or more files (or directories of files,)
+	# such as the package.mask files of a cascaded profile. Files are read
+	# in order, and as with other incremental profile files, an entry of
+	# "-<dep>" removes an identical <dep> added by an earlier file, and
+	# "-*" removes everything added so far (see profile.py.)
+
+	def __repr__(self):
+		return "%s(%s)" % ( self.__class__.__name__, ",".join(path.diskpath for path in self.paths) )
+
+	def __init__(self,paths,slotfunc=None):
+		# paths is a FilePath or a list of FilePaths.
+		if not isinstance(paths,(list,tuple)):
+			paths = [ paths ]
+		self.paths = list(paths)
+		FilterGroup.__init__(self,slotfunc=slotfunc)
+		self._stamp = None
+		self.load()
+
+	def stamp(self):
+
+		# Returns the current FilePath.stamp() of every file that this
+		# group reads. Missing files are included, so that creating one is
+		# noticed too.
+
+		return [ ( path.diskpath, path.stamp() ) for path in self.paths ]
+
+	def load(self):
+		self._stamp = self.stamp()
+		self.clear()
+		for dep in collapse_incremental(self.paths):
+			self.add(dep)
+
+	def reload(self):
+		if self.stamp() == self._stamp:
+			return None
+		old = self.catpkgs()
+		self.load()
+		return old | self.catpkgs()
+
+class MaskFilterGroup(FileFilterGroup):
+
+	# package.mask: matching atoms are masked.
+
+	mask = True
+
+class UnmaskFilterGroup(FileFilterGroup):
+
+	# package.unmask: matching atoms are unmasked.
+
+	mask = False
+
 class MultiFilterGroup(object):
 
-class MaskFilterGroup(object):
+	# A MultiFilterGroup stacks several FilterGroups, highest precedence
+	# first. The visibility of an atom is decided by the first group with a
+	# matching filter -- an UnmaskFilterGroup makes the atom visible, a
+	# MaskFilterGroup masks it -- and atoms not matched by any group are
+	# visible. For example, with:
+	#
+	# MultiFilterGroup(( UnmaskFilterGroup(user_unmask), MaskFilterGroup(user_mask), MaskFilterGroup(profile_masks) ))
+	#
+	# /etc/portage/package.unmask overrides both mask files, and
+	# /etc/portage/package.mask masks atoms regardless of the profile.
+	#
+	# Visibility is checked for every candidate during dependency
+	# resolution, so results are memoized per catpkg: the first check of a
+	# catpkg collects the filters from every group that apply to it, and
+	# the result for each atom is cached. Every self.interval seconds, a
+	# check will first stat the underlying mask files; if one of them has
+	# changed, that group is re-read and only the cached results for the
+	# catpkgs it affects are thrown away. Call refresh() to check
+	# immediately.
+
+	def __repr__(self):
+		return "MultiFilterGroup(%s)" % ",".join(repr(group) for group in self.groups)
+
+	def __init__(self,groups,interval=2):
+		self.groups = list(groups)
+		self.interval = interval
+		self._checked = time.time()
+		self._cache = {}
+
+	def refresh(self):
+
+		# Re-reads any groups whose files have changed, and invalidates the
+		# affected cache entries. Returns True if anything changed.
+
+		self._checked = time.time()
+		changed = False
+		for group in self.groups:
+			keys = group.reload()
+			if keys == None:
+				continue
+			changed = True
+			for key in keys:
+				if key in self._cache:
+					del self._cache[key]
+		return changed
+
+	def invalidate(self):
+		self._cache = {}
+
+	def _entry(self,key):
+		entry = self._cache.get(key)
+		if entry == None:
+			chain = []
+			for group in self.groups:
+				filters = group._index.get(key)
+				if filters != None:
+					chain.append(( group.mask, filters ))
+			entry = self._cache[key] = ( chain, {} )
+		return entry
+
+	def visible(self,atom):
+
+		# Returns True if atom is visible (not masked).
+
+		if time.time() - self._checked >= self.interval:
+			self.refresh()
+		chain, results = self._entry(( atom.cat, atom.p ))
+		if not chain:
+			return True
+		result = results.get(atom)
+		if result == None:
+			result = True
+			for mask, filters in chain:
+				for filter in filters:
+					if filter.match(atom):
+						result = not mask
+						break
+				else:
+					continue
+				break
+			results[atom] = result
+		return result
+
+	def apply(self,pkgatomset):
 
-class UnmaskFilterGroup(object):
+		# Returns a tuple of two sets: the visible and masked PkgAtoms
+		# from pkgatomset.
 
+		visible = set()
+		masked = set()
+		for atom in pkgatomset:
+			if self.visible(atom):
+				visible.add(atom)
+			else:
+				masked.add(atom)
+		return visible, masked
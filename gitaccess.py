@@ -0,0 +1,613 @@
+#!/usr/bin/python2
+
+# Copyright 2010 Daniel Robbins, Funtoo Technologies, LLC.
+#
+# FUNTOO TECHNOLOGIES INTERNAL SOURCE CODE
+# ALPHA - DO NOT RELEASE - NOT FOR DISTRIBUTION
+#
+# The unauthorized reproduction or distribution of this copyrighted work is
+# illegal, and may result in civil or criminal liability.
+
+import os
+import mmap
+import stat
+import zlib
+import struct
+import threading
+from StringIO import StringIO
+
+from access import FilePath
+
+# This module lets a PortageRepository run directly against a git repository
+# (typically a bare one), at any commit, without a checkout. GitObjectStore
+# reads objects straight out of the repository's object database -- loose
+# objects as well as packfiles and their .idx indexes, including deltified
+# objects -- and GitPath is a FilePath whose directory listings and file
+# contents come from git tree and blob objects:
+#
+# >>> store = GitObjectStore(FilePath("/var/git/portage.git"))
+# >>> a = PortageRepository(GitPath(store,"HEAD"))
+# >>> a.getList(PkgAtom,[CatPkg("sys-apps/portage")])
+#
+# Any commit-ish that names a commit can be used in place of "HEAD": a
+# branch or tag name, a full ref such as "refs/heads/master", or a full
+# 40-digit SHA1. Parsed trees are cached in memory, so after the first look
+# at a directory, listing it or checking whether something exists in it
+# doesn't touch the filesystem at all.
+
+_types = { 1 : "commit", 2 : "tree", 3 : "blob", 4 : "tag" }
+_OFS_DELTA = 6
+_REF_DELTA = 7
+
+class GitError(Exception):
+	pass
+
+class GitPack(object):
+
+	# A single packfile and its index. Both are memory-mapped, so that
+	# objects can be read by several threads at once (DirectoryScanner
+	# may be reading directories in parallel.)
+
+	def __repr__(self):
+		return "GitPack(%s)" % self.path
+
+	def __init__(self,path):
+		# path is the disk path of the pack, minus ".pack" or ".idx".
+		self.path = path
+		self.idx = self._map(path + ".idx")
+		self.pack = self._map(path + ".pack")
+		if self.pack[:4] != "PACK":
+			raise GitError("%s.pack is not a packfile" % path)
+		if self.idx[:4] == "\377tOc":
+			if struct.unpack(">I",self.idx[4:8])[0] != 2:
+				raise GitError("%s.idx: unsupported index version" % path)
+			self.version = 2
+			self.fanout = 8
+		else:
+			self.version = 1
+			self.fanout = 0
+		self.count = struct.unpack(">I",self.idx[self.fanout+1020:self.fanout+1024])[0]
+
+	def _map(self,diskpath):
+		a = open(diskpath,"rb")
+		try:
+			return mmap.mmap(a.fileno(),0,access=mmap.ACCESS_READ)
+		finally:
+			a.close()
+
+	def _sha(self,pos):
+		if self.version == 2:
+			start = self.fanout + 1024 + pos * 20
+		else:
+			start = 1024 + pos * 24 + 4
+		return self.idx[start:start+20]
+
+	def offset(self,binsha):
+
+		# Returns the offset of the object with binary SHA1 binsha in the
+		# packfile, or None if it isn't in this pack. The fanout table
+		# narrows the search to objects with the same first byte, and the
+		# rest is a binary search of the sorted SHA1 table.
+
+		first = ord(binsha[0])
+		if first == 0:
+			lo = 0
+		else:
+			lo = struct.unpack(">I",self.idx[self.fanout+(first-1)*4:self.fanout+first*4])[0]
+		hi = struct.unpack(">I",self.idx[self.fanout+first*4:self.fanout+first*4+4])[0]
+		while lo < hi:
+			mid = ( lo + hi ) // 2
+			sha = self._sha(mid)
+			if sha < binsha:
+				lo = mid + 1
+			elif sha > binsha:
+				hi = mid
+			else:
+				return self._offset(mid)
+		return None
+
+	def _offset(self,pos):
+		if self.version == 1:
+			start = 1024 + pos * 24
+			return struct.unpack(">I",self.idx[start:start+4])[0]
+		start = self.fanout + 1024 + self.count * 24 + pos * 4
+		offset = struct.unpack(">I",self.idx[start:start+4])[0]
+		if offset & 0x80000000:
+			# index into the table of 8-byte offsets, for packs over 2GB:
+			start = self.fanout + 1024 + self.count * 28 + ( offset & 0x7fffffff ) * 8
+			offset = struct.unpack(">Q",self.idx[start:start+8])[0]
+		return offset
+
+	def header(self,offset):
+
+		# Returns the ( type number, size, data offset ) of the object at
+		# offset. For deltas, the size is that of the delta data.
+
+		pack = self.pack
+		byte = ord(pack[offset])
+		offset += 1
+		otype = ( byte >> 4 ) & 7
+		size = byte & 15
+		shift = 4
+		while byte & 0x80:
+			byte = ord(pack[offset])
+			offset += 1
+			size |= ( byte & 0x7f ) << shift
+			shift += 7
+		return otype, size, offset
+
+	def inflate(self,offset,size):
+		# Returns size bytes of zlib-compressed data from offset.
+		d = zlib.decompressobj()
+		out = []
+		got = 0
+		chunk = max(size,4096)
+		while got < size:
+			data = self.pack[offset:offset+chunk]
+			if not data:
+				raise GitError("%s.pack: truncated object" % self.path)
+			data = d.decompress(data)
+			got += len(data)
+			out.append(data)
+			if d.unused_data:
+				break
+			offset += chunk
+		out = "".join(out)
+		if len(out) != size:
+			raise GitError("%s.pack: corrupt object" % self.path)
+		return out
+
+	def inflate_head(self,offset,size):
+		# Returns the first size bytes of zlib-compressed data from
+		# offset (or fewer, if the data is shorter), without inflating
+		# the rest.
+		d = zlib.decompressobj()
+		out = []
+		got = 0
+		while got < size:
+			data = self.pack[offset:offset+1024]
+			if not data:
+				break
+			data = d.decompress(data,size-got)
+			got += len(data)
+			out.append(data)
+			if d.unconsumed_tail or d.unused_data:
+				break
+			offset += 1024
+		return "".join(out)
+
+	def delta_base(self,otype,offset):
+		# For a delta object whose data starts at offset, returns the
+		# base (an offset in this pack for OFS_DELTA, or a binary SHA1
+		# for REF_DELTA) and the offset of the delta data.
+		pack = self.pack
+		if otype == _REF_DELTA:
+			return pack[offset:offset+20], offset + 20
+		byte = ord(pack[offset])
+		offset += 1
+		rel = byte & 0x7f
+		while byte & 0x80:
+			byte = ord(pack[offset])
+			offset += 1
+			rel = (( rel + 1 ) << 7 ) | ( byte & 0x7f )
+		return rel, offset
+
+def _varint(data,pos):
+	# Reads a delta header size (little-endian base 128) from data.
+	size = 0
+	shift = 0
+	while True:
+		byte = ord(data[pos])
+		pos += 1
+		size |= ( byte & 0x7f ) << shift
+		shift += 7
+		if not byte & 0x80:
+			return size, pos
+
+def apply_delta(base,delta):
+
+	# Applies git delta data to the string base, and returns the result.
+	# A delta is a list of instructions that either copy a range of the
+	# base, or insert literal data.
+
+	srcsize, pos = _varint(delta,0)
+	if srcsize != len(base):
+		raise GitError("delta base size mismatch")
+	destsize, pos = _varint(delta,pos)
+	out = []
+	end = len(delta)
+	while pos < end:
+		op = ord(delta[pos])
+		pos += 1
+		if op & 0x80:
+			offset = 0
+			for i in range(4):
+				if op & ( 1 << i ):
+					offset |= ord(delta[pos]) << ( i * 8 )
+					pos += 1
+			size = 0
+			for i in range(3):
+				if op & ( 0x10 << i ):
+					size |= ord(delta[pos]) << ( i * 8 )
+					pos += 1
+			if size == 0:
+				size = 0x10000
+			out.append(base[offset:offset+size])
+		elif op:
+			out.append(delta[pos:pos+op])
+			pos += op
+		else:
+			raise GitError("invalid delta instruction")
+	out = "".join(out)
+	if len(out) != destsize:
+		raise GitError("delta result size mismatch")
+	return out
+
+class GitObjectStore(object):
+
+	# GitObjectStore reads objects from the object database of the git
+	# repository at FilePath path (the repository itself if it is bare,
+	# otherwise its .git directory.) Parsed trees are cached by SHA1, and
+	# since a tree's SHA1 identifies its contents, the cache never needs
+	# to be invalidated. Packs added to the repository after the store
+	# is created (for instance, by a fetch) are found on the next lookup
+	# that misses. Call clear() to drop the cached trees. A store may be
+	# shared by threads (see scanner.py), so its caches and pack list are
+	# only changed while holding self._lock.
+
+	# The number of delta base objects to keep cached. Deltas in a pack
+	# are often chained, so this avoids re-inflating the same bases.
+
+	basecache = 256
+
+	def __repr__(self):
+		return "GitObjectStore(%s)" % self.path.diskpath
+
+	def __init__(self,path):
+		self.path = path
+		self.objects = path.adjpath("objects")
+		if not self.objects.isdir():
+			raise GitError("%s is not a git repository" % path.diskpath)
+		self._packs = {}
+		self._trees = {}
+		self._bases = {}
+		self._lock = threading.Lock()
+		self._scan_packs()
+
+	def clear(self):
+		self._lock.acquire()
+		try:
+			self._trees = {}
+			self._bases = {}
+		finally:
+			self._lock.release()
+
+	def _scan_packs(self):
+		packdir = self.objects.adjpath("pack")
+		if not packdir.isdir():
+			return
+		self._lock.acquire()
+		try:
+			for name in os.listdir(packdir.diskpath):
+				if name[-4:] != ".idx":
+					continue
+				base = os.path.join(packdir.diskpath,name[:-4])
+				if base not in self._packs and os.path.exists(base + ".pack"):
+					self._packs[base] = GitPack(base)
+		finally:
+			self._lock.release()
+
+	def resolve(self,rev):
+
+		# Returns the hex SHA1 of the commit named by rev. Tags are
+		# peeled to the commit they point to.
+
+		sha = self._ref(rev)
+		if sha == None:
+			raise GitError("unknown revision %s" % rev)
+		while True:
+			otype, data = self.read(sha)
+			if otype == "commit":
+				return sha
+			if otype != "tag":
+				raise GitError("%s is a %s, not a commit" % ( rev, otype ))
+			sha = data.split("\n",1)[0].split(" ")[1]
+
+	def _ref(self,ref):
+		if len(ref) == 40:
+			try:
+				int(ref,16)
+				return ref.lower()
+			except ValueError:
+				pass
+		for name in ( ref, "refs/%s" % ref, "refs/tags/%s" % ref, "refs/heads/%s" % ref ):
+			path = self.path.adjpath(name)
+			if not path.exists() or path.isdir():
+				continue
+			a = path.open("r")
+			try:
+				data = a.read().strip()
+			finally:
+				a.close()
+			if data[:5] == "ref: ":
+				return self._ref(data[5:])
+			return data
+		packed = self.path.adjpath("packed-refs")
+		for line in packed.itergrab():
+			if line[0] == "^":
+				continue
+			sha, name = line.split(" ",1)
+			if name in ( ref, "refs/%s" % ref, "refs/tags/%s" % ref, "refs/heads/%s" % ref ):
+				return sha
+		return None
+
+	def read(self,sha):
+
+		# Returns the ( type, data ) of the object with hex SHA1 sha,
+		# where type is "commit", "tree", "blob" or "tag".
+
+		out = self._read_loose(sha)
+		if out != None:
+			return out
+		binsha = sha.decode("hex")
+		out = self._read_packed(binsha)
+		if out == None:
+			# maybe a pack was added since we last looked:
+			self._scan_packs()
+			out = self._read_packed(binsha)
+		if out == None:
+			raise GitError("object %s not found" % sha)
+		return out
+
+	def _read_loose(self,sha):
+		path = os.path.join(self.objects.diskpath,sha[:2],sha[2:])
+		try:
+			a = open(path,"rb")
+		except IOError:
+			return None
+		try:
+			data = zlib.decompress(a.read())
+		finally:
+			a.close()
+		header, data = data.split("\0",1)
+		return header.split(" ",1)[0], data
+
+	def size(self,sha):
+
+		# Returns the size of the object with hex SHA1 sha, reading only
+		# its header rather than inflating the whole object.
+
+		path = os.path.join(self.objects.diskpath,sha[:2],sha[2:])
+		try:
+			a = open(path,"rb")
+		except IOError:
+			a = None
+		if a != None:
+			try:
+				d = zlib.decompressobj()
+				header = d.decompress(a.read(1024),64)
+			finally:
+				a.close()
+			return int(header.split("\0",1)[0].split(" ",1)[1])
+		binsha = sha.decode("hex")
+		for attempt in ( 0, 1 ):
+			for pack in self._packs.values():
+				offset = pack.offset(binsha)
+				if offset != None:
+					otype, size, pos = pack.header(offset)
+					if otype in _types:
+						return size
+					# a delta starts with the sizes of its base and of
+					# the result:
+					base, pos = pack.delta_base(otype,pos)
+					delta = pack.inflate_head(pos,20)
+					srcsize, pos = _varint(delta,0)
+					return _varint(delta,pos)[0]
+			# maybe a pack was added since we last looked:
+			self._scan_packs()
+		raise GitError("object %s not found" % sha)
+
+	def _read_packed(self,binsha):
+		for pack in self._packs.values():
+			offset = pack.offset(binsha)
+			if offset != None:
+				return self._unpack(pack,offset)
+		return None
+
+	def _unpack(self,pack,offset):
+
+		# Returns the ( type, data ) of the object at offset in pack,
+		# resolving deltas.
+
+		key = ( pack.path, offset )
+		cached = self._bases.get(key)
+		if cached != None:
+			return cached
+		otype, size, pos = pack.header(offset)
+		if otype in _types:
+			return _types[otype], pack.inflate(pos,size)
+		if otype not in ( _OFS_DELTA, _REF_DELTA ):
+			raise GitError("%s.pack: unknown object type %s" % ( pack.path, otype ))
+		base, pos = pack.delta_base(otype,pos)
+		if otype == _OFS_DELTA:
+			btype, bdata = self._unpack(pack,offset-base)
+		else:
+			btype, bdata = self.read(base.encode("hex"))
+		out = btype, apply_delta(bdata,pack.inflate(pos,size))
+		self._lock.acquire()
+		try:
+			if len(self._bases) >= self.basecache:
+				self._bases = {}
+			self._bases[key] = out
+		finally:
+			self._lock.release()
+		return out
+
+	def tree(self,sha):
+
+		# Returns the tree with hex SHA1 sha as a dictionary of name ->
+		# ( mode, hex SHA1 ), where mode is an integer.
+
+		tree = self._trees.get(sha)
+		if tree != None:
+			return tree
+		otype, data = self.read(sha)
+		if otype != "tree":
+			raise GitError("%s is a %s, not a tree" % ( sha, otype ))
+		tree = {}
+		pos = 0
+		end = len(data)
+		while pos < end:
+			space = data.index(" ",pos)
+			nul = data.index("\0",space)
+			tree[data[space+1:nul]] = ( int(data[pos:space],8), data[nul+1:nul+21].encode("hex") )
+			pos = nul + 21
+		self._lock.acquire()
+		try:
+			self._trees[sha] = tree
+		finally:
+			self._lock.release()
+		return tree
+
+	def commit_tree(self,rev):
+		# Returns the hex SHA1 of the root tree of commit rev.
+		otype, data = self.read(self.resolve(rev))
+		for line in data.split("\n"):
+			if line[:5] == "tree ":
+				return line[5:]
+		raise GitError("commit %s has no tree" % rev)
+
+	def lookup(self,root,path):
+
+		# Returns the ( mode, hex SHA1 ) of path (i.e.
+		# "sys-apps/portage/metadata.xml") inside tree root, or None if
+		# it doesn't exist.
+
+		entry = ( stat.S_IFDIR, root )
+		if path in ( "", "." ):
+			return entry
+		for name in path.split("/"):
+			if not stat.S_ISDIR(entry[0]):
+				return None
+			entry = self.tree(entry[1]).get(name)
+			if entry == None:
+				return None
+		return entry
+
+class GitPath(FilePath):
+
+	# A GitPath is a FilePath that refers to a path inside a commit of a
+	# git repository. It supports the methods PortageRepository and its
+	# helpers use -- adjpath(), exists(), isdir(), listdir(), scandir(),
+	# stat(), stamp(), open() for reading, and grabfile() -- so it can be
+	# used anywhere a FilePath pointing into a tree is expected. Its
+	# diskpath is the repository path plus "@" and the commit's root tree
+	# SHA1, followed by the path, so GitPaths from different commits never
+	# compare equal unless the trees are identical. Paths that try to
+	# leave the tree with ".." don't exist.
+	#
+	# stamp() returns the object's SHA1, which changes exactly when its
+	# contents change, so contentstamps is True (see TreeIndex.)
+
+	__slots__ = ( "_store", "_root", "_entry" )
+
+	contentstamps = True
+
+	def __init__(self,store,rev="HEAD",path="",root=None):
+		# store is a GitObjectStore. root may be given instead of rev as
+		# the hex SHA1 of a tree, to skip resolving rev.
+		if root == None:
+			root = store.commit_tree(rev)
+		FilePath.__init__(self,path,base_path="%s@%s" % ( store.path.diskpath, root ))
+		self._store = store
+		self._root = root
+		self._entry = False
+
+	def __repr__(self):
+		return "GitPath(%s,%s)" % ( self.base_path, self.path )
+
+	@property
+	def store(self):
+		return self._store
+
+	def _make(self,path):
+		return GitPath(self._store,path=path,root=self._root)
+
+	def _child(self,name):
+		if self._path in ( "", "." ):
+			return self._make(name)
+		return self._make(os.path.normpath(os.path.join(self._path, name)))
+
+	def __add__(self,other):
+		return self._child(other)
+
+	def adjpath(self,change):
+		if os.path.isabs(change):
+			return self._make(os.path.normpath(change).lstrip("/"))
+		return self._child(change)
+
+	def follow(self):
+		return self
+
+	def _lookup(self):
+		if self._entry == False:
+			self._entry = self._store.lookup(self._root,os.path.normpath(self._path) if self._path else "")
+		return self._entry
+
+	def exists(self):
+		return self._lookup() != None
+
+	def isdir(self):
+		entry = self._lookup()
+		return entry != None and stat.S_ISDIR(entry[0])
+
+	def _tree(self):
+		entry = self._lookup()
+		if entry == None:
+			raise OSError(2,"No such file or directory",self.diskpath)
+		if not stat.S_ISDIR(entry[0]):
+			raise OSError(20,"Not a directory",self.diskpath)
+		return self._store.tree(entry[1])
+
+	def listdir(self):
+		return set(self._tree().keys())
+
+	def scandir(self):
+		return [ ( name, stat.S_ISDIR(entry[0]) ) for name, entry in self._tree().items() ]
+
+	def stat(self):
+		# Returns an os.stat_result with the mode and size of the object.
+		# Times are zero, since git doesn't record them.
+		entry = self._lookup()
+		if entry == None:
+			return None
+		if stat.S_ISDIR(entry[0]):
+			return os.stat_result(( stat.S_IFDIR | 0755, 0, 0, 1, 0, 0, 0, 0, 0, 0 ))
+		return os.stat_result(( entry[0], 0, 0, 1, 0, 0, self._store.size(entry[1]), 0, 0, 0 ))
+
+	def stamp(self):
+		entry = self._lookup()
+		if entry == None:
+			return None
+		return ( entry[1], )
+
+	def open(self,mode="r"):
+		if "w" in mode or "a" in mode or "+" in mode:
+			raise IOError(30,"Read-only file system",self.diskpath)
+		entry = self._lookup()
+		if entry == None:
+			raise IOError(2,"No such file or directory",self.diskpath)
+		if stat.S_ISDIR(entry[0]):
+			raise IOError(21,"Is a directory",self.diskpath)
+		return StringIO(self._store.read(entry[1])[1])
+
+	def itergrab(self,usemmap=False):
+		# Blobs are already in memory, so mmap doesn't apply.
+		return FilePath.itergrab(self,False)
+
+if __name__ == "__main__":
+	from portsmod import *
+	store = GitObjectStore(FilePath("/var/git/portage-mini-2010/.git"))
+	a = PortageRepository(GitPath(store,"HEAD"))
+	print a.getList(PkgAtom,[CatPkg("sys-apps/portage")])
+	print a.categories
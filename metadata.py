@@ -0,0 +1,88 @@
+#!/usr/bin/python2
+
+# Copyright 2010 Daniel Robbins, Funtoo Technologies, LLC.
+#
+# FUNTOO TECHNOLOGIES INTERNAL SOURCE CODE
+# ALPHA - DO NOT RELEASE - NOT FOR DISTRIBUTION
+#
+# The unauthorized reproduction or distribution of this copyrighted work is
+# illegal, and may result in civil or criminal liability.
+
+# This module describes ebuild metadata, as stored in the classic
+# metadata/cache directory of a Portage tree and in our SQLite bundles (see
+# metadata.txt and sqliterepo.py.)
+
+# Each file in metadata/cache/<cat>/<pf> is in "flat list" format: one
+# line per metadata key, in the order below. (metadata.txt refers to
+# INHERITED by its original name, ECLASS.) Line 12 is unused.
+
+auxdbkeys = [
+	"DEPEND", "RDEPEND", "SLOT", "SRC_URI", "RESTRICT", "HOMEPAGE",
+	"LICENSE", "DESCRIPTION", "KEYWORDS", "INHERITED", "IUSE", "",
+	"PDEPEND", "PROVIDE", "EAPI", "PROPERTIES", "DEFINED_PHASES"
+]
+
+# Metadata is split into two bundles. The "core" bundle holds what is
+# needed for dependency resolution and fetching, plus the internal build
+# metadata that travels with the bundle. The "desc" bundle holds the
+# nice-to-have DESCRIPTION and HOMEPAGE, which are only needed for things
+# like "emerge -s".
+
+core_keys = [
+	"DEPEND", "RDEPEND", "PDEPEND", "LICENSE", "EAPI", "IUSE", "KEYWORDS",
+	"PROVIDE", "SLOT", "RESTRICT", "SRC_URI", "INHERITED", "PROPERTIES",
+	"DEFINED_PHASES"
+]
+
+desc_keys = [ "DESCRIPTION", "HOMEPAGE" ]
+
+all_keys = core_keys + desc_keys
+
+def read_flat_list(path):
+
+	# Reads a flat list metadata cache entry from FilePath path, and returns
+	# a dictionary of metadata, or None if the entry does not exist.
+
+	try:
+		a = path.open("r")
+	except IOError:
+		return None
+	try:
+		return parse_flat_list(a.read())
+	finally:
+		a.close()
+
+def parse_flat_list(data):
+
+	# Parses string data in flat list format -- the contents of a cache
+	# entry, or what "ebuild.sh depend" writes to fd 9 -- and returns a
+	# dictionary of metadata.
+
+	lines = data.split("\n")
+	out = {}
+	for pos in range(len(auxdbkeys)):
+		key = auxdbkeys[pos]
+		if not key:
+			continue
+		if pos < len(lines):
+			out[key] = lines[pos]
+		else:
+			out[key] = ""
+	return out
+
+def write_flat_list(path,data):
+
+	# Writes dictionary data to FilePath path as a flat list metadata cache
+	# entry.
+
+	lines = []
+	for key in auxdbkeys:
+		if key:
+			lines.append(data.get(key,""))
+		else:
+			lines.append("")
+	a = path.open("w")
+	try:
+		a.write("\n".join(lines) + "\n")
+	finally:
+		a.close()
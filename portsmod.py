@@ -12,10 +12,13 @@
 # and easily managed:
 
 import os
-
-import portage.versions
+import weakref
 
 import access
+import versions
+import metadata
+from treeindex import TreeIndex
+from scanner import DirectoryScanner
 
 
 # This module implements a simplified mechanism to access the contents of a
@@ -30,22 +33,41 @@ class CatPkg(object):
 	# ebuilds that is identified by a category and package name, such
 	# as "sys-apps/portage".
 
+	# CatPkgs are interned: as long as a reference to it exists,
+	# CatPkg("sys-apps/portage") returns the same object every time, so a
+	# full tree's worth of CatPkgs doesn't hold duplicate copies. The
+	# category and package names are split once, on creation, and should
+	# be treated as read-only.
+
+	__slots__ = [ "catpkg", "cat", "pkg", "__weakref__" ]
+
+	_interned = weakref.WeakValueDictionary()
+
 	def __repr__(self):
 		return "CatPkg(%s)" % self.catpkg
 
-	def __init__(self,catpkg):
+	def __new__(cls,catpkg):
 		# catpkg = something like "sys-apps/portage"
-		self.catpkg = catpkg
+		self = cls._interned.get(catpkg)
+		if self is None:
+			self = object.__new__(cls)
+			self.catpkg = catpkg
+			# i.e. "sys-apps", "portage"
+			self.cat, self.pkg = catpkg.split("/",1)
+			cls._interned[catpkg] = self
+		return self
 
-	@property
-	def cat(self):
-		#i.e. "sys-apps"
-		return self.catpkg.split("/")[0]
-	
-	@property
-	def pkg(self):
-		#i.e. "portage"
-		return self.catpkg.split("/")[1]
+	def __reduce__(self):
+		return ( self.__class__, ( self.catpkg, ) )
+
+	def __hash__(self):
+		return hash(self.catpkg)
+
+	def __eq__(self,other):
+		return self is other or ( isinstance(other,CatPkg) and self.catpkg == other.catpkg )
+
+	def __ne__(self,other):
+		return not self.__eq__(other)
 
 	@property
 	def p(self):
@@ -63,6 +85,18 @@ class CatPkg(object):
 		if hasattr(self,key):
 			return getattr(self,key)
 
+class FrozenDict(dict):
+
+	# A dict that can't be modified after it has been created.
+
+	def _frozen(self,*args,**kwargs):
+		raise TypeError("FrozenDict can't be modified")
+
+	__setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _frozen
+
+	def __hash__(self):
+		return hash(frozenset(self.items()))
+
 class PkgAtom(object):
 
 	# Our PkgAtom is different from a dependency, and literally means "a
@@ -119,15 +153,72 @@ class PkgAtom(object):
 
 	# (Although you wouldn't want to specify keywords in an PkgAtom as it
 	# wouldn't pass the LOGICAL TESTS above.)
-	
+
+	# Like CatPkgs, PkgAtoms are interned by their atom string, and all of
+	# their fields are parsed exactly once, when the PkgAtom is created.
+	# These fields should be treated as read-only:
+
+	# atom = "sys-apps/portage-2.2_rc67-r1:slot=3"
+	# cat = "sys-apps"
+	# pf = "portage-2.2_rc67-r1"
+	# p = "portage"
+	# pv = "2.2_rc67"
+	# pr = "r1"
+	# cpvs = ( "sys-apps", "portage", "2.2_rc67", "r1" ) ("catpkgsplit" tuple)
+	# keys = { "slot" : "3" } (additional atomdata key/value pairs, as a FrozenDict)
+	# vkey = sortable version key (see versions.py)
+
+	# If the version can't be parsed, cpvs, p, pv, pr and vkey are None.
+
+	# PkgAtoms are ordered by category, package name, version (following
+	# the PMS version rules) and then key data, so sorting the versions of
+	# a catpkg or picking the best version is simply:
+
+	# >>> sorted(atoms)
+	# >>> max(atoms)
+
+	__slots__ = [ "atom", "cat", "pf", "p", "pv", "pr", "cpvs", "vkey", "keys", "_ident", "_order", "_hash", "__weakref__" ]
+
+	_interned = weakref.WeakValueDictionary()
+
 	def __repr__(self):
 		return "PkgAtom(%s)" % self.atom
 
-	def __init__(self,atom):
+	def __new__(cls,atom):
+		self = cls._interned.get(atom)
+		if self is None:
+			self = object.__new__(cls)
+			self._parse(atom)
+			cls._interned[atom] = self
+		return self
+
+	def _parse(self,atom):
 		self.atom = atom
-		self._keysplit = None
-		self._keys = None
-		self._cpvs = None
+		keysplit = atom.split(":")
+		self.cat, self.pf = keysplit[0].split("/",1)
+		# keys is shared by every holder of this PkgAtom, so it is frozen:
+		self.keys = FrozenDict(meta.split("=",1) for meta in keysplit[1:])
+		self.cpvs = versions.catpkgsplit(keysplit[0])
+		if self.cpvs == None:
+			self.p = self.pv = self.pr = self.vkey = None
+			ident = ( self.cat, self.pf )
+			self._order = ( self.cat, self.pf, None, None, sorted(self.keys.items()) )
+		else:
+			self.p, self.pv, self.pr = self.cpvs[1:]
+			self.vkey = versions.version_key(self.pv,self.pr)
+			ident = self.cpvs
+			# pv is a tie-breaker for equal versions like "1.0" and
+			# "1.00", so that the ordering agrees with __eq__():
+			self._order = ( self.cat, self.p, self.vkey, self.pv, sorted(self.keys.items()) )
+		# _ident is what makes two PkgAtoms equal - see __eq__():
+		self._ident = ( ident, frozenset(self.keys.items()) )
+		self._hash = hash(self._ident)
+
+	def __reduce__(self):
+		return ( self.__class__, ( self.atom, ) )
+
+	def __hash__(self):
+		return self._hash
 
 	def __getitem__(self,key):
 		
@@ -140,58 +231,35 @@ class PkgAtom(object):
 		if hasattr(self,key):
 			return getattr(self,key)
 
-	@property
-	def keys(self):
-		
-		# Additional atomdata key/value pairs in dictionary format. These
-		# are created on initialization and you should not modify the
-		# keys property directly.
-
-		if self._keys == None:
-			self._keys = {}
-			for meta in self._keysplit[1:]:
-				key, val = meta.split("=",1)
-				self._keys[key] = val
-		return self._keys
-
-	@property
-	def cpvs(self):
-		# cpvs = "catpkgsplit string" and is used by other properties
-		if self._cpvs == None:
-			self._keysplit = self.atom.split(":")
-			self._cpvs = portage.versions.catpkgsplit(self._keysplit[0])
-		return self._cpvs
-	
-	@property
-	def cat(self):
-		#i.e. "sys-apps"
-		return self.atom.split("/")[0]
-	
-	@property
-	def pf(self):
-		#i.e. "portage-2.2_rc67-r1"
-		return self.atom.split("/")[1]
-	
-	@property
-	def p(self):
-		#i.e. "portage"
-		return self.cpvs[1]
-
-	@property
-	def pv(self):
-		#i.e. "2.2_rc67"
-		return self.cpvs[2]
-	
-	@property
-	def pr(self):
-		#i.e. "r1"
-		return self.cpvs[3]
-
 	def __eq__(self,other):
-		# We can only test for atom equality, but cannot otherwise compare them.
 		# PkgAtoms are equal when they reference the same unique cat/pkg and have
-		# the same key data.
-		return self.cpvs == other.cpvs and self.keys == other.keys
+		# the same key data. Equality is by version string, so "1.0" and "1.00"
+		# are different atoms even though they sort as the same version; the
+		# ordering methods below compare versions (see versions.py.)
+		return self is other or ( isinstance(other,PkgAtom) and self._ident == other._ident )
+
+	def __ne__(self,other):
+		return not self.__eq__(other)
+
+	def __lt__(self,other):
+		if not isinstance(other,PkgAtom):
+			return NotImplemented
+		return self._order < other._order
+
+	def __le__(self,other):
+		if not isinstance(other,PkgAtom):
+			return NotImplemented
+		return self._order <= other._order
+
+	def __gt__(self,other):
+		if not isinstance(other,PkgAtom):
+			return NotImplemented
+		return self._order > other._order
+
+	def __ge__(self,other):
+		if not isinstance(other,PkgAtom):
+			return NotImplemented
+		return self._order >= other._order
 
 class PkgAtomFilter(object):
 
@@ -204,19 +272,123 @@ class PkgAtomFilter(object):
 
 	# >>> vis, masked = my.apply(asdlfkdsjf)
 
+	# The dependency string is compiled once, when the PkgAtomFilter is
+	# created. The following dependency strings are supported:
+
+	# sys-apps/portage		(any version)
+	# =sys-apps/portage-2.2_rc67-r1	(exact version, including revision)
+	# =sys-apps/portage-2.2*	(2.2, 2.2.1, 2.2_rc1 and so on, but not 2.20)
+	# ~sys-apps/portage-2.2_rc67	(any revision of this version)
+	# >=, >, <=, <			(version comparison, following the PMS rules)
+	# sys-apps/portage:2		(slot - can be combined with the above)
+	# sys-apps/portage::funtoo	(repository - likewise, and after any slot)
+
+	# Blockers ("!sys-apps/portage") are not supported: in package.mask a
+	# "!" is not an inversion, and a filter that matched everything else
+	# would mask the whole tree. They raise ValueError like any other
+	# invalid entry, so FilterGroup records them in its invalid list.
+
+	# Slots can only be matched against PkgAtoms that carry slot key data
+	# (i.e. "sys-apps/portage-2.2_rc67:slot=2"), which is the case for
+	# installed packages. See filter.py for filters that can look up the
+	# slot of ebuilds in a repository. Likewise, repositories are matched
+	# against "repo" key data.
+
+	# An invalid dependency string raises ValueError.
+
+	_ops = [ ">=", "<=", ">", "<", "=", "~" ]
+
+	_tests = {
+		None : lambda vkey, fkey: True,
+		"=" : lambda vkey, fkey: vkey == fkey,
+		"~" : lambda vkey, fkey: vkey[:4] == fkey[:4],
+		">=" : lambda vkey, fkey: vkey >= fkey,
+		">" : lambda vkey, fkey: vkey > fkey,
+		"<=" : lambda vkey, fkey: vkey <= fkey,
+		"<" : lambda vkey, fkey: vkey < fkey,
+	}
+
+	def __repr__(self):
+		return "PkgAtomFilter(%s)" % self.depstring
+
 	def __init__(self,depstring):
 		self.depstring = depstring
+		self._compile(depstring.strip())
+
+	def _compile(self,dep):
+		if dep[:1] == "!":
+			raise ValueError("blockers are not supported: %s" % self.depstring)
+		self.op = None
+		for op in self._ops:
+			if dep[:len(op)] == op:
+				self.op = op
+				dep = dep[len(op):]
+				break
+		dep, sep, self.repo = dep.partition("::")
+		if not sep:
+			self.repo = None
+		elif not self.repo:
+			raise ValueError("empty repository in %s" % self.depstring)
+		dep, sep, self.slot = dep.partition(":")
+		if not sep:
+			self.slot = None
+		elif not self.slot:
+			raise ValueError("empty slot in %s" % self.depstring)
+		if self.op == "=" and dep[-1:] == "*":
+			self.op = "=*"
+			dep = dep[:-1]
+		cpvs = versions.catpkgsplit(dep)
+		if self.op == None:
+			if cpvs != None or dep.count("/") != 1:
+				raise ValueError("invalid dependency %s" % self.depstring)
+			self.cat, self.p = dep.split("/")
+			self.version = self.vkey = None
+		else:
+			if cpvs == None:
+				raise ValueError("invalid dependency %s" % self.depstring)
+			self.cat, self.p = cpvs[0:2]
+			# version as specified, including any revision:
+			self.version = dep[len(self.cat) + len(self.p) + 2:]
+			self.vkey = versions.version_key(cpvs[2],cpvs[3])
+		self.catpkg = "%s/%s" % ( self.cat, self.p )
+		if self.op == "=*":
+			prefix = versions.prefix_test(self.version)
+			self._test = lambda vkey, fkey: prefix(vkey)
+		else:
+			self._test = self._tests.get(self.op)
+
+	def slotOf(self,atom):
+		# Returns the slot of atom, or None if it is unknown.
+		return atom.keys.get("slot")
+
+	def match(self,atom):
+
+		# Returns True if atom is matched by this filter.
+
+		if atom.p != self.p or atom.cat != self.cat:
+			return False
+		if self.op != None:
+			if atom.vkey == None or not self._test(atom.vkey,self.vkey):
+				return False
+		if self.slot != None and self.slotOf(atom) != self.slot:
+			return False
+		if self.repo != None and atom.keys.get("repo") != self.repo:
+			return False
+		return True
 
 	def apply(self,pkgatomset):
-		pass
 
-	@property
-	def cat(self):
-		return "foo"
+		# Returns a tuple of two sets: the visible (not matched) and
+		# masked (matched) PkgAtoms from pkgatomset.
 
-	@property
-	def p(self):
-		return "bar"
+		visible = set()
+		masked = set()
+		for atom in pkgatomset:
+			if self.match(atom):
+				masked.add(atom)
+			else:
+				visible.add(atom)
+		return visible, masked
 
 class EClassAtom(object):
 
@@ -226,12 +398,36 @@ class EClassAtom(object):
 	def __init__(self,atom):
 		self.atom = atom
 
+	def __hash__(self):
+		return hash(self.atom)
+
+	def __eq__(self,other):
+		return self is other or ( isinstance(other,EClassAtom) and self.atom == other.atom )
+
+	def __ne__(self,other):
+		return not self.__eq__(other)
+
 class Adapter(object):
 
 	def __init__(self,**args):
 		for arg in args.keys():
 			setattr(self,arg,args[arg])
 
+class RepositoryObjRef(object):
+
+	# A RepositoryObjRef is returned by PortageRepository.getRef(), and
+	# records which repository owns an object (PkgAtom, CatPkg, etc.), the
+	# object itself, and the path to the object relative to the object
+	# root.
+
+	def __repr__(self):
+		return "RepositoryObjRef(%s,%s,%s)" % ( self.repo, self.atom, self.path )
+
+	def __init__(self,repo,atom,path):
+		self.repo = repo
+		self.atom = atom
+		self.path = path
+
 class PortageRepository(object):
 
 	# PortageRepository provides an easy-to-use and elegant means of
@@ -243,10 +439,10 @@ class PortageRepository(object):
 	# metadata to view the repository, or even a Portage repository with a
 	# non-standard filesystem layout.
 
-	# This class has minimal external source code dependencies, utilizing
-	# only "portage.versions" from the official Portage sources for version
-	# splitting, etc. This allows this code to be easily used by utility
-	# programs.
+	# This class has minimal external source code dependencies, and does
+	# not require the official Portage sources (version splitting and
+	# comparison is implemented in versions.py.) This allows this code to
+	# be easily used by utility programs.
 
 	# Subclasses can override PortageRepository's init_paths() method to
 	# implement alternate repository layouts, or override accessor
@@ -254,7 +450,7 @@ class PortageRepository(object):
 	# mechanisms.
 
 	def __repr__(self):
-		return "PortageRepository(%s)" % self.base_path.diskpath
+		return "PortageRepository(%s)" % self.path.diskpath
 
 	# The self._has_*() and self._*_list() methods below are used to query
 	# the Portage repository. If you want to change the structure of the
@@ -272,48 +468,141 @@ class PortageRepository(object):
 	# They query the local repository only. That is why these methods
 	# should not be called by other code.
 
-	# Also note that I don't implement _eclass_list(), as eclasses are
-	# not something that you need to query in this way. You just need
-	# to find the right eclasses from your base tree and overlays, and
-	# _has_eclass() is sufficient to get this done.
+	# The _*_path() methods return the path an object would have in this
+	# repository, without checking whether it exists. getRef() uses these
+	# when it answers from the owner index (see below.)
+
+	# Eclasses are not something that you normally need to list. You just
+	# need to find the right eclasses from your base tree and overlays,
+	# and _has_eclass() is sufficient to get this done. _eclass_list()
+	# exists so that the owner index can be built.
+
+	def _eclass_path(self,eclass):
+		return self.paths["eclass_dir"].adjpath("%s.eclass" % eclass.atom).path
 
 	def _has_eclass(self,arg,**args):
-		path = self.path.adjpath("eclass/%s.eclass" % arg.atom)
+		path = self.paths["eclass_dir"].adjpath("%s.eclass" % arg.atom)
 		if path.exists():
 			return path.path
 
+	def _eclass_list(self):
+		path = self.paths["eclass_dir"]
+		if not path.isdir():
+			return []
+		return [ EClassAtom(file[:-7]) for file in path.listdir() if file[-7:] == ".eclass" ]
+
+	# _eclass_iter() yields all eclasses, or those in eclasses (EClassAtoms
+	# or eclass names) that exist in this repository.
+
+	def _eclass_iter(self,eclasses=None):
+		if eclasses == None:
+			for eclass in self._eclass_list():
+				yield eclass
+			return
+		for eclass in eclasses:
+			if not isinstance(eclass,EClassAtom):
+				eclass = EClassAtom(eclass)
+			if self._has_eclass(eclass) != None:
+				yield eclass
+
+	# If the repository has a TreeIndex (see treeindex.py), the
+	# _has_catpkg(), _catpkg_list(), _has_pkgatom() and _pkgatom_list()
+	# methods answer from the index, which only rescans directories whose
+	# mtime has changed.
+
+	def _catpkg_path(self,catpkg):
+		return self.path.adjpath(catpkg.catpkg).path
+
 	def _has_catpkg(self,catpkg):
 		path = self.path.adjpath(catpkg.catpkg)
-		if path.isdir():
+		if self.index != None:
+			if catpkg.pkg in self.index.catpkgs(catpkg.cat):
+				return path.path
+		elif path.isdir():
 			return path.path
 
-	def _catpkg_list(self,categories=None):
-		cp = []
+	# The _*_iter() methods are generator versions of the _*_list()
+	# methods, used by iterList() to stream results.
+
+	def _catpkg_iter(self,categories=None):
 		if categories == None:
 			categories = self.categories
-		for cat in categories:
-			if not self.path.adjpath(cat).isdir():
+		if self.index != None:
+			try:
+				for cat in categories:
+					for pkg in self.index.catpkgs(cat):
+						yield CatPkg("%s/%s" % ( cat, pkg ))
+			finally:
+				self.index.save()
+			return
+		jobs = ( ( cat, self.path.adjpath(cat) ) for cat in categories )
+		for cat, pkgs in self.scanner.scan(jobs,dironly=True):
+			if pkgs == None:
 				continue
-			for pkg in self.path.adjpath(cat).listdir():
-				cp.append(CatPkg("%s/%s" % ( cat, pkg )))
-		return cp
+			for pkg in pkgs:
+				yield CatPkg("%s/%s" % ( cat, pkg ))
+
+	def _catpkg_list(self,categories=None):
+		return list(self._catpkg_iter(categories))
+
+	def _pkgatom_path(self,pkgatom):
+		return self.path.adjpath("%s/%s/%s.ebuild" % ( pkgatom.cat, pkgatom.p, pkgatom.pf )).path
 
 	def _has_pkgatom(self,pkgatom):
 		path = self.path.adjpath("%s/%s/%s.ebuild" % ( pkgatom.cat, pkgatom.p, pkgatom.pf ))
-		if path.exists():
+		if self.index != None:
+			if pkgatom.pf in self.index.ebuilds(pkgatom.cat, pkgatom.p):
+				return path.path
+		elif path.exists():
 			return path.path
 
-	def _pkgatom_list(self,catpkgs=None):
-		pa = []
+	def _pkgatom_iter(self,catpkgs=None):
 		if catpkgs == None:
-			catpkgs = self._catpkg_list()
-		for catpkg in catpkgs:
-			if not self.access.isdir(catpkg.catpkg):
+			catpkgs = self._catpkg_iter()
+		if self.index != None:
+			try:
+				for catpkg in catpkgs:
+					for pf in self.index.ebuilds(catpkg.cat, catpkg.pkg):
+						yield PkgAtom("%s/%s" % ( catpkg.cat, pf ))
+			finally:
+				self.index.save()
+			return
+		jobs = ( ( catpkg, self.path.adjpath(catpkg.catpkg) ) for catpkg in catpkgs )
+		for catpkg, files in self.scanner.scan(jobs):
+			if files == None:
 				continue
-			for file in self.access.listdir(catpkg.catpkg):
+			for file in files:
 				if file[-7:] == ".ebuild":
-					pa.append(PkgAtom("%s/%s" % ( catpkg.cat, file[:-7])))
-		return pa
+					yield PkgAtom("%s/%s" % ( catpkg.cat, file[:-7]))
+
+	def _pkgatom_list(self,catpkgs=None):
+		return list(self._pkgatom_iter(catpkgs))
+
+	# _metadata() returns the cached metadata of an ebuild in this
+	# repository as a dictionary (see metadata.py for the keys), or None
+	# if there is no cache entry. If keys is specified, only those keys
+	# are returned. The classic layout reads the flat list cache in
+	# metadata/cache/<cat>/<pf>.
+
+	def _metadata(self,pkgatom,keys=None):
+		data = metadata.read_flat_list(self.paths["metadata_cache"].adjpath("%s/%s" % ( pkgatom.cat, pkgatom.pf )))
+		if data == None or keys == None:
+			return data
+		return dict(( key, data.get(key,"") ) for key in keys)
+
+	# _store_metadata() replaces the cached metadata of an ebuild in this
+	# repository with dictionary data (see regen.py), and
+	# _flush_metadata() makes stored metadata durable; the flat list cache
+	# is written one file at a time, so there is nothing to flush.
+
+	def _store_metadata(self,pkgatom,data):
+		path = self.paths["metadata_cache"].adjpath(pkgatom.cat)
+		if not path.isdir():
+			os.makedirs(path.diskpath)
+		metadata.write_flat_list(path.adjpath(pkgatom.pf),data)
+
+	def _flush_metadata(self):
+		pass
 
 	def init_paths(self):
 
@@ -323,11 +612,16 @@ class PortageRepository(object):
 		# simply override this method for any variant PortageRepository
 		# layouts without having to mess with __init__()
 
-		self.path = {
+		self.paths = {
 			"eclass_dir" : self.path.adjpath("eclass"),
+			"profiles" : self.path.adjpath("profiles"),
 			"categories" : self.path.adjpath("profiles/categories"),
 			"info_pkgs" : self.path.adjpath("profiles/info_pkgs"),
-			"info_vars" : self.path.adjpath("profiles/info_vars")
+			"info_vars" : self.path.adjpath("profiles/info_vars"),
+			"metadata_cache" : self.path.adjpath("metadata/cache"),
+			"news" : self.path.adjpath("metadata/news"),
+			"licenses" : self.path.adjpath("licenses"),
+			"advisories" : self.path.adjpath("metadata/glsa")
 		}
 
 		#self.config_map = {
@@ -352,19 +646,34 @@ class PortageRepository(object):
 		# does is create object attributes and methods based on the
 		# keyword arguments you pass to __init__().
 
+		# "path" returns an object's path without checking that it
+		# exists, and "key" returns the key used for the object in the
+		# owner index (see getRef().) For PkgAtoms, this ignores any key
+		# data, as the ebuild path does.
+
 		self.atom_map = {
 			CatPkg : Adapter( 
 					has=self._has_catpkg,
 					list=self._catpkg_list,
+					iter=self._catpkg_iter,
+					path=self._catpkg_path,
+					key=lambda catpkg: catpkg.catpkg,
 					overlays=self.overlays
 			),
 			PkgAtom: Adapter( 
 					has=self._has_pkgatom, 
 					list=self._pkgatom_list,
+					iter=self._pkgatom_iter,
+					path=self._pkgatom_path,
+					key=lambda pkgatom: ( pkgatom.cat, pkgatom.pf ),
 					overlays=self.overlays  
 			),
 			EClassAtom: Adapter(
 					has=self._has_eclass, 
+					list=self._eclass_list,
+					iter=self._eclass_iter,
+					path=self._eclass_path,
+					key=lambda eclass: eclass.atom,
 					overlays=self.eclass_overlays 
 			)
 		}
@@ -400,13 +709,52 @@ class PortageRepository(object):
 		# those ebuilds in "a", but eclasses in "b" will also complement
 		# and override those in "a".
 
-		self.overlays = []
-		self.eclass_overlays = []
+		# (self.overlays and self.eclass_overlays are properties -
+		# assigning a new list updates the existing list in place, so
+		# that self.atom_map sees the change.)
 
-		# self.base_path is a variable pointing to the starting path
+		self._overlays = []
+		self._eclass_overlays = []
+
+		# caches used by __grabset__() and getRef() - see below:
+
+		self._setcache = {}
+		self._mergecache = {}
+		self._owners = {}
+
+		# specifying "refindex=True" to __init__() will make getRef()
+		# answer from an owner index rather than by probing each
+		# overlay - see getRef().
+
+		if "refindex" in args and args["refindex"] == True:
+			self.refindex = True
+		else:
+			self.refindex = False
+
+		# self.path is a FilePath pointing to the starting path
 		# of the Portage tree, i.e. "/usr/portage".
 
-		self.path = path.repository(self)
+		self.path = path
+
+		# specifying "index=FilePath(...)" to __init__() will keep a
+		# persistent TreeIndex of this repository's categories, catpkgs
+		# and ebuilds in the specified file, which avoids re-walking
+		# the tree on every query.
+
+		if "index" in args and args["index"] != None:
+			self.index = TreeIndex(self,args["index"])
+		else:
+			self.index = None
+
+		# self.scanner is the DirectoryScanner used to read category
+		# and package directories. The default reads them one at a
+		# time; pass "scanner=DirectoryScanner(threads=16)" to read
+		# many directories in parallel (useful on NFS and cold caches.)
+
+		if "scanner" in args and args["scanner"] != None:
+			self.scanner = args["scanner"]
+		else:
+			self.scanner = DirectoryScanner(threads=1)
 
 		# specifying "overlay=True" to __init__() will set self.overlay
 		# to True. This is not really used for anything right now other
@@ -424,6 +772,43 @@ class PortageRepository(object):
 
 		self.init_paths()
 
+		# specifying "contents=FilePath(...)" to __init__() will read a
+		# contents descriptor (see contents.py) and bind each section of
+		# the repository -- ebuild listings, eclasses, profiles, the
+		# metadata cache, licenses and so on -- to the backend the
+		# descriptor specifies. self.sections holds the backends for
+		# sections that aren't objects in self.atom_map, such as
+		# licenses. A ContentsDescriptor object can be passed instead
+		# of a path.
+
+		self.sections = {}
+		if "contents" in args and args["contents"] != None:
+			import contents
+			self.contents = args["contents"]
+			if not isinstance(self.contents,contents.ContentsDescriptor):
+				self.contents = contents.ContentsDescriptor.load(self.contents)
+			self.contents.bind(self)
+		else:
+			self.contents = None
+
+	@property
+	def overlays(self):
+		return self._overlays
+
+	@overlays.setter
+	def overlays(self,overlays):
+		self._overlays[:] = overlays
+		self._owners = {}
+
+	@property
+	def eclass_overlays(self):
+		return self._eclass_overlays
+
+	@eclass_overlays.setter
+	def eclass_overlays(self,overlays):
+		self._eclass_overlays[:] = overlays
+		self._owners = {}
+
 	@property
 	def info_pkgs(self,recurse=True):
 
@@ -431,7 +816,7 @@ class PortageRepository(object):
 		# of ebuild atoms that "emerge --info" should display
 		# versions of (used for user bug reports)
 
-		return self.__grabset__(self.path["info_pkgs"],recurse)
+		return self.__grabset__("info_pkgs",recurse)
 
 	@property
 	def info_vars(self,recurse=True):
@@ -440,7 +825,7 @@ class PortageRepository(object):
 		# of variables that "emerge --info" should display.
 		# (Used for user bug reports.)
 		
-		return self.__grabset__(self.path["info_vars"],recurse)
+		return self.__grabset__("info_vars",recurse)
 
 	@property
 	def categories(self,recurse=True):
@@ -448,9 +833,9 @@ class PortageRepository(object):
 		# This property will return a set containing all valid
 		# categories. By default, overlays are scanned as well.
 		
-		return self.__grabset__(self.path["categories"],recurse)
+		return self.__grabset__("categories",recurse)
 
-	def __grabset__(self,path,recurse=True):
+	def __grabset__(self,key,recurse=True):
 		
 		# This is a helper function for various methods above
 		# that need to grab data from a file in the repo and
@@ -459,12 +844,52 @@ class PortageRepository(object):
 		# -- useful for categories, info_pkgs, and info_vars,
 		# but probably not what you want for package.mask :)
 
-		out = set(path.grabfile())
+		# key refers to a path in self.paths, so each overlay
+		# reads its own copy of the file. The contents of each
+		# file are cached as a frozenset along with the file's
+		# FilePath.stamp(), so a file is only re-read when it
+		# changes. The merged set is cached too, and is only
+		# rebuilt when one of the per-repository sets it was
+		# built from has been replaced. Call invalidate() to
+		# throw these caches away.
+
+		path = self.paths[key]
+		stamp = path.stamp()
+		cached = self._setcache.get(key)
+		if cached == None or cached[0] != stamp:
+			cached = self._setcache[key] = ( stamp, frozenset(path.grabfile()) )
+		parts = [ cached[1] ]
 		if recurse:
 			for overlay in self.overlays:
-				out = out | overlay.__grabset__(path)
+				parts.append(overlay.__grabset__(key))
+		if len(parts) == 1:
+			return parts[0]
+		cached = self._mergecache.get(key)
+		if cached != None and len(cached[0]) == len(parts):
+			for old, new in zip(cached[0],parts):
+				if old is not new:
+					break
+			else:
+				return cached[1]
+		out = set()
+		for part in parts:
+			out.update(part)
+		out = frozenset(out)
+		self._mergecache[key] = ( parts, out )
 		return out
 
+	def invalidate(self,recurse=True):
+
+		# Throws away cached repository data, so that it is re-read
+		# when next needed. By default, overlays are invalidated too.
+
+		self._setcache = {}
+		self._mergecache = {}
+		self._owners = {}
+		if recurse:
+			for overlay in self.overlays:
+				overlay.invalidate(recurse)
+
 	def getList(self,otype,qlist,recurse=True):
 
 		# getList() implements the generic recursive overlay lookup
@@ -487,12 +912,50 @@ class PortageRepository(object):
 		# it can efficiently handle bulk queries. If you just want to
 		# query one thing, then pass it a single-item list.
 
-		atoms = set()
+		return set(self.iterList(otype,qlist,recurse))
+
+	def iterList(self,otype,qlist=None,recurse=True):
+
+		# iterList() is a generator version of getList(). Rather than
+		# building the full result before returning anything, objects
+		# are yielded as the underlying directories are read, from the
+		# highest-precedence overlay down to this repository. Objects
+		# found in more than one repository are only yielded once.
+		#
+		# >>> for atom in repo.iterList(PkgAtom):
+		# ...	print atom
+		#
+		# If qlist is None, all objects of type otype are listed: all
+		# CatPkgs in all categories, or all PkgAtoms in the tree.
+		# Every repository is listed using the categories of this
+		# repository and its overlays.
+		#
+		# For EClassAtoms, qlist is a list of eclasses (EClassAtoms or
+		# names), and those that exist are yielded.
+
+		if qlist != None:
+			qlist = list(qlist)
+		elif otype in ( CatPkg, PkgAtom ):
+			categories = self.categories
 		if recurse:
-			for overlay in self.atom_map[otype].overlays:
-				atoms = atoms | overlay.getList(otype,qlist,recurse)
-		atoms = atoms | set(self.atom_map[otype].list(qlist))
-		return atoms
+			repos = self._stack(otype)
+		else:
+			repos = [ self ]
+		seen = set()
+		for repo in repos:
+			adapter = repo.atom_map[otype]
+			if qlist != None:
+				atoms = adapter.iter(qlist)
+			elif otype == CatPkg:
+				atoms = adapter.iter(categories)
+			elif otype == PkgAtom:
+				atoms = adapter.iter(repo.atom_map[CatPkg].iter(categories))
+			else:
+				atoms = adapter.iter()
+			for atom in atoms:
+				if atom not in seen:
+					seen.add(atom)
+					yield atom
 
 	def getRef(self,atom,recurse=True,**args):
 
@@ -517,16 +980,83 @@ class PortageRepository(object):
 		# print repo.getRef(EClassAtom("autotools")) print
 		# repo.getRef(CatPkg("sys-libs/glibc"))
 
+		# Probing each overlay costs a stat() per overlay for every
+		# lookup. If self.refindex is True, the first recursive lookup
+		# of a type of object instead lists that type across the whole
+		# overlay stack and records which repository owns each object,
+		# after which getRef() is a dict lookup. Objects added to the
+		# repositories after the index is built won't be found until
+		# invalidate() is called.
+
+		adapter = self.atom_map[type(atom)]
+		if recurse and self.refindex:
+			repo = self._ownerIndex(type(atom)).get(adapter.key(atom))
+			if repo == None:
+				return None
+			return RepositoryObjRef(repo,atom,repo.atom_map[type(atom)].path(atom))
 		if recurse:
-			for overlay in self.atom_map[type(atom)].overlays:
+			for overlay in adapter.overlays:
 				ref = overlay.getRef(atom,recurse,**args)
 				if ref != None:
 					return ref
-			path = self.atom_map[type(atom)].has(atom, **args)
-			if path != None:
-				return RepositoryObjRef(self,atom,path)
-			else:
-				return None
+		path = adapter.has(atom, **args)
+		if path != None:
+			return RepositoryObjRef(self,atom,path)
+		else:
+			return None
+
+	def getMetadata(self,atom,keys=None,recurse=True):
+
+		# Returns the metadata of PkgAtom atom as a dictionary, taken
+		# from the repository that owns the ebuild (as found by
+		# getRef().) Returns None if the ebuild does not exist or has
+		# no cached metadata.
+		#
+		# >>> repo.getMetadata(PkgAtom("sys-apps/portage-2.1"),["SLOT","KEYWORDS"])
+		# {'SLOT': '0', 'KEYWORDS': 'amd64 x86'}
+
+		ref = self.getRef(atom,recurse)
+		if ref == None:
+			return None
+		return ref.repo._metadata(atom,keys)
+
+	def _stack(self,otype):
+
+		# Returns the repositories that getRef() looks at for otype, in
+		# order of precedence: overlays (and their overlays) first, then
+		# this repository.
+
+		out = []
+		for overlay in self.atom_map[otype].overlays:
+			out.extend(overlay._stack(otype))
+		out.append(self)
+		return out
+
+	def _ownerIndex(self,otype):
+
+		# Returns a dictionary mapping the key of every otype object in
+		# the overlay stack to the repository that owns it. Overlays
+		# often don't list the categories they use, so every repository
+		# is listed using the categories of the whole stack.
+
+		owners = self._owners.get(otype)
+		if owners == None:
+			owners = {}
+			categories = self.categories
+			for repo in self._stack(otype):
+				adapter = repo.atom_map[otype]
+				if otype == CatPkg:
+					atoms = adapter.iter(categories)
+				elif otype == PkgAtom:
+					atoms = adapter.iter(repo.atom_map[CatPkg].iter(categories))
+				else:
+					atoms = adapter.list()
+				for atom in atoms:
+					key = adapter.key(atom)
+					if key not in owners:
+						owners[key] = repo
+			self._owners[otype] = owners
+		return owners
 
 	# In a classic Portage tree, the categories and ebuilds in the tree are
 	# used to define the authoritative contents of the tree, but when you
@@ -1,5 +1,123 @@
 import os
+from collections import OrderedDict
 from access import *
+from portsmod import FrozenDict
+
+# Most profile files are "incremental": the files of a cascaded profile
+# are applied in order, parents first, and each line either adds an entry or,
+# if it starts with "-", removes an entry added by an earlier file. A line
+# of "-*" removes everything added so far. The collapse_*() functions
+# below take the list of FilePaths returned by PortageProfile._cascade()
+# and return the merged result, which PortageProfile.collapse() memoizes.
+# Results are frozen (tuples and FrozenDicts) since they are shared.
+
+# Profile files are shared by many profiles (every profile has base/ in its
+# cascade), so each file's lines are read once, and cached by disk path along
+# with the file's stamp.
+
+_lines = {}
+
+def profile_lines(path):
+
+	# Returns the lines of FilePath path (or of the files in directory
+	# path), split into tokens, minus blank lines and comments.
+
+	stamp = path.stamp()
+	cached = _lines.get(path.diskpath)
+	if cached != None and cached[0] == stamp:
+		return cached[1]
+	out = []
+	for line in path.grabfile():
+		line = line.split("#",1)[0].split()
+		if line:
+			out.append(tuple(line))
+	_lines[path.diskpath] = ( stamp, out )
+	return out
+
+def _incremental(entries,token):
+	# Applies a single incremental token to entries, an OrderedDict used
+	# as an ordered set so that large files such as package.mask collapse
+	# in linear time.
+	if token == "-*":
+		entries.clear()
+	elif token[0] == "-":
+		entries.pop(token[1:],None)
+	elif token not in entries:
+		entries[token] = None
+
+def collapse_incremental(paths):
+
+	# For files with one entry per line, such as package.mask, use.mask,
+	# use.force and packages. Returns a tuple of entries, in the order
+	# they were added.
+
+	entries = OrderedDict()
+	for path in paths:
+		for line in profile_lines(path):
+			_incremental(entries,line[0])
+	return tuple(entries.keys())
+
+def collapse_atom_flags(paths):
+
+	# For package.use and friends: each line is an atom followed by USE
+	# flags, which are incremental per atom ("-flag" and "-*" only affect
+	# the flags of the same atom.) An entry of "-atom" on its own removes
+	# the atom entirely. Returns a FrozenDict of atom -> tuple of flags.
+
+	atoms = OrderedDict()
+	for path in paths:
+		for line in profile_lines(path):
+			atom = line[0]
+			if len(line) == 1 and atom[0] == "-":
+				if atom == "-*":
+					atoms.clear()
+				else:
+					atoms.pop(atom[1:],None)
+				continue
+			if atom not in atoms:
+				atoms[atom] = OrderedDict()
+			for flag in line[1:]:
+				_incremental(atoms[atom],flag)
+	return FrozenDict(( atom, tuple(flags.keys()) ) for atom, flags in atoms.items())
+
+def collapse_virtuals(paths):
+
+	# For virtuals: each line is a virtual followed by its default
+	# providers. Providers listed by later (more specific) profiles take
+	# precedence, so they are placed first. Returns a FrozenDict of
+	# virtual -> tuple of providers.
+
+	virtuals = {}
+	for path in paths:
+		for line in profile_lines(path):
+			virtual = line[0]
+			if virtual == "-*":
+				virtuals = {}
+				continue
+			if virtual[0] == "-":
+				if virtual[1:] in virtuals:
+					del virtuals[virtual[1:]]
+				continue
+			providers = virtuals.get(virtual,[])
+			for provider in reversed(line[1:]):
+				if provider[0] == "-":
+					if provider[1:] in providers:
+						providers.remove(provider[1:])
+					continue
+				if provider in providers:
+					providers.remove(provider)
+				providers.insert(0,provider)
+			virtuals[virtual] = providers
+	return FrozenDict(( virtual, tuple(providers) ) for virtual, providers in virtuals.items())
+
+def _dirstamp(path):
+	# Returns the mtime and size of FilePath path, or None if it doesn't
+	# exist. Unlike FilePath.stamp(), this doesn't look inside
+	# directories.
+	st = path.stat()
+	if st == None:
+		return None
+	return ( st.st_mtime, st.st_size )
 
 class PortageProfile(object):
 
@@ -8,30 +126,97 @@ class PortageProfile(object):
 	# PortageProfile object. This PortageProfile object can exist anywhere
 	# on the filesystem.
 
+	# Collapse functions for the incremental profile files that collapse()
+	# knows about:
+
+	collapsers = {
+		"virtuals" : collapse_virtuals,
+		"package.mask" : collapse_incremental,
+		"package.unmask" : collapse_incremental,
+		"packages" : collapse_incremental,
+		"use.mask" : collapse_incremental,
+		"use.force" : collapse_incremental,
+		"package.use" : collapse_atom_flags,
+		"package.use.mask" : collapse_atom_flags,
+		"package.use.force" : collapse_atom_flags,
+	}
+
+	# Profiles form a DAG: many profiles share ancestors such as "base" or
+	# "default/linux". PortageProfile objects are therefore interned by
+	# resolved disk path, so that PortageProfile(path) returns the same
+	# object for every path that refers to the same profile directory,
+	# and a shared ancestor is only read and cascaded once no matter how
+	# many profiles inherit from it. Parents are loaded lazily, the first
+	# time self.parents is used.
+
+	# Interned profiles live as long as the process, so each one records
+	# the stamps of its directory and parent file (see _dirstamp()) when
+	# it reads them, and rereads its parents and recomputes its cascades
+	# when either changes. Adding or removing a file in a profile
+	# directory changes the directory's mtime, so this is one stat() of
+	# each for every profile involved, as with ProfileSnapshot.
+
+	_interned = {}
+
 	def __repr__(self):
 		return "PortageProfile(%s)" % self.path
 
-	def __init__(self, path):
-		# self.path is a FilePath object (defined in access.py).
-		# self.path.base_path would point to e.g. "/usr/portage/profiles".
-		# self.path.path would point to e.g. "default/linux/x86/2008.0".
-		# self.path.diskpath would point to "/usr/portage/profiles/default/linux/x86/2008.0".
-		
-		self.path = path
-		self._cascaded_items = {}
-		
-		self.parents = [ ]
-		parent = self.path.adjpath("parent")
-		if parent.exists():
-			entries = parent.grabfile()
-			for entry in entries:
-				self.parents.append(PortageProfile(self.path.adjpath(entry)))
+	def __new__(cls, path):
+		# path is a FilePath object (defined in access.py).
+		# path.base_path would point to e.g. "/usr/portage/profiles".
+		# path.path would point to e.g. "default/linux/x86/2008.0".
+		# path.diskpath would point to "/usr/portage/profiles/default/linux/x86/2008.0".
+
+		return cls._node(os.path.realpath(path.diskpath),path)
+
+	@classmethod
+	def _node(cls,key,path):
+		# Returns the interned profile for resolved disk path key,
+		# creating it if necessary.
+		self = cls._interned.get(key)
+		if self is None:
+			self = object.__new__(cls)
+			self.key = key
+			self.path = path
+			self._cascaded_items = {}
+			self._collapsed = {}
+			self._parents = None
+			self._stamps = None
+			cls._interned[key] = self
+		return self
+
+	@classmethod
+	def clear(cls):
+		# Forgets all interned profiles, so that profiles are read again
+		# from disk the next time they are created.
+		cls._interned.clear()
+		_lines.clear()
+
+	def _validate(self):
+		# Forgets this profile's parents and cascades if its directory or
+		# parent file has changed since they were read.
+		stamps = ( _dirstamp(self.path), _dirstamp(self.path.adjpath("parent")) )
+		if stamps != self._stamps:
+			self._stamps = stamps
+			self._parents = None
+			self._cascaded_items = {}
+
+	@property
+	def parents(self):
+		self._validate()
+		if self._parents == None:
+			parents = [ ]
+			parent = self.path.adjpath("parent")
+			if parent.exists():
+				for entry in parent.grabfile():
+					entry = entry.strip()
+					if entry:
+						parents.append(PortageProfile(self.path.adjpath(entry)))
+			self._parents = parents
+		return self._parents
 
 	def __getitem__(self,path):
-		if path in self._cascaded_items:
-			return self._cascaded_items[path]
-		else:
-			return self._cascade(path)
+		return self._cascade(path)
 
 	def _cascade(self,filename):
 
@@ -42,24 +227,204 @@ class PortageProfile(object):
 		# absolute physical disk path to these files is returned in
 		# list form. Already-computed lists are stored in
 		# self._cascaded_items[filename], in case they are requested
-		# multiple times.
-
-		if filename not in self._cascaded_items:
-			found = []
-			for parent in self.parents:
-				parent_items = parent[filename]
-				if parent_items != None:
-					found.extend(parent_items)
-			myf = self.path.adjpath(filename)
-			if myf.exists():
-				found.append(myf)
-			self._cascaded_items[filename] = found
-		return self._cascaded_items[filename]
-
-	#@property
-	#def virtuals(self):
-#		virts = self._cascade("virtuals")
-#		return self.access.collapse_files(virts)
+		# multiple times. Since parents are interned, the lists of a
+		# common ancestor are computed once and shared by every profile
+		# that inherits from it. A stored list is reused as long as this
+		# profile hasn't changed (see _validate()) and each parent
+		# returns the same list it did when it was computed.
+
+		parents = self.parents
+		parts = [ parent._cascade(filename) for parent in parents ]
+		cached = self._cascaded_items.get(filename)
+		if cached != None and len(cached[0]) == len(parts):
+			for old, new in zip(cached[0],parts):
+				if old is not new:
+					break
+			else:
+				return cached[1]
+		found = []
+		for parent_items in parts:
+			found.extend(parent_items)
+		myf = self.path.adjpath(filename)
+		if myf.exists():
+			found.append(myf)
+		self._cascaded_items[filename] = ( parts, found )
+		return found
+
+	def collapse(self,filename):
+
+		# Returns the merged contents of filename across the cascaded
+		# profile, using the collapse function for filename from
+		# self.collapsers. The result is memoized, and is recomputed only
+		# if one of the cascaded files has changed on disk.
+
+		paths = self._cascade(filename)
+		stamps = [ ( path.diskpath, path.stamp() ) for path in paths ]
+		cached = self._collapsed.get(filename)
+		if cached != None and cached[0] == stamps:
+			return cached[1]
+		result = self.collapsers[filename](paths)
+		self._collapsed[filename] = ( stamps, result )
+		return result
+
+	def ancestors(self):
+		# Returns this profile and every profile it inherits from, each
+		# once, parents first.
+		out = []
+		seen = set()
+		def walk(profile):
+			if profile.key in seen:
+				return
+			seen.add(profile.key)
+			for parent in profile.parents:
+				walk(parent)
+			out.append(profile)
+		walk(self)
+		return out
+
+	@property
+	def virtuals(self):
+		return self.collapse("virtuals")
+
+	@property
+	def package_mask(self):
+		return self.collapse("package.mask")
+
+	@property
+	def package_use(self):
+		return self.collapse("package.use")
+
+	@property
+	def use_mask(self):
+		return self.collapse("use.mask")
+
+	@property
+	def use_force(self):
+		return self.collapse("use.force")
+
+	@property
+	def packages(self):
+		return self.collapse("packages")
+
+class ProfileSnapshot(object):
+
+	# A ProfileSnapshot is a compiled copy of a resolved PortageProfile,
+	# stored in a single marshal-format file: the profile's parent graph
+	# and the cascaded file lists of every profile in it. Loading a
+	# snapshot rebuilds the interned PortageProfile objects directly,
+	# without reading parent files or checking which files exist. The
+	# contents of the files are still read on demand; in particular,
+	# make.defaults variables depend on make.globals and make.conf, and
+	# are expanded by DistroAdapter.complete_config. Its layout is:
+	#
+	# { "version" : 2, "profile" : key,
+	#   "nodes" : { key : [ base_path, path, [ parent key, ... ], { filename : [ ( base_path, path ), ... ] } ] },
+	#   "stamps" : [ ( diskpath, mtime, size ), ... ] }
+	#
+	# where key is the resolved disk path of a profile (see
+	# PortageProfile.__new__().) stamps records every profile directory
+	# and parent file. Creating or removing a file in a
+	# profile directory changes the directory's mtime, so the snapshot
+	# is fresh as long as every recorded stamp is unchanged, which is
+	# one stat() per entry.
+	#
+	# Use it like this:
+	#
+	# >>> s = ProfileSnapshot(FilePath("/var/cache/funports/profile.snapshot"))
+	# >>> profile = s.load(profpath)
+	# >>> if profile == None:
+	# ...	profile = PortageProfile(profpath)
+	# ...	s.save(profile)
+
+	version = 2
+
+	# The files whose cascades are compiled into the snapshot. Cascades
+	# of other files are computed on demand, as usual.
+
+	files = [ "make.defaults", "virtuals", "package.mask", "package.unmask", "packages", "use.mask",
+		"use.force", "package.use", "package.use.mask", "package.use.force", "package.provided" ]
+
+	def __repr__(self):
+		return "ProfileSnapshot(%s)" % self.path.diskpath
+
+	def __init__(self,path):
+		# self.path is a FilePath pointing to the snapshot file itself.
+		self.path = path
+
+	def _read(self):
+		return self.path.loadmarshal(self.version)
+
+	def _stamp(self,diskpath):
+		stamp = _dirstamp(FilePath(diskpath))
+		if stamp == None:
+			return None
+		return ( diskpath, ) + stamp
+
+	def fresh(self,data):
+		# Returns True if none of the files and directories recorded in
+		# snapshot data have changed.
+		for stamp in data["stamps"]:
+			if self._stamp(stamp[0]) != tuple(stamp):
+				return False
+		return True
+
+	def load(self,path=None):
+
+		# Returns the PortageProfile stored in the snapshot, or None if
+		# there is no usable snapshot, if it is stale, or if FilePath
+		# path is specified and the snapshot is of a different profile.
+
+		data = self._read()
+		if data == None:
+			return None
+		if path != None and os.path.realpath(path.diskpath) != data["profile"]:
+			return None
+		if not self.fresh(data):
+			return None
+		nodes = data["nodes"]
+		stamps = dict(( stamp[0], tuple(stamp[1:]) ) for stamp in data["stamps"])
+		built = {}
+		def build(key):
+			# parents are built first, so that each cascade can refer to
+			# its parents' lists (see PortageProfile._cascade().)
+			if key in built:
+				return built[key]
+			node = nodes[key]
+			profile = PortageProfile._node(key,FilePath(node[1],base_path=node[0]))
+			parents = [ build(pkey) for pkey in node[2] ]
+			profile._stamps = ( stamps.get(profile.path.diskpath), stamps.get(profile.path.adjpath("parent").diskpath) )
+			profile._parents = parents
+			profile._cascaded_items = {}
+			for filename, paths in node[3].items():
+				profile._cascaded_items[filename] = ( [ parent._cascaded_items[filename][1] for parent in parents ],
+					[ FilePath(p,base_path=b) for b, p in paths ] )
+			built[key] = profile
+			return profile
+		return build(data["profile"])
+
+	def save(self,profile):
+
+		# Compiles PortageProfile profile into the snapshot file, using a
+		# temporary file and a rename so that concurrent readers never
+		# see a partial snapshot.
+
+		nodes = {}
+		stamps = {}
+		for node in profile.ancestors():
+			cascades = {}
+			for filename in self.files:
+				cascades[filename] = [ ( path.base_path, path.path ) for path in node[filename] ]
+			nodes[node.key] = [ node.path.base_path, node.path.path, [ parent.key for parent in node.parents ], cascades ]
+			for path in ( node.path, node.path.adjpath("parent") ):
+				stamp = self._stamp(path.diskpath)
+				if stamp != None:
+					stamps[path.diskpath] = stamp
+		data = {
+			"profile" : profile.key,
+			"nodes" : nodes,
+			"stamps" : stamps.values()
+		}
+		self.path.savemarshal(self.version,data)
 
 if __name__ == "__main__":
 	a=PortageProfile(FilePath("default/linux/amd64/2008.0",base_path="/var/git/portage-mini-2010/profiles"))
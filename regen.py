@@ -0,0 +1,373 @@
+#!/usr/bin/python2
+
+# Copyright 2010 Daniel Robbins, Funtoo Technologies, LLC.
+#
+# FUNTOO TECHNOLOGIES INTERNAL SOURCE CODE
+# ALPHA - DO NOT RELEASE - NOT FOR DISTRIBUTION
+#
+# The unauthorized reproduction or distribution of this copyrighted work is
+# illegal, and may result in civil or criminal liability.
+
+import os
+import fcntl
+import select
+import hashlib
+import subprocess
+import multiprocessing
+from grp import getgrnam
+
+import metadata
+from portsmod import *
+
+# This module regenerates stale metadata, as described at the end of
+# portsmod.py: for each ebuild whose metadata is missing or out of date,
+# "ebuild.sh depend" is run, which sources the ebuild and writes its
+# metadata to file descriptor 9 in flat list format (see metadata.py), and
+# the result is stored in the repository's metadata cache.
+#
+# Sourcing an ebuild takes a process and a shell, so many of them are run
+# at once, up to one per CPU by default, and results are stored as they
+# arrive rather than when the whole run is done:
+#
+# >>> r = MetadataRegenerator(repo,state=FilePath("/var/cache/funports/regen.state"))
+# >>> for pkgatom, data in r.regen(r.stale()):
+# ...	print pkgatom, data != None
+#
+# To decide what is stale, the regenerator remembers the SHA1 of each
+# ebuild and of each eclass it inherited when its metadata was generated.
+# Files are only hashed when their stamp (mtime and size) has changed.
+# Checking every ebuild still means a stat() of each one; after an eclass
+# commit, an EClassIndex can narrow the candidates to the ebuilds that
+# use the changed eclasses:
+#
+# >>> index = EClassIndex(repo,FilePath("/var/cache/funports/eclass.idx"))
+# >>> r = MetadataRegenerator(repo,index=index)
+# >>> changed = index.changed()
+# >>> r.run(index.affected(changed))
+# >>> index.refresh(changed)
+# >>> index.save()
+#
+# The regenerator keeps the index's ebuild entries up to date, but only
+# refresh() records the new state of the changed eclasses; without it,
+# the same eclasses are reported by changed() on every run.
+
+def _fd9(fd):
+	# Makes fd available as fd 9 across exec() in the child process.
+	if fd == 9:
+		fcntl.fcntl(fd,fcntl.F_SETFD,fcntl.fcntl(fd,fcntl.F_GETFD) & ~fcntl.FD_CLOEXEC)
+	else:
+		os.dup2(fd,9)
+
+class RegenState(object):
+
+	# RegenState is stored in a single marshal-format file, laid out like
+	# this:
+	#
+	# { "version" : 1,
+	#   "files" : { diskpath : [ stamp, sha1 ] },
+	#   "ebuilds" : { "cat/pf" : [ sha1, { eclass : sha1 } ] } }
+
+	version = 1
+
+	def __repr__(self):
+		return "RegenState(%s)" % self.path.diskpath
+
+	def __init__(self,path):
+		# self.path is a FilePath pointing to the state file itself.
+		self.path = path
+		self.dirty = False
+		self._files = None
+		self._ebuilds = None
+
+	def _load(self):
+		self._files = {}
+		self._ebuilds = {}
+		data = self.path.loadmarshal(self.version)
+		if data != None:
+			self._files = data["files"]
+			self._ebuilds = data["ebuilds"]
+		elif self.path.exists():
+			# unreadable, truncated or old state - everything is stale:
+			self.dirty = True
+
+	def digest(self,path):
+
+		# Returns the SHA1 of FilePath path, or None if it doesn't exist,
+		# reading the file only if its stamp has changed.
+
+		if self._files == None:
+			self._load()
+		stamp = path.stamp()
+		if stamp == None:
+			return None
+		entry = self._files.get(path.diskpath)
+		if entry != None and entry[0] == stamp:
+			return entry[1]
+		a = path.open("rb")
+		try:
+			digest = hashlib.sha1(a.read()).hexdigest()
+		finally:
+			a.close()
+		self._files[path.diskpath] = [ stamp, digest ]
+		self.dirty = True
+		return digest
+
+	def get(self,key):
+		if self._ebuilds == None:
+			self._load()
+		return self._ebuilds.get(key)
+
+	def set(self,key,record):
+		if self._ebuilds == None:
+			self._load()
+		if record == None:
+			if self._ebuilds.pop(key,None) == None:
+				return
+		else:
+			self._ebuilds[key] = record
+		self.dirty = True
+
+	def invalidate(self):
+		self._files = {}
+		self._ebuilds = {}
+		self.dirty = True
+
+	def save(self):
+
+		# Writes the state back to disk if anything changed (see
+		# FilePath.savemarshal().)
+
+		if not self.dirty or self._files == None:
+			return
+		self.path.savemarshal(self.version,{ "files" : self._files, "ebuilds" : self._ebuilds })
+		self.dirty = False
+
+class RegenJob(object):
+
+	# A single running "ebuild.sh depend", and what it has written to fd 9
+	# so far.
+
+	def __init__(self,pkgatom,proc,fd):
+		self.pkgatom = pkgatom
+		self.proc = proc
+		self.fd = fd
+		self.chunks = []
+
+class MetadataRegenerator(object):
+
+	def __repr__(self):
+		return "MetadataRegenerator(%s,jobs=%s)" % ( self.repo, self.jobs )
+
+	def __init__(self,repo,state=None,ebuild_sh="/usr/lib/portage/bin/ebuild.sh",jobs=None,env={},batch=100,index=None):
+
+		# repo is the PortageRepository whose own ebuilds (not those of
+		# its overlays) are regenerated, into its own metadata cache.
+		# Eclasses are looked up across its eclass overlays, like
+		# getRef() does. state is a FilePath for the RegenState; by
+		# default it is metadata/regen.state in the repository. Up to
+		# jobs copies of ebuild_sh run at once, defaulting to the number
+		# of CPUs. env is added to the environment of ebuild_sh, and
+		# stored metadata is flushed every batch ebuilds. If index is an
+		# EClassIndex (see eclassindex.py), it is kept up to date with
+		# the INHERITED metadata of each regenerated ebuild.
+
+		self.repo = repo
+		if state == None:
+			state = repo.path.adjpath("metadata/regen.state")
+		self.state = RegenState(state)
+		self.ebuild_sh = ebuild_sh
+		if jobs == None:
+			jobs = multiprocessing.cpu_count()
+		self.jobs = jobs
+		self.env = env
+		self.batch = batch
+		self.index = index
+		self._eclasses = {}
+
+	def _ebuild(self,pkgatom):
+		return self.repo.path.adjpath("%s/%s/%s.ebuild" % ( pkgatom.cat, pkgatom.p, pkgatom.pf ))
+
+	def _eclass(self,name):
+
+		# Returns the SHA1 of the eclass called name, as resolved across
+		# the eclass overlays, or None if there is no such eclass. Each
+		# eclass is looked at once per run.
+
+		if name not in self._eclasses:
+			ref = self.repo.getRef(EClassAtom(name))
+			if ref == None:
+				self._eclasses[name] = None
+			else:
+				self._eclasses[name] = self.state.digest(ref.repo.paths["eclass_dir"].adjpath("%s.eclass" % name))
+		return self._eclasses[name]
+
+	def isStale(self,pkgatom):
+
+		# Returns True if the cached metadata of PkgAtom pkgatom is
+		# missing, or the ebuild or any eclass it inherited has changed
+		# since it was generated.
+
+		record = self.state.get("%s/%s" % ( pkgatom.cat, pkgatom.pf ))
+		if record == None or self.state.digest(self._ebuild(pkgatom)) != record[0]:
+			return True
+		for name, digest in record[1].items():
+			if self._eclass(name) != digest:
+				return True
+		return self.repo._metadata(pkgatom,["INHERITED"]) == None
+
+	def stale(self,atoms=None):
+
+		# Yields the PkgAtoms in atoms (by default, every ebuild in the
+		# repository) whose metadata is stale.
+
+		self._eclasses = {}
+		if atoms == None:
+			atoms = self.repo.iterList(PkgAtom,recurse=False)
+		for pkgatom in atoms:
+			if self.isStale(pkgatom):
+				yield pkgatom
+
+	def _environ(self,pkgatom):
+		repo = self.repo
+		overlays = [ overlay.path.diskpath for overlay in repo._stack(EClassAtom)[:-1] ]
+		overlays.reverse()
+		env = {
+			"PATH" : os.environ.get("PATH","/bin:/usr/bin"),
+			"PORTAGE_TMPDIR" : "/var/tmp/portage",
+			"EBUILD" : self._ebuild(pkgatom).diskpath,
+			"EBUILD_PHASE" : "depend",
+			"ECLASSDIR" : repo.paths["eclass_dir"].diskpath,
+			"PORTDIR" : repo.path.diskpath,
+			"PORTDIR_OVERLAY" : " ".join(overlays),
+			"CATEGORY" : pkgatom.cat,
+			"PF" : pkgatom.pf,
+			"PN" : pkgatom.p,
+			"P" : "%s-%s" % ( pkgatom.p, pkgatom.pv ),
+			"PV" : pkgatom.pv,
+			"PR" : pkgatom.pr
+		}
+		try:
+			env["PORTAGE_GID"] = repr(getgrnam("portage")[2])
+		except KeyError:
+			pass
+		env.update(self.env)
+		return env
+
+	def _spawn(self,pkgatom):
+
+		# Starts "ebuild.sh depend" for pkgatom, with the write end of a
+		# pipe as its fd 9. Both ends are close-on-exec, so that other
+		# jobs don't inherit them and each pipe sees EOF as soon as its
+		# own job exits; _fd9() clears the flag on fd 9.
+
+		pr, pw = os.pipe()
+		for fd in ( pr, pw ):
+			fcntl.fcntl(fd,fcntl.F_SETFD,fcntl.fcntl(fd,fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+		devnull = open(os.devnull,"r")
+		try:
+			proc = subprocess.Popen([ self.ebuild_sh, "depend" ],env=self._environ(pkgatom),stdin=devnull,
+				close_fds=False,preexec_fn=lambda: _fd9(pw))
+		finally:
+			devnull.close()
+			os.close(pw)
+		return RegenJob(pkgatom,proc,pr)
+
+	def _finish(self,job):
+
+		# Stores the result of a job that has exited, and returns its
+		# metadata, or None if ebuild.sh failed.
+
+		os.close(job.fd)
+		data = None
+		if job.proc.wait() == 0 and job.chunks:
+			data = metadata.parse_flat_list("".join(job.chunks))
+		key = "%s/%s" % ( job.pkgatom.cat, job.pkgatom.pf )
+		if data == None:
+			self.state.set(key,None)
+			return None
+		self.repo._store_metadata(job.pkgatom,data)
+		if self.index != None:
+			self.index.set(job.pkgatom,data.get("INHERITED","").split())
+		eclasses = dict(( name, self._eclass(name) ) for name in data.get("INHERITED","").split())
+		self.state.set(key,[ self.state.digest(self._ebuild(job.pkgatom)), eclasses ])
+		return data
+
+	def regen(self,atoms):
+
+		# Regenerates the metadata of each PkgAtom in atoms, and yields a
+		# ( pkgatom, data ) tuple as each one completes, where data is
+		# the new metadata, or None if ebuild.sh failed. Results arrive
+		# in completion order, not the order of atoms. Atoms without a
+		# version (i.e. from a misnamed ebuild) fail without running
+		# ebuild.sh, since there is no P or PV to give it.
+
+		self._eclasses = {}
+		atoms = iter(atoms)
+		running = {}
+		stored = 0
+		try:
+			while True:
+				while atoms != None and len(running) < self.jobs:
+					try:
+						pkgatom = atoms.next()
+					except StopIteration:
+						atoms = None
+						break
+					if pkgatom.pv == None:
+						yield pkgatom, None
+						continue
+					job = self._spawn(pkgatom)
+					running[job.fd] = job
+				if not running:
+					break
+				for fd in select.select(running.keys(),[],[])[0]:
+					job = running[fd]
+					chunk = os.read(fd,65536)
+					if chunk:
+						job.chunks.append(chunk)
+						continue
+					del running[fd]
+					data = self._finish(job)
+					if data != None:
+						stored += 1
+						if stored % self.batch == 0:
+							self.repo._flush_metadata()
+					yield job.pkgatom, data
+		finally:
+			for job in running.values():
+				try:
+					job.proc.kill()
+				except OSError:
+					pass
+				job.proc.wait()
+				os.close(job.fd)
+			self.repo._flush_metadata()
+			self.state.save()
+			if self.index != None:
+				self.index.save()
+
+	def run(self,atoms=None):
+
+		# Regenerates whatever is stale among atoms (by default, the
+		# whole repository), and returns a tuple of the number of ebuilds
+		# regenerated and a list of those for which ebuild.sh failed.
+
+		count = 0
+		failed = []
+		for pkgatom, data in self.regen(self.stale(atoms)):
+			if data == None:
+				failed.append(pkgatom)
+			else:
+				count += 1
+		return count, failed
+
+if __name__ == "__main__":
+	import sys
+	from access import FilePath
+	if len(sys.argv) != 2:
+		print "usage: regen.py <tree>"
+		sys.exit(1)
+	count, failed = MetadataRegenerator(PortageRepository(FilePath(os.path.abspath(sys.argv[1])))).run()
+	print count, "regenerated"
+	for pkgatom in failed:
+		print "failed:", pkgatom
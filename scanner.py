@@ -0,0 +1,132 @@
+#!/usr/bin/python2
+
+# Copyright 2010 Daniel Robbins, Funtoo Technologies, LLC.
+#
+# FUNTOO TECHNOLOGIES INTERNAL SOURCE CODE
+# ALPHA - DO NOT RELEASE - NOT FOR DISTRIBUTION
+#
+# The unauthorized reproduction or distribution of this copyrighted work is
+# illegal, and may result in civil or criminal liability.
+
+import threading
+import Queue
+from collections import deque
+
+class ScanJob(object):
+
+	# A single directory read, queued by DirectoryScanner.scan() and
+	# completed by one of the worker threads.
+
+	def __init__(self,key,path,dironly):
+		self.key = key
+		self.path = path
+		self.dironly = dironly
+		self.result = None
+		self.error = None
+		self.done = threading.Event()
+
+	def run(self):
+		try:
+			if self.dironly:
+				self.result = [ name for name, isdir in self.path.scandir() if isdir ]
+			else:
+				self.result = self.path.listdir()
+		except OSError:
+			# missing or unreadable directory - result stays None
+			pass
+		except Exception, e:
+			self.error = e
+		self.done.set()
+
+class DirectoryScanner(object):
+
+	# DirectoryScanner reads many directories at once. On NFS-backed and
+	# cold-cache trees, each listdir() spends most of its time waiting on
+	# I/O, so rather than reading directories one after another we hand
+	# them to a bounded pool of worker threads (listdir() releases the
+	# GIL while it waits) and stream the results back to the caller in
+	# the same order the directories were requested.
+	#
+	# Use it like this:
+	#
+	# >>> s = DirectoryScanner(threads=16)
+	# >>> for cat, pkgs in s.scan([ ( cat, repo.path.adjpath(cat) ) for cat in cats ], dironly=True):
+	# ...	print cat, pkgs
+	#
+	# scan() yields (key, entries) tuples, where entries is None if the
+	# directory does not exist. With dironly=True, only subdirectories are
+	# returned, using FilePath.scandir() so that d_type information
+	# replaces a separate isdir() call per entry.
+	#
+	# A DirectoryScanner with threads=1 reads directories serially in the
+	# calling thread, and is what PortageRepository uses by default.
+
+	def __repr__(self):
+		return "DirectoryScanner(threads=%s)" % self.threads
+
+	def __init__(self,threads=8,window=None):
+		# window is the maximum number of directory reads that may be
+		# queued ahead of the consumer.
+		self.threads = threads
+		if window == None:
+			window = threads * 4
+		self.window = window
+		self._queue = None
+		self._lock = threading.Lock()
+
+	def _start(self):
+		self._lock.acquire()
+		try:
+			if self._queue != None:
+				return
+			self._queue = Queue.Queue()
+			for i in range(self.threads):
+				t = threading.Thread(target=self._worker,args=(self._queue,))
+				t.setDaemon(True)
+				t.start()
+		finally:
+			self._lock.release()
+
+	def _worker(self,queue):
+		while True:
+			job = queue.get()
+			if job == None:
+				return
+			job.run()
+
+	def close(self):
+		# Stops the worker threads. They are started again if scan() is
+		# called later.
+		self._lock.acquire()
+		try:
+			if self._queue == None:
+				return
+			for i in range(self.threads):
+				self._queue.put(None)
+			self._queue = None
+		finally:
+			self._lock.release()
+
+	def _finish(self,job):
+		job.done.wait()
+		if job.error != None:
+			raise job.error
+		return job.key, job.result
+
+	def scan(self,jobs,dironly=False):
+		if self.threads <= 1:
+			for key, path in jobs:
+				job = ScanJob(key,path,dironly)
+				job.run()
+				yield self._finish(job)
+			return
+		self._start()
+		pending = deque()
+		for key, path in jobs:
+			job = ScanJob(key,path,dironly)
+			self._queue.put(job)
+			pending.append(job)
+			if len(pending) >= self.window:
+				yield self._finish(pending.popleft())
+		while len(pending):
+			yield self._finish(pending.popleft())
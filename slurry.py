@@ -0,0 +1,383 @@
+#!/usr/bin/python2
+
+# Copyright 2010 Daniel Robbins, Funtoo Technologies, LLC.
+#
+# FUNTOO TECHNOLOGIES INTERNAL SOURCE CODE
+# ALPHA - DO NOT RELEASE - NOT FOR DISTRIBUTION
+#
+# The unauthorized reproduction or distribution of this copyrighted work is
+# illegal, and may result in civil or criminal liability.
+
+import os
+import json
+import zlib
+import hashlib
+import urllib2
+
+import metadata
+from portsmod import PkgAtom
+
+# This module implements the "changeset-slurry" sync protocol for metadata
+# bundles, the "wimpy git" described in metadata.txt. Rather than
+# downloading the whole SQLite bundle on every sync, the client downloads a
+# compressed changeset containing only the ebuilds whose metadata was
+# added, changed or removed since its last sync, and applies it to its
+# local SQLiteMetadataCache (see sqliterepo.py).
+#
+# Every ebuild's metadata is addressed by a SHA1 of its contents, and the
+# whole cache by a "head" SHA1 computed from the sorted list of
+# "<cat>/<pf> <sha1>" lines, much like a git tree. A server publishes its
+# current head in a JSON "heads" file, in the format described in
+# glep-0062-drobbins.txt:
+#
+# { "head" : { "cache" : "<sha1>" } }
+#
+# along with, in the cache/ directory:
+#
+# <head>.slurry		a full changeset, for clients with no usable head
+# <old>-<head>.slurry	a changeset from each of the last few heads
+# <head>.manifest	the manifest of <head>, used to create the next changesets
+#
+# A changeset is zlib-compressed JSON:
+#
+# { "version" : 1, "from" : <sha1 or null>, "to" : <sha1>, "keys" : [ key, ... ],
+#   "set" : [ [ cat, pf, [ value, ... ] ], ... ], "delete" : [ [ cat, pf ], ... ] }
+#
+# The client records the SHA1 of each ebuild it has, so after applying a
+# changeset it can compute its new head and check it against the "to" head
+# before committing. A changeset is applied in a single transaction, so a
+# failed or interrupted sync leaves the cache as it was.
+#
+# On the server:
+#
+# >>> SlurryPublisher(FilePath("/var/www/slurry")).publish(cache)
+#
+# On the client:
+#
+# >>> SlurrySync(cache,HTTPTransport("http://pkg.funtoo.org/funtoo/slurry")).sync()
+
+version = 1
+
+class SlurryError(Exception):
+	pass
+
+def entry_sha1(values):
+	# Returns the SHA1 of a list of metadata values, in metadata.all_keys
+	# order.
+	return hashlib.sha1(json.dumps(values,separators=(",",":"))).hexdigest()
+
+def head_sha1(manifest):
+	# Returns the head SHA1 of manifest, a dictionary of ( cat, pf ) ->
+	# SHA1.
+	h = hashlib.sha1()
+	for key in sorted(manifest.keys()):
+		h.update("%s/%s %s\n" % ( key[0], key[1], manifest[key] ))
+	return h.hexdigest()
+
+def snapshot(cache):
+
+	# Returns a tuple of ( manifest, values ) for SQLiteMetadataCache
+	# cache, where manifest maps ( cat, pf ) to the SHA1 of the ebuild's
+	# metadata, and values maps ( cat, pf ) to the metadata values.
+
+	manifest = {}
+	values = {}
+	for cat, pf, data in cache.entries():
+		vals = [ data[key] for key in metadata.all_keys ]
+		manifest[( cat, pf )] = entry_sha1(vals)
+		values[( cat, pf )] = vals
+	return manifest, values
+
+def make_changeset(old,new,values):
+
+	# Returns a compressed changeset that turns manifest old into manifest
+	# new, where values holds the metadata values of new (see
+	# snapshot()). If old is None, the changeset contains every ebuild.
+
+	if old == None:
+		old = {}
+		start = None
+	else:
+		start = head_sha1(old)
+	changes = []
+	for key in sorted(new.keys()):
+		if old.get(key) != new[key]:
+			changes.append([ key[0], key[1], values[key] ])
+	deletes = [ list(key) for key in sorted(old.keys()) if key not in new ]
+	data = {
+		"version" : version,
+		"from" : start,
+		"to" : head_sha1(new),
+		"keys" : metadata.all_keys,
+		"set" : changes,
+		"delete" : deletes
+	}
+	return zlib.compress(json.dumps(data,separators=(",",":")),9)
+
+def _dump_manifest(manifest):
+	return zlib.compress(json.dumps([ [ key[0], key[1], sha ] for key, sha in sorted(manifest.items()) ],separators=(",",":")),9)
+
+def _load_manifest(data):
+	return dict(( ( cat, pf ), sha ) for cat, pf, sha in json.loads(zlib.decompress(data)))
+
+class SlurryPublisher(object):
+
+	# SlurryPublisher maintains the server side of a changeset-slurry
+	# sync in a local directory (FilePath path), which can then be served
+	# over HTTP as-is. Changesets to the current head are kept from the
+	# last self.keep heads; clients with an older head get the full
+	# changeset. Files for older heads are removed.
+
+	keep = 10
+
+	def __repr__(self):
+		return "SlurryPublisher(%s)" % self.path.diskpath
+
+	def __init__(self,path,branch="head"):
+		self.path = path
+		self.branch = branch
+
+	def _write(self,name,data):
+		# Writes a file atomically, so that clients never see a partial
+		# file.
+		self.path.adjpath(name).atomicwrite(data)
+
+	def _read(self,name):
+		try:
+			a = self.path.adjpath(name).open("rb")
+		except IOError:
+			return None
+		try:
+			return a.read()
+		finally:
+			a.close()
+
+	def heads(self):
+		data = self._read("heads")
+		if data == None:
+			return {}
+		return json.loads(data)
+
+	def publish(self,cache):
+
+		# Publishes the current contents of SQLiteMetadataCache cache as
+		# the new head, and returns the head SHA1. Changesets are written
+		# before the heads file is updated, so a client always finds the
+		# changesets for the head it sees.
+
+		cachedir = self.path.adjpath("cache")
+		if not cachedir.isdir():
+			os.makedirs(cachedir.diskpath)
+		manifest, values = snapshot(cache)
+		head = head_sha1(manifest)
+		heads = self.heads()
+		history = heads.get("history",{}).get(self.branch,[])
+		if history[-1:] == [ head ]:
+			return head
+		for old in history[-self.keep:]:
+			if old == head:
+				# the cache went back to an earlier state:
+				continue
+			data = self._read("cache/%s.manifest" % old)
+			if data == None:
+				continue
+			self._write("cache/%s-%s.slurry" % ( old, head ), make_changeset(_load_manifest(data),manifest,values))
+		self._write("cache/%s.slurry" % head, make_changeset(None,manifest,values))
+		self._write("cache/%s.manifest" % head, _dump_manifest(manifest))
+		history = ( history + [ head ] )[-self.keep:]
+		heads[self.branch] = { "cache" : head }
+		heads.setdefault("history",{})[self.branch] = history
+		self._write("heads",json.dumps(heads,indent=1,sort_keys=True))
+		self._prune(cachedir,head,history)
+		return head
+
+	def _prune(self,cachedir,head,history):
+
+		# Removes what clients can no longer use, once the heads file
+		# points at head: changesets to earlier heads (a client that
+		# still sees an earlier head falls back to its full changeset),
+		# and the full changeset and manifest of each head that has
+		# dropped out of history.
+
+		for name in cachedir.listdir():
+			if name[-7:] == ".slurry":
+				parts = name[:-7].split("-")
+				if len(parts) == 2:
+					keep = parts[1] == head
+				else:
+					keep = parts[0] in history
+			elif name[-9:] == ".manifest":
+				keep = name[:-9] in history
+			else:
+				continue
+			if not keep:
+				try:
+					os.unlink(cachedir.adjpath(name).diskpath)
+				except OSError:
+					pass
+
+class DirectoryTransport(object):
+
+	# Fetches files from a published slurry directory on the local
+	# filesystem (a FilePath.)
+
+	def __repr__(self):
+		return "DirectoryTransport(%s)" % self.path.diskpath
+
+	def __init__(self,path):
+		self.path = path
+
+	def fetch(self,name):
+		# Returns the contents of name, or None if it doesn't exist.
+		try:
+			a = self.path.adjpath(name).open("rb")
+		except IOError:
+			return None
+		try:
+			return a.read()
+		finally:
+			a.close()
+
+class HTTPTransport(object):
+
+	# Fetches files from a published slurry directory over HTTP.
+
+	def __repr__(self):
+		return "HTTPTransport(%s)" % self.url
+
+	def __init__(self,url,timeout=30):
+		self.url = url.rstrip("/")
+		self.timeout = timeout
+
+	def fetch(self,name):
+		try:
+			a = urllib2.urlopen("%s/%s" % ( self.url, name ),timeout=self.timeout)
+		except urllib2.HTTPError, e:
+			if e.code == 404:
+				return None
+			raise
+		try:
+			return a.read()
+		finally:
+			a.close()
+
+class SlurrySync(object):
+
+	# SlurrySync is the client side. It keeps the SHA1 of each ebuild in
+	# the local SQLiteMetadataCache in an extra table of the core bundle,
+	# along with the head it was last synced to.
+
+	def __repr__(self):
+		return "SlurrySync(%s,%s)" % ( self.cache, self.transport )
+
+	def __init__(self,cache,transport,branch="head"):
+		self.cache = cache
+		self.transport = transport
+		self.branch = branch
+		self._created = False
+
+	@property
+	def db(self):
+		db = self.cache.db
+		if not self._created:
+			db.execute("CREATE TABLE IF NOT EXISTS main.slurry_objects ( cat TEXT NOT NULL, pf TEXT NOT NULL, sha1 TEXT NOT NULL, PRIMARY KEY ( cat, pf ) )")
+			db.execute("CREATE TABLE IF NOT EXISTS main.slurry_heads ( branch TEXT PRIMARY KEY, head TEXT )")
+			db.commit()
+			self._created = True
+		return db
+
+	def head(self):
+		# Returns the head the local cache was last synced to, or None.
+		row = self.db.execute("SELECT head FROM slurry_heads WHERE branch = ?",( self.branch, )).fetchone()
+		if row == None:
+			return None
+		return row[0]
+
+	def _local_head(self):
+		h = hashlib.sha1()
+		for cat, pf, sha in self.db.execute("SELECT cat, pf, sha1 FROM slurry_objects ORDER BY cat, pf"):
+			h.update("%s/%s %s\n" % ( cat, pf, sha ))
+		return h.hexdigest()
+
+	def remote_head(self):
+		data = self.transport.fetch("heads")
+		if data == None:
+			raise SlurryError("%s has no heads file" % self.transport)
+		head = json.loads(data).get(self.branch,{}).get("cache")
+		if head == None:
+			raise SlurryError("%s has no %s head" % ( self.transport, self.branch ))
+		return head
+
+	def sync(self):
+
+		# Brings the local cache up to date with the remote head. Returns
+		# a tuple of ( number of ebuilds added or changed, number
+		# removed, bytes transferred ), or None if the cache was already
+		# up to date.
+
+		remote = self.remote_head()
+		local = self.head()
+		if local == remote:
+			return None
+		data = None
+		if local != None:
+			data = self.transport.fetch("cache/%s-%s.slurry" % ( local, remote ))
+		if data == None:
+			data = self.transport.fetch("cache/%s.slurry" % remote)
+		if data == None:
+			raise SlurryError("%s has no changeset for %s" % ( self.transport, remote ))
+		changes, deletes = self.apply(data)
+		return changes, deletes, len(data)
+
+	def apply(self,data):
+
+		# Applies compressed changeset data to the local cache in a
+		# single transaction, and returns the number of ebuilds set and
+		# deleted. The changeset's "to" head is checked against the
+		# resulting cache before it is committed.
+
+		changeset = json.loads(zlib.decompress(data))
+		if changeset.get("version") != version:
+			raise SlurryError("unsupported changeset version %s" % changeset.get("version"))
+		keys = [ str(key) for key in changeset["keys"] ]
+		db = self.db
+		with db:
+			if changeset["from"] == None:
+				# a full changeset replaces everything:
+				self.cache.clear()
+				db.execute("DELETE FROM slurry_objects")
+			elif changeset["from"] != self.head():
+				raise SlurryError("changeset is from %s, but the cache is at %s" % ( changeset["from"], self.head() ))
+			for cat, pf in changeset["delete"]:
+				cat, pf = str(cat), str(pf)
+				self.cache.delete(PkgAtom("%s/%s" % ( cat, pf )))
+				db.execute("DELETE FROM slurry_objects WHERE cat = ? AND pf = ?",( cat, pf ))
+			for cat, pf, values in changeset["set"]:
+				cat, pf = str(cat), str(pf)
+				values = [ value.encode("utf-8") for value in values ]
+				data = dict(zip(keys,values))
+				self.cache.set(PkgAtom("%s/%s" % ( cat, pf )),data)
+				db.execute("INSERT OR REPLACE INTO slurry_objects ( cat, pf, sha1 ) VALUES ( ?, ?, ? )",
+					( cat, pf, entry_sha1([ data.get(key,"") for key in metadata.all_keys ]) ))
+			head = self._local_head()
+			if head != changeset["to"]:
+				raise SlurryError("head mismatch after applying changeset: expected %s, got %s" % ( changeset["to"], head ))
+			db.execute("INSERT OR REPLACE INTO slurry_heads ( branch, head ) VALUES ( ?, ? )",( self.branch, head ))
+		return len(changeset["set"]), len(changeset["delete"])
+
+if __name__ == "__main__":
+	import sys
+	from access import FilePath
+	from sqliterepo import SQLiteMetadataCache
+	if len(sys.argv) != 4 or sys.argv[1] not in ( "publish", "sync" ):
+		print "usage: slurry.py publish <core.sqlite> <dir> | sync <core.sqlite> <url or dir>"
+		sys.exit(1)
+	cache = SQLiteMetadataCache(FilePath(os.path.abspath(sys.argv[2])))
+	if sys.argv[1] == "publish":
+		print SlurryPublisher(FilePath(os.path.abspath(sys.argv[3]))).publish(cache)
+	else:
+		if "://" in sys.argv[3]:
+			transport = HTTPTransport(sys.argv[3])
+		else:
+			transport = DirectoryTransport(FilePath(os.path.abspath(sys.argv[3])))
+		print SlurrySync(cache,transport).sync()
@@ -0,0 +1,288 @@
+#!/usr/bin/python2
+
+# Copyright 2010 Daniel Robbins, Funtoo Technologies, LLC.
+#
+# FUNTOO TECHNOLOGIES INTERNAL SOURCE CODE
+# ALPHA - DO NOT RELEASE - NOT FOR DISTRIBUTION
+#
+# The unauthorized reproduction or distribution of this copyrighted work is
+# illegal, and may result in civil or criminal liability.
+
+import sqlite3
+
+import metadata
+from portsmod import *
+
+# This module implements the "immutable tree" described at the end of
+# portsmod.py: a Portage repository where the metadata is the
+# authoritative source of what exists in the tree. Ebuild metadata lives
+# in two SQLite bundles (see metadata.txt) -- core.sqlite, holding what is
+# needed for dependency resolution, and desc.sqlite, holding DESCRIPTION
+# and HOMEPAGE. Existence checks, listings and metadata lookups are all
+# indexed queries, and no per-ebuild inodes are touched.
+
+class SQLiteMetadataCache(object):
+
+	# SQLiteMetadataCache wraps the core and desc bundles. The desc bundle
+	# is attached to the same connection as the core bundle, so that both
+	# can be updated in a single transaction:
+	#
+	# >>> cache = SQLiteMetadataCache(FilePath("/tmp/core.sqlite"),FilePath("/tmp/desc.sqlite"))
+	# >>> with cache.db:
+	# ...	cache.set(PkgAtom("sys-apps/portage-2.1"),{ "SLOT" : "0", "DESCRIPTION" : "Portage" })
+	#
+	# The desc bundle is optional; without it, DESCRIPTION and HOMEPAGE
+	# are returned as empty strings.
+
+	def __repr__(self):
+		return "SQLiteMetadataCache(%s)" % self.core.diskpath
+
+	def __init__(self,core,desc=None):
+		# core and desc are FilePaths pointing to the bundles.
+		self.core = core
+		self.desc = desc
+		self._db = None
+
+	@property
+	def db(self):
+		if self._db == None:
+			db = sqlite3.connect(self.core.diskpath)
+			db.text_factory = str
+			if self.desc != None:
+				db.execute("ATTACH DATABASE ? AS desc",( self.desc.diskpath, ))
+			self._create(db)
+			self._db = db
+		return self._db
+
+	def _create(self,db):
+		db.execute("CREATE TABLE IF NOT EXISTS main.pkgs ( cat TEXT NOT NULL, pkg TEXT NOT NULL, pf TEXT NOT NULL, %s, PRIMARY KEY ( cat, pf ) )" %
+			", ".join("%s TEXT" % key for key in metadata.core_keys))
+		db.execute("CREATE INDEX IF NOT EXISTS main.pkgs_catpkg ON pkgs ( cat, pkg )")
+		if self.desc != None:
+			db.execute("CREATE TABLE IF NOT EXISTS desc.descs ( cat TEXT NOT NULL, pf TEXT NOT NULL, %s, PRIMARY KEY ( cat, pf ) )" %
+				", ".join("%s TEXT" % key for key in metadata.desc_keys))
+		db.commit()
+
+	def close(self):
+		if self._db != None:
+			self._db.close()
+			self._db = None
+
+	def categories(self):
+		return [ row[0] for row in self.db.execute("SELECT DISTINCT cat FROM pkgs") ]
+
+	def pkgs(self,cat):
+		# Returns the package names in category cat.
+		return [ row[0] for row in self.db.execute("SELECT DISTINCT pkg FROM pkgs WHERE cat = ?",( cat, )) ]
+
+	def pfs(self,cat,pkg):
+		# Returns the ebuild names (i.e. "portage-2.1") in cat/pkg.
+		return [ row[0] for row in self.db.execute("SELECT pf FROM pkgs WHERE cat = ? AND pkg = ?",( cat, pkg )) ]
+
+	def hasCatPkg(self,cat,pkg):
+		return self.db.execute("SELECT 1 FROM pkgs WHERE cat = ? AND pkg = ? LIMIT 1",( cat, pkg )).fetchone() != None
+
+	def has(self,cat,pf):
+		return self.db.execute("SELECT 1 FROM pkgs WHERE cat = ? AND pf = ?",( cat, pf )).fetchone() != None
+
+	def get(self,cat,pf,keys=None):
+
+		# Returns the metadata of cat/pf as a dictionary, or None if it
+		# is not in the cache. If keys is specified, only those keys are
+		# returned.
+
+		if keys == None:
+			keys = metadata.all_keys
+		core = [ key for key in keys if key in metadata.core_keys ]
+		desc = [ key for key in keys if key in metadata.desc_keys ]
+		row = self.db.execute("SELECT %s FROM pkgs WHERE cat = ? AND pf = ?" % ", ".join([ "1" ] + core),( cat, pf )).fetchone()
+		if row == None:
+			return None
+		out = dict(zip(core,row[1:]))
+		if desc:
+			row = None
+			if self.desc != None:
+				row = self.db.execute("SELECT %s FROM descs WHERE cat = ? AND pf = ?" % ", ".join(desc),( cat, pf )).fetchone()
+			if row == None:
+				row = [ "" ] * len(desc)
+			out.update(zip(desc,row))
+		for key in keys:
+			if out.get(key) == None:
+				out[key] = ""
+		return out
+
+	def entries(self):
+
+		# Yields a ( cat, pf, data ) tuple for every ebuild in the cache,
+		# sorted by cat and pf, where data is a dictionary of all
+		# metadata keys.
+
+		core = ", ".join("pkgs.%s" % key for key in metadata.core_keys)
+		if self.desc != None:
+			query = "SELECT pkgs.cat, pkgs.pf, %s, %s FROM pkgs LEFT JOIN descs ON pkgs.cat = descs.cat AND pkgs.pf = descs.pf ORDER BY pkgs.cat, pkgs.pf" % ( core, ", ".join("descs.%s" % key for key in metadata.desc_keys) )
+			keys = metadata.all_keys
+		else:
+			query = "SELECT pkgs.cat, pkgs.pf, %s FROM pkgs ORDER BY pkgs.cat, pkgs.pf" % core
+			keys = metadata.core_keys
+		for row in self.db.execute(query):
+			data = dict(( key, "" ) for key in metadata.all_keys)
+			for key, value in zip(keys,row[2:]):
+				if value != None:
+					data[key] = value
+			yield row[0], row[1], data
+
+	def set(self,pkgatom,data):
+
+		# Adds or replaces the metadata for PkgAtom pkgatom. Missing keys
+		# are stored as empty strings. This does not commit; use the
+		# connection (self.db) as a context manager, or call commit().
+
+		self.db.execute("INSERT OR REPLACE INTO pkgs ( cat, pkg, pf, %s ) VALUES ( ?, ?, ?, %s )" %
+			( ", ".join(metadata.core_keys), ", ".join([ "?" ] * len(metadata.core_keys)) ),
+			[ pkgatom.cat, pkgatom.p, pkgatom.pf ] + [ data.get(key,"") for key in metadata.core_keys ])
+		if self.desc != None:
+			self.db.execute("INSERT OR REPLACE INTO descs ( cat, pf, %s ) VALUES ( ?, ?, %s )" %
+				( ", ".join(metadata.desc_keys), ", ".join([ "?" ] * len(metadata.desc_keys)) ),
+				[ pkgatom.cat, pkgatom.pf ] + [ data.get(key,"") for key in metadata.desc_keys ])
+
+	def delete(self,pkgatom):
+		self.db.execute("DELETE FROM pkgs WHERE cat = ? AND pf = ?",( pkgatom.cat, pkgatom.pf ))
+		if self.desc != None:
+			self.db.execute("DELETE FROM descs WHERE cat = ? AND pf = ?",( pkgatom.cat, pkgatom.pf ))
+
+	def clear(self):
+		# Deletes all entries. Like set(), this does not commit.
+		self.db.execute("DELETE FROM pkgs")
+		if self.desc != None:
+			self.db.execute("DELETE FROM descs")
+
+	def commit(self):
+		self.db.commit()
+
+	def populate(self,repo):
+
+		# Fills the cache from the metadata of every ebuild in
+		# PortageRepository repo (not including its overlays), in a
+		# single transaction. This is how bundles are generated from a
+		# classic tree. Returns the number of ebuilds added.
+
+		count = 0
+		with self.db:
+			for atom in repo.iterList(PkgAtom,recurse=False):
+				data = repo._metadata(atom)
+				if data != None:
+					self.set(atom,data)
+					count += 1
+		return count
+
+class SQLiteBackend(object):
+
+	# SQLiteBackend answers the ebuild listings and metadata lookups of a
+	# PortageRepository from an SQLiteMetadataCache. Its methods stand in
+	# for the repository's _has_catpkg(), _catpkg_iter(), _metadata() and
+	# so on, either through SQLitePortageRepository, below, or when a
+	# contents descriptor binds a section of a classic repository to
+	# SQLite (see contents.py.)
+
+	def __repr__(self):
+		return "SQLiteBackend(%s)" % self.cache.core.diskpath
+
+	def __init__(self,repo,cache):
+		self.repo = repo
+		self.cache = cache
+
+	def has_catpkg(self,catpkg):
+		if self.cache.hasCatPkg(catpkg.cat,catpkg.pkg):
+			return self.repo._catpkg_path(catpkg)
+
+	def catpkg_iter(self,categories=None):
+		if categories == None:
+			categories = self.repo.categories
+		for cat in categories:
+			for pkg in self.cache.pkgs(cat):
+				yield CatPkg("%s/%s" % ( cat, pkg ))
+
+	def catpkg_list(self,categories=None):
+		return list(self.catpkg_iter(categories))
+
+	def has_pkgatom(self,pkgatom):
+		if self.cache.has(pkgatom.cat,pkgatom.pf):
+			return self.repo._pkgatom_path(pkgatom)
+
+	def pkgatom_iter(self,catpkgs=None):
+		if catpkgs == None:
+			catpkgs = self.catpkg_iter()
+		for catpkg in catpkgs:
+			for pf in self.cache.pfs(catpkg.cat,catpkg.pkg):
+				yield PkgAtom("%s/%s" % ( catpkg.cat, pf ))
+
+	def pkgatom_list(self,catpkgs=None):
+		return list(self.pkgatom_iter(catpkgs))
+
+	def metadata(self,pkgatom,keys=None):
+		return self.cache.get(pkgatom.cat,pkgatom.pf,keys)
+
+	def store_metadata(self,pkgatom,data):
+		self.cache.set(pkgatom,data)
+
+	def flush_metadata(self):
+		self.cache.commit()
+
+class SQLitePortageRepository(PortageRepository):
+
+	# A PortageRepository whose ebuild listings and metadata are answered
+	# from an SQLiteMetadataCache rather than from the filesystem. Profiles
+	# and eclasses are still read from disk. By default, the bundles are
+	# expected in metadata/sqlite/ inside the repository:
+	#
+	# >>> a = SQLitePortageRepository(FilePath("/usr/portage"))
+	# >>> a.getMetadata(PkgAtom("sys-apps/portage-2.1"),["SLOT"])
+	#
+	# Other locations can be specified with "core=FilePath(...)" and
+	# "desc=FilePath(...)". Pass "desc=None" to go without a desc bundle.
+
+	def __repr__(self):
+		return "SQLitePortageRepository(%s)" % self.path.diskpath
+
+	def __init__(self,path,**args):
+		if "core" in args:
+			core = args["core"]
+		else:
+			core = path.adjpath("metadata/sqlite/core.sqlite")
+		if "desc" in args:
+			desc = args["desc"]
+		else:
+			desc = path.adjpath("metadata/sqlite/desc.sqlite")
+		self.cache = SQLiteMetadataCache(core,desc)
+		self.backend = SQLiteBackend(self,self.cache)
+		PortageRepository.__init__(self,path,**args)
+
+	def _has_catpkg(self,catpkg):
+		return self.backend.has_catpkg(catpkg)
+
+	def _catpkg_iter(self,categories=None):
+		return self.backend.catpkg_iter(categories)
+
+	def _has_pkgatom(self,pkgatom):
+		return self.backend.has_pkgatom(pkgatom)
+
+	def _pkgatom_iter(self,catpkgs=None):
+		return self.backend.pkgatom_iter(catpkgs)
+
+	def _metadata(self,pkgatom,keys=None):
+		return self.backend.metadata(pkgatom,keys)
+
+	def _store_metadata(self,pkgatom,data):
+		self.backend.store_metadata(pkgatom,data)
+
+	def _flush_metadata(self):
+		self.backend.flush_metadata()
+
+if __name__ == "__main__":
+	from access import *
+	a = PortageRepository(FilePath("/var/git/portage-mini-2010"))
+	b = SQLiteMetadataCache(FilePath("/tmp/core.sqlite"),FilePath("/tmp/desc.sqlite"))
+	print "populated", b.populate(a), "ebuilds"
+	c = SQLitePortageRepository(a.path,core=b.core,desc=b.desc)
+	print c.getList(PkgAtom,[CatPkg("sys-apps/portage")])
+	print c.getMetadata(PkgAtom("sys-apps/portage-2.2_rc67-r2"))
@@ -0,0 +1,7 @@
+#!/bin/bash
+# A stand-in for Portage's "ebuild.sh depend", used by test_regen.py: it
+# sources $EBUILD, with inherit() sourcing eclasses from $ECLASSDIR, and
+# writes the metadata to fd 9 in flat list order (see metadata.py.)
+inherit() { local e; for e in "$@"; do INHERITED="$INHERITED $e"; source "$ECLASSDIR/$e.eclass" || exit 1; done; }
+source "$EBUILD" || exit 1
+printf '%s\n' "$DEPEND" "$RDEPEND" "$SLOT" "$SRC_URI" "$RESTRICT" "$HOMEPAGE" "$LICENSE" "$DESCRIPTION" "$KEYWORDS" "${INHERITED# }" "$IUSE" "" "$PDEPEND" "$PROVIDE" "${EAPI:-0}" "$PROPERTIES" "$DEFINED_PHASES" >&9
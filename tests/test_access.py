@@ -0,0 +1,164 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import time
+import shutil
+import marshal
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+import access
+from access import FilePath, StatCache
+
+def write(path,data=""):
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	a = open(path,"w")
+	try:
+		a.write(data)
+	finally:
+		a.close()
+
+class StatCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		write(os.path.join(self.tmp,"a/file"),"x")
+		os.makedirs(os.path.join(self.tmp,"a/sub"))
+		self.stats = []
+		self._stat = access.os.stat
+		def counting(path):
+			self.stats.append(path)
+			return self._stat(path)
+		access.os.stat = counting
+
+	def tearDown(self):
+		access.os.stat = self._stat
+		shutil.rmtree(self.tmp)
+
+	def testListingFillsChildren(self):
+		cache = StatCache()
+		d = os.path.join(self.tmp,"a")
+		cache.fill(d,[ ( "file", False ), ( "sub", True ) ])
+		self.assertEqual(cache.isdir(os.path.join(d,"sub")),True)
+		self.assertEqual(cache.isdir(os.path.join(d,"file")),False)
+		self.assertEqual(cache.exists(os.path.join(d,"file")),True)
+		self.assertEqual(cache.exists(os.path.join(d,"missing")),False)
+		self.assertEqual(cache.stat(os.path.join(d,"missing")),None)
+		self.assertEqual(self.stats,[])
+		self.assertEqual(sorted(cache.scandir(d)),[ ( "file", False ), ( "sub", True ) ])
+		# a real stat() is done once, then cached:
+		st = cache.stat(os.path.join(d,"file"))
+		self.assertEqual(st.st_size,1)
+		cache.stat(os.path.join(d,"file"))
+		self.assertEqual(self.stats,[ os.path.join(d,"file") ])
+
+	def testFilePath(self):
+		FilePath.statcache = StatCache()
+		try:
+			d = FilePath(os.path.join(self.tmp,"a"))
+			self.assertEqual(sorted(d.scandir()),[ ( "file", False ), ( "sub", True ) ])
+			del self.stats[:]
+			self.assertEqual(d.adjpath("sub").isdir(),True)
+			self.assertEqual(d.adjpath("missing").exists(),False)
+			self.assertEqual(self.stats,[])
+		finally:
+			FilePath.statcache = None
+
+	def testTTL(self):
+		cache = StatCache(ttl=0.05)
+		path = os.path.join(self.tmp,"a/new")
+		self.assertEqual(cache.exists(path),False)
+		write(path)
+		self.assertEqual(cache.exists(path),False)
+		time.sleep(0.1)
+		self.assertEqual(cache.exists(path),True)
+
+	def testInvalidate(self):
+		cache = StatCache()
+		d = os.path.join(self.tmp,"a")
+		path = os.path.join(d,"new")
+		cache.fill(d,[ ( "file", False ), ( "sub", True ) ])
+		self.assertEqual(cache.exists(path),False)
+		write(path)
+		self.assertEqual(cache.exists(path),False)
+		# forgetting a path also forgets its parent's listing:
+		cache.invalidate(path)
+		self.assertEqual(cache.exists(path),True)
+		self.assertEqual(cache.scandir(d),None)
+		os.unlink(path)
+		self.assertEqual(cache.exists(path),True)
+		cache.invalidate()
+		self.assertEqual(cache.exists(path),False)
+		self.assertEqual(cache.isdir(os.path.join(d,"sub")),True)
+
+	def testThreads(self):
+		# expiry, refills and invalidation racing in several threads
+		# must not raise.
+		cache = StatCache(ttl=0)
+		d = os.path.join(self.tmp,"a")
+		errors = []
+		def run():
+			try:
+				for i in range(2000):
+					cache.fill(d,[ ( "file", False ), ( "sub", True ) ])
+					cache.isdir(os.path.join(d,"sub"))
+					cache.exists(os.path.join(d,"file"))
+					cache.scandir(d)
+					if i % 100 == 0:
+						cache.invalidate(os.path.join(d,"file"))
+			except Exception, e:
+				errors.append(e)
+		threads = [ threading.Thread(target=run) for i in range(4) ]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(errors,[])
+
+class MarshalFileTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+
+	def tearDown(self):
+		FilePath.statcache = None
+		shutil.rmtree(self.tmp)
+
+	def testRoundTrip(self):
+		path = FilePath(os.path.join(self.tmp,"index"))
+		self.assertEqual(path.loadmarshal(1),None)
+		path.savemarshal(1,{ "cats" : { "sys-apps" : [ 1, 2 ] } })
+		self.assertEqual(path.loadmarshal(1),{ "version" : 1, "cats" : { "sys-apps" : [ 1, 2 ] } })
+		self.assertEqual(path.loadmarshal(2),None)
+		self.assertEqual(os.listdir(self.tmp),[ "index" ])
+
+	def testUnreadable(self):
+		path = FilePath(os.path.join(self.tmp,"index"))
+		path.savemarshal(1,{ "cats" : range(100) })
+		data = open(path.diskpath,"rb").read()
+		path.atomicwrite(data[:len(data)/2])
+		self.assertEqual(path.loadmarshal(1),None)
+		path.atomicwrite("garbage")
+		self.assertEqual(path.loadmarshal(1),None)
+		path.atomicwrite(marshal.dumps([ 1 ]))
+		self.assertEqual(path.loadmarshal(1),None)
+
+	def testStatCache(self):
+		# writing a file is seen through the stat cache.
+		FilePath.statcache = StatCache()
+		d = FilePath(self.tmp)
+		d.scandir()
+		path = d.adjpath("new")
+		self.assertEqual(path.exists(),False)
+		path.atomicwrite("x")
+		self.assertEqual(path.exists(),True)
+		self.assertEqual(sorted(d.scandir()),[ ( "new", False ) ])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from access import FilePath
+from configfile import *
+
+def write(path,data=""):
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	a = open(path,"w")
+	try:
+		a.write(data)
+	finally:
+		a.close()
+
+# Each case is ( file contents, variables ). The expected variables are
+# what the original character-by-character parser produced for the same
+# file, so these cases check that the single-pass tokenizer is compatible
+# with it.
+
+compatible = [
+	( 'CFLAGS="-O2 -pipe"\nCHOST="x86_64-pc-linux-gnu"\n', { "CFLAGS" : "-O2 -pipe", "CHOST" : "x86_64-pc-linux-gnu" } ),
+	( 'FOO=bar\nBAR=baz qux\n', { "FOO" : "bar", "BAR" : "baz qux" } ),
+	( '# a comment\n\n   # indented comment\nFOO="a"\n\t\nBAR="b" \n', { "FOO" : "a", "BAR" : "b" } ),
+	( '   FOO="a"\n\tBAR="${FOO} b"\n', { "FOO" : "a", "BAR" : "a b" } ),
+	( 'FOO="a"\nBAR="${FOO} b"\nBAZ="${BAR}-${FOO}${MISSING}"\n', { "FOO" : "a", "BAR" : "a b", "BAZ" : "a b-a" } ),
+	( 'USE="a"\nUSE="${USE} b"\nUSE="${USE} c"\n', { "USE" : "a b c" } ),
+	( 'FOO="a \\"quoted\\" word"\nBAR="\\${FOO}"\nBAZ="cost \\$5"\n', { "FOO" : 'a "quoted" word', "BAR" : "${FOO}", "BAZ" : "cost $5" } ),
+	( 'FOO="a\\nb"\n', { "FOO" : "a\\nb" } ),
+	( 'FOO="a\n  b\n\tc"\nBAR="x"\n', { "FOO" : "a b c", "BAR" : "x" } ),
+	( 'FOO="a \\\nb \\\n c"\n', { "FOO" : "a  b  c" } ),
+	( 'FOO=" "foo bar" oni "\n', { "FOO" : ' "foo bar" oni ' } ),
+	( 'FOO="a"   \nBAR="b\nc"  \n', { "FOO" : "a", "BAR" : "b c" } ),
+	( 'FOO="a"\nBAR=${FOO}/b\n', { "FOO" : "a", "BAR" : "a/b" } ),
+	( 'FOO=""\nBAR=\n', { "FOO" : "", "BAR" : "" } ),
+]
+
+class TokenizeTest(unittest.TestCase):
+
+	def testTokenize(self):
+		self.assertEqual(tokenize(""),[])
+		self.assertEqual(tokenize("plain text"),[ "plain text" ])
+		self.assertEqual(tokenize('${CFLAGS} -I\\"foo\\"'),[ ( "CFLAGS", ), ' -I"foo"' ])
+		self.assertEqual(tokenize("${A}${B}"),[ ( "A", ), ( "B", ) ])
+		self.assertEqual(tokenize("a${A}b"),[ "a", ( "A", ), "b" ])
+
+	def testEscapes(self):
+		# only \$, \\ and \" are escapes; adjacent text is merged.
+		self.assertEqual(tokenize("\\${A} \\$5"),[ "${A} $5" ])
+		self.assertEqual(tokenize("a\\\\b"),[ "a\\b" ])
+		self.assertEqual(tokenize("a\\nb\\"),[ "a\\nb\\" ])
+
+	def testLiteralDollar(self):
+		self.assertEqual(tokenize("$HOME ${ x} ${A $"),[ "$HOME ${ x} ${A $" ])
+		self.assertEqual(tokenize("${}${A-B}"),[ "${}${A-B}" ])
+
+class ParseTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.count = 0
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def read(self,contents):
+		# each file gets a new name, since parses are cached by path.
+		self.count += 1
+		path = os.path.join(self.tmp,"make.conf.%s" % self.count)
+		write(path,contents)
+		cfg = ConfigFile(FilePath(path))
+		cfg._read()
+		return cfg
+
+	def testCompatible(self):
+		for contents, expected in compatible:
+			cfg = self.read(contents)
+			self.assertEqual(cfg.data,expected,contents)
+			self.assertEqual(cfg.errors,[],contents)
+
+	def testOrder(self):
+		self.assertEqual(parse('B="1"\nA=2\nB="${A}"\n'),[ ( "B", [ "1" ] ), ( "A", [ "2" ] ), ( "B", [ ( "A", ) ] ) ])
+
+	def testFixed(self):
+		# cases the original parser got wrong: "\\" produced two
+		# backslashes, a missing newline at the end of the file raised
+		# IndexError, one-letter names were rejected and an unterminated
+		# "${" dropped the rest of the value.
+		self.assertEqual(self.read('FOO="a\\\\b"\nBAR="C:\\\\"\n').data,{ "FOO" : "a\\b", "BAR" : "C:\\" })
+		self.assertEqual(self.read('FOO="a"\nBAR="b"').data,{ "FOO" : "a", "BAR" : "b" })
+		self.assertEqual(self.read('X="a"\n').data,{ "X" : "a" })
+		self.assertEqual(self.read('FOO="$HOME ${ x"\n').data,{ "FOO" : "$HOME ${ x" })
+
+	def testNoReexpansion(self):
+		# an escaped "${" is never expanded again when referenced.
+		self.assertEqual(self.read('A="\\${B}"\nB="x"\nC="${A}"\n').data,{ "A" : "${B}", "B" : "x", "C" : "${B}" })
+
+	def testErrors(self):
+		errors = []
+		items = parse('A="1"\nnot an assignment\n1X="2"\nB="3"\nC="open\nD="4"\n',errors)
+		self.assertEqual(items,[ ( "A", [ "1" ] ), ( "B", [ "3" ] ), ( "C", [ 'open D="4' ] ) ])
+		self.assertEqual(errors,[ ( 2, "no variable definition" ), ( 3, "invalid variable name 1X" ) ])
+		errors = []
+		self.assertEqual(parse('A="1"\nB="open\nmore\n',errors),[ ( "A", [ "1" ] ) ])
+		self.assertEqual(errors,[ ( 4, "no end quote for B" ) ])
+
+class ParseCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.conf = FilePath(os.path.join(self.tmp,"make.conf"))
+		self.cache = FilePath(os.path.join(self.tmp,"config.cache"))
+		write(self.conf.diskpath,'USE="a b"\n')
+
+	def tearDown(self):
+		use_parse_cache(None)
+		shutil.rmtree(self.tmp)
+
+	def touch(self,mtime,contents=None):
+		if contents != None:
+			write(self.conf.diskpath,contents)
+		os.utime(self.conf.diskpath,( mtime, mtime ))
+		return self.conf.stamp()
+
+	def testInvalidation(self):
+		cache = ParseCache(self.cache)
+		stamp = self.touch(1000)
+		items, errors = cache.parse(self.conf,stamp)
+		self.assertEqual(items,[ ( "USE", [ "a b" ] ) ])
+		self.assertEqual(cache.parse(self.conf,stamp)[0] is items,True)
+		# touched but unchanged - the SHA1 matches, so the parse is
+		# reused and only the stamp is updated:
+		stamp = self.touch(2000)
+		self.assertEqual(cache.parse(self.conf,stamp)[0] is items,True)
+		self.assertEqual(cache._files[self.conf.diskpath][0],stamp)
+		# changed - parsed again:
+		stamp = self.touch(3000,'USE="c"\nbad line\n')
+		self.assertEqual(cache.parse(self.conf,stamp),( [ ( "USE", [ "c" ] ) ], [ ( 2, "no variable definition" ) ] ))
+
+	def testReload(self):
+		cache = ParseCache(self.cache)
+		stamp = self.touch(1000)
+		items = cache.parse(self.conf,stamp)[0]
+		self.assertEqual(cache.dirty,True)
+		cache.save()
+		self.assertEqual(cache.dirty,False)
+		# an unchanged stamp is answered without reading the file:
+		os.unlink(self.conf.diskpath)
+		cache = ParseCache(self.cache)
+		self.assertEqual(cache.parse(self.conf,stamp)[0],items)
+		self.assertEqual(cache.dirty,False)
+
+	def testVersion(self):
+		cache = ParseCache(self.cache)
+		stamp = self.touch(1000)
+		cache.parse(self.conf,stamp)
+		cache.save()
+		ParseCache.version += 1
+		try:
+			cache = ParseCache(self.cache)
+			write(self.conf.diskpath,'USE="c"\n')
+			self.assertEqual(cache.parse(self.conf,stamp)[0],[ ( "USE", [ "c" ] ) ])
+			self.assertEqual(cache.dirty,True)
+			cache.save()
+			self.assertEqual(self.cache.loadmarshal(ParseCache.version)["version"],ParseCache.version)
+		finally:
+			ParseCache.version -= 1
+		self.assertEqual(self.cache.loadmarshal(ParseCache.version),None)
+
+	def testCorrupt(self):
+		write(self.cache.diskpath,"not a cache")
+		cache = ParseCache(self.cache)
+		stamp = self.touch(1000)
+		self.assertEqual(cache.parse(self.conf,stamp)[0],[ ( "USE", [ "a b" ] ) ])
+		self.assertEqual(cache.dirty,True)
+
+	def testParseFile(self):
+		use_parse_cache(self.cache)
+		self.touch(1000)
+		self.assertEqual(parse_file(self.conf),( [ ( "USE", [ "a b" ] ) ], [] ))
+		# switching caches saves the old one:
+		use_parse_cache(None)
+		self.assertEqual(self.cache.loadmarshal(ParseCache.version)["files"].keys(),[ self.conf.diskpath ])
+
+if __name__ == "__main__":
+	unittest.main()
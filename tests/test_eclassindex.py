@@ -0,0 +1,132 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from access import FilePath
+from portsmod import *
+from eclassindex import EClassIndex
+
+def write(path,data=""):
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	a = open(path,"w")
+	try:
+		a.write(data)
+	finally:
+		a.close()
+
+# eclass -> eclasses it inherits. toolchain -> multilib -> eutils is a
+# chain, and loop-a and loop-b inherit each other.
+
+eclasses = {
+	"eutils" : [],
+	"multilib" : [ "eutils" ],
+	"toolchain" : [ "multilib" ],
+	"flag-o-matic" : [],
+	"loop-a" : [ "loop-b" ],
+	"loop-b" : [ "loop-a" ],
+}
+
+# ebuild -> INHERITED
+
+ebuilds = {
+	"sys-devel/gcc-4.4" : [ "toolchain", "multilib", "eutils" ],
+	"sys-libs/zlib-1.2" : [ "multilib", "eutils" ],
+	"sys-apps/sed-4.2" : [ "eutils" ],
+	"app-misc/foo-1.0" : [ "flag-o-matic" ],
+	"app-misc/bar-1.0" : [ "loop-a", "loop-b" ],
+}
+
+class EClassIndexTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.tree = os.path.join(self.tmp,"tree")
+		for name, parents in eclasses.items():
+			lines = [ "# %s.eclass" % name ]
+			if parents:
+				lines.append("inherit %s" % " ".join(parents))
+			self.eclass(name,"\n".join(lines) + "\n")
+		self.repo = PortageRepository(FilePath(self.tree))
+		self.path = FilePath(os.path.join(self.tmp,"eclass.idx"))
+		self.index = self.build()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def eclass(self,name,contents):
+		write(os.path.join(self.tree,"eclass/%s.eclass" % name),contents)
+
+	def build(self):
+		index = EClassIndex(self.repo,self.path)
+		for key, inherited in ebuilds.items():
+			index.set(PkgAtom(key),inherited)
+		index.refresh()
+		index.save()
+		return index
+
+	def affected(self,names,index=None):
+		if index == None:
+			index = self.index
+		return sorted(atom.atom for atom in index.affected(names))
+
+	def testInherits(self):
+		self.assertEqual(self.index.inherits("toolchain"),[ "multilib" ])
+		self.assertEqual(self.index.inheritedBy("eutils"),[ "multilib" ])
+		self.assertEqual(self.index.inheritedBy("multilib"),[ "toolchain" ])
+		self.assertEqual(self.index.changed(),[])
+
+	def testAffected(self):
+		# ebuilds reached through eclasses that inherit eclasses:
+		self.assertEqual(self.affected([ "eutils" ]),[ "sys-apps/sed-4.2", "sys-devel/gcc-4.4", "sys-libs/zlib-1.2" ])
+		self.assertEqual(self.affected([ "toolchain" ]),[ "sys-devel/gcc-4.4" ])
+		self.assertEqual(self.affected([ "flag-o-matic", "toolchain" ]),[ "app-misc/foo-1.0", "sys-devel/gcc-4.4" ])
+		self.assertEqual(self.affected([ "loop-a" ]),[ "app-misc/bar-1.0" ])
+		self.assertEqual(self.affected([ "missing" ]),[])
+
+	def testAffectedIndirect(self):
+		# an ebuild whose INHERITED only lists the top of the chain is
+		# still reached through the eclass edges.
+		self.index.set(PkgAtom("sys-devel/binutils-2.20"),[ "toolchain" ])
+		self.assertEqual(self.affected([ "eutils" ]),[ "sys-apps/sed-4.2", "sys-devel/binutils-2.20", "sys-devel/gcc-4.4", "sys-libs/zlib-1.2" ])
+		self.index.set(PkgAtom("sys-devel/binutils-2.20"),None)
+		self.assertEqual(self.affected([ "eutils" ]),[ "sys-apps/sed-4.2", "sys-devel/gcc-4.4", "sys-libs/zlib-1.2" ])
+
+	def testReload(self):
+		index = EClassIndex(self.repo,self.path)
+		self.assertEqual(self.affected([ "eutils" ],index),[ "sys-apps/sed-4.2", "sys-devel/gcc-4.4", "sys-libs/zlib-1.2" ])
+		self.assertEqual(index.changed(),[])
+		self.assertEqual(index.dirty,False)
+
+	def testChangedEdit(self):
+		# multilib stops inheriting eutils:
+		self.eclass("multilib","# multilib.eclass, edited\n")
+		changed = self.index.changed()
+		self.assertEqual(changed,[ "multilib" ])
+		self.assertEqual(self.affected(changed),[ "sys-devel/gcc-4.4", "sys-libs/zlib-1.2" ])
+		self.index.refresh(changed)
+		self.assertEqual(self.index.changed(),[])
+		self.assertEqual(self.index.inheritedBy("eutils"),[])
+
+	def testChangedRemoved(self):
+		os.unlink(os.path.join(self.tree,"eclass/multilib.eclass"))
+		changed = self.index.changed()
+		self.assertEqual(changed,[ "multilib" ])
+		# the ebuilds that used it, directly or through toolchain:
+		self.assertEqual(self.affected(changed),[ "sys-devel/gcc-4.4", "sys-libs/zlib-1.2" ])
+		self.index.refresh(changed)
+		self.assertEqual(self.index.changed(),[])
+		self.assertEqual(self.index.inherits("multilib"),[])
+		# and it counts as changed again when it comes back:
+		self.eclass("multilib","inherit eutils\n")
+		self.assertEqual(self.index.changed(),[ "multilib" ])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from access import FilePath
+from fetcher import *
+from slurry import DirectoryTransport
+
+def write(path,data=""):
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	a = open(path,"w")
+	try:
+		a.write(data)
+	finally:
+		a.close()
+
+def read(path):
+	a = open(path)
+	try:
+		return a.read()
+	finally:
+		a.close()
+
+class BundleFetcherTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.tree = os.path.join(self.tmp,"tree")
+		write(os.path.join(self.tree,"profiles","categories"),"sys-apps\n")
+		write(os.path.join(self.tree,"sys-apps","foo","foo-1.0.ebuild"),'SLOT="0"\n')
+		write(os.path.join(self.tree,"sys-apps","foo","metadata.xml"),"<pkgmetadata/>\n")
+		write(os.path.join(self.tree,"sys-apps","foo","files","foo.patch"),"--- a\n+++ b\n")
+		write(os.path.join(self.tree,"eclass","eutils.eclass"),"# eutils\n")
+		self.pub = os.path.join(self.tmp,"pub")
+		publish_bundles(PortageRepository(FilePath(self.tree)),FilePath(self.pub))
+		self.fetcher = BundleFetcher(DirectoryTransport(FilePath(self.pub)),BlobCache(FilePath(os.path.join(self.tmp,"blobs"))))
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def testFetch(self):
+		local = os.path.join(self.tmp,"local")
+		write(os.path.join(local,"profiles","categories"),"sys-apps\n")
+		backend = BundleBackend(PortageRepository(FilePath(local)),self.fetcher)
+		self.assertEqual(backend.getEbuild(PkgAtom("sys-apps/foo-1.0")),'SLOT="0"\n')
+		self.assertEqual(backend.getFile(CatPkg("sys-apps/foo"),"files/foo.patch"),"--- a\n+++ b\n")
+		self.assertEqual(backend.getFile(CatPkg("sys-apps/foo"),"missing"),None)
+		self.assertEqual(backend.getEClass(EClassAtom("eutils")),"# eutils\n")
+		self.assertEqual(backend.eclass_list(),[ EClassAtom("eutils") ])
+		self.assertNotEqual(backend.has_eclass(EClassAtom("eutils")),None)
+		self.assertEqual(backend.has_eclass(EClassAtom("missing")),None)
+		self.assertEqual(len(self.fetcher.blobs),3)
+		dest = os.path.join(self.tmp,"work","foo")
+		backend.materialize(CatPkg("sys-apps/foo"),FilePath(dest))
+		for name in ( "foo-1.0.ebuild", "metadata.xml", "files/foo.patch" ):
+			self.assertEqual(read(os.path.join(dest,name)),read(os.path.join(self.tree,"sys-apps","foo",name)))
+
+	def testMismatch(self):
+		sha1 = self.fetcher.manifest("sys-apps/foo")["metadata.xml"]
+		write(os.path.join(self.pub,"objects",sha1[:2],sha1[2:]),"tampered\n")
+		self.assertRaises(FetchError,self.fetcher.get,"sys-apps/foo","metadata.xml")
+		self.assertFalse(sha1 in self.fetcher.blobs)
+		# a cached blob that has been corrupted on disk is discarded:
+		data = self.fetcher.get("sys-apps/foo","foo-1.0.ebuild")
+		sha1 = hashlib.sha1(data).hexdigest()
+		write(os.path.join(self.tmp,"blobs",sha1),"corrupt\n")
+		self.assertEqual(self.fetcher.blobs.get(sha1),None)
+		self.assertFalse(sha1 in self.fetcher.blobs)
+
+	def testEviction(self):
+		blobs = BlobCache(FilePath(os.path.join(self.tmp,"lru")),maxsize=25)
+		data = [ "%d" % n * 10 for n in range(3) ]
+		sha1s = [ hashlib.sha1(item).hexdigest() for item in data ]
+		blobs.put(sha1s[0],data[0])
+		blobs.put(sha1s[1],data[1])
+		# use the first, so that the second is least recently used:
+		self.assertEqual(blobs.get(sha1s[0]),data[0])
+		blobs.put(sha1s[2],data[2])
+		self.assertEqual(( sha1s[0] in blobs, sha1s[1] in blobs, sha1s[2] in blobs ),( True, False, True ))
+		self.assertEqual(( len(blobs), blobs.size ),( 2, 20 ))
+		self.assertFalse(os.path.exists(os.path.join(self.tmp,"lru",sha1s[1])))
+		# the LRU order survives a reload:
+		self.assertEqual(len(BlobCache(FilePath(os.path.join(self.tmp,"lru")),maxsize=25)),2)
+
+	def testTraversal(self):
+		sha1 = self.fetcher.manifest("sys-apps/foo")["metadata.xml"]
+		dest = os.path.join(self.tmp,"work","foo")
+		for name in ( "../evil", "/tmp/evil", "files//evil", "files/../../evil" ):
+			write(os.path.join(self.pub,"sys-apps","bar","manifest"),json.dumps({ "good" : sha1, name : sha1 }))
+			self.fetcher.invalidate()
+			self.assertRaises(FetchError,self.fetcher.materialize,"sys-apps/bar",FilePath(dest))
+			self.assertFalse(os.path.exists(dest))
+			self.assertFalse(os.path.exists(os.path.join(self.tmp,"work","evil")))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from access import FilePath
+from portsmod import *
+from filter import *
+
+def write(path,data=""):
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	a = open(path,"w")
+	try:
+		a.write(data)
+	finally:
+		a.close()
+
+def matches(depstring,atoms):
+	filter = PkgAtomFilter(depstring)
+	return [ atom for atom in atoms if filter.match(PkgAtom("sys-apps/portage-%s" % atom)) ]
+
+versions = [ "2.1", "2.2_rc1", "2.2_rc67", "2.2_rc67-r1", "2.2", "2.2-r1", "2.2b", "2.2.1", "2.20", "2.21", "3.0" ]
+
+class PkgAtomFilterTest(unittest.TestCase):
+
+	def testAny(self):
+		self.assertEqual(matches("sys-apps/portage",versions),versions)
+		self.assertFalse(PkgAtomFilter("sys-apps/portage").match(PkgAtom("sys-apps/sed-4.2")))
+		self.assertFalse(PkgAtomFilter("sys-apps/portage").match(PkgAtom("app-misc/portage-2.1")))
+
+	def testOperators(self):
+		self.assertEqual(matches("=sys-apps/portage-2.2_rc67",versions),[ "2.2_rc67" ])
+		self.assertEqual(matches("=sys-apps/portage-2.2_rc67-r1",versions),[ "2.2_rc67-r1" ])
+		self.assertEqual(matches("~sys-apps/portage-2.2_rc67",versions),[ "2.2_rc67", "2.2_rc67-r1" ])
+		self.assertEqual(matches(">=sys-apps/portage-2.2",versions),[ "2.2", "2.2-r1", "2.2b", "2.2.1", "2.20", "2.21", "3.0" ])
+		self.assertEqual(matches(">sys-apps/portage-2.2",versions),[ "2.2-r1", "2.2b", "2.2.1", "2.20", "2.21", "3.0" ])
+		self.assertEqual(matches("<=sys-apps/portage-2.2_rc67",versions),[ "2.1", "2.2_rc1", "2.2_rc67" ])
+		self.assertEqual(matches("<sys-apps/portage-2.2_rc67",versions),[ "2.1", "2.2_rc1" ])
+
+	def testPrefix(self):
+		self.assertEqual(matches("=sys-apps/portage-2.2*",versions),[ "2.2_rc1", "2.2_rc67", "2.2_rc67-r1", "2.2", "2.2-r1", "2.2b", "2.2.1" ])
+		self.assertEqual(matches("=sys-apps/portage-2*",versions),versions[:-1])
+		self.assertEqual(matches("=sys-apps/portage-2.2_rc*",versions),[ "2.2_rc1", "2.2_rc67", "2.2_rc67-r1" ])
+		self.assertEqual(matches("=sys-apps/portage-2.2_rc6*",versions),[])
+		self.assertEqual(matches("=sys-apps/portage-2.2b*",versions),[ "2.2b" ])
+		self.assertEqual(matches("=sys-apps/portage-2.2-r1*",versions),[ "2.2-r1" ])
+
+	def testSlotAndRepo(self):
+		filter = PkgAtomFilter(">=sys-apps/portage-2.2:2")
+		self.assertEqual(filter.slot,"2")
+		self.assertTrue(filter.match(PkgAtom("sys-apps/portage-2.2:slot=2")))
+		self.assertFalse(filter.match(PkgAtom("sys-apps/portage-2.2:slot=1")))
+		self.assertFalse(filter.match(PkgAtom("sys-apps/portage-2.1:slot=2")))
+		# without slot key data, the slot is unknown:
+		self.assertFalse(filter.match(PkgAtom("sys-apps/portage-2.2")))
+		filter = PkgAtomFilter("sys-apps/portage:2::funtoo")
+		self.assertEqual(( filter.slot, filter.repo ),( "2", "funtoo" ))
+		self.assertTrue(filter.match(PkgAtom("sys-apps/portage-2.2:slot=2:repo=funtoo")))
+		self.assertFalse(filter.match(PkgAtom("sys-apps/portage-2.2:slot=2:repo=gentoo")))
+		filter = PkgAtomFilter("=sys-apps/portage-2.2*::funtoo")
+		self.assertEqual(( filter.slot, filter.repo ),( None, "funtoo" ))
+		self.assertTrue(filter.match(PkgAtom("sys-apps/portage-2.2.1:repo=funtoo")))
+		self.assertFalse(filter.match(PkgAtom("sys-apps/portage-2.20:repo=funtoo")))
+		# slotfunc is consulted for atoms without slot key data:
+		filter = compile_filter("sys-apps/portage:2",slotfunc=lambda atom: "2")
+		self.assertTrue(isinstance(filter,Level2PkgAtomFilter))
+		self.assertTrue(filter.match(PkgAtom("sys-apps/portage-2.2")))
+		self.assertTrue(isinstance(compile_filter("sys-apps/portage"),Level1PkgAtomFilter))
+		self.assertRaises(ValueError,Level1PkgAtomFilter,"sys-apps/portage::funtoo")
+
+	def testInvalid(self):
+		for depstring in ( "!sys-apps/portage", "!!sys-apps/portage", "!<sys-apps/portage-2.2", "sys-apps/portage-2.2",
+			">=sys-apps/portage", "sys-apps/portage:", "sys-apps/portage::", "portage", "=sys-apps/portage-x*" ):
+			self.assertRaises(ValueError,PkgAtomFilter,depstring)
+
+	def testApply(self):
+		atoms = set(PkgAtom("sys-apps/portage-%s" % version) for version in versions)
+		visible, masked = PkgAtomFilter(">=sys-apps/portage-2.20").apply(atoms)
+		self.assertEqual(masked,set([ PkgAtom("sys-apps/portage-2.20"), PkgAtom("sys-apps/portage-2.21"), PkgAtom("sys-apps/portage-3.0") ]))
+		self.assertEqual(visible,atoms - masked)
+
+class FilterGroupTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def testGroup(self):
+		g = FilterGroup([ "# comment", "", ">=sys-apps/portage-2.2", "!sys-apps/sed", "=app-misc/foo-1*", "bogus" ])
+		self.assertEqual(len(g),2)
+		self.assertEqual(g.invalid,[ "!sys-apps/sed", "bogus" ])
+		self.assertEqual(g.catpkgs(),set([ ( "sys-apps", "portage" ), ( "app-misc", "foo" ) ]))
+		self.assertEqual(len(g.filters("sys-apps/portage")),1)
+		self.assertEqual(g.filters("sys-apps/sed"),[])
+		self.assertTrue(g.match(PkgAtom("sys-apps/portage-2.2")))
+		self.assertFalse(g.match(PkgAtom("sys-apps/portage-2.1")))
+		self.assertTrue(g.match(PkgAtom("app-misc/foo-1.5")))
+		self.assertFalse(g.match(PkgAtom("app-misc/foo-10")))
+		self.assertFalse(g.match(PkgAtom("sys-apps/sed-4.2")))
+
+	def testMulti(self):
+		profile = os.path.join(self.tmp,"profile.mask")
+		user_unmask = os.path.join(self.tmp,"package.unmask")
+		write(profile,">=sys-apps/portage-2.2\napp-misc/foo\n")
+		write(user_unmask,"=sys-apps/portage-2.2.1\n")
+		m = MultiFilterGroup(( UnmaskFilterGroup(FilePath(user_unmask)), MaskFilterGroup(FilePath(profile)) ),interval=3600)
+		atoms = set(PkgAtom(atom) for atom in ( "sys-apps/portage-2.1", "sys-apps/portage-2.2", "sys-apps/portage-2.2.1", "app-misc/foo-1", "sys-apps/sed-4.2" ))
+		visible, masked = m.apply(atoms)
+		self.assertEqual(masked,set([ PkgAtom("sys-apps/portage-2.2"), PkgAtom("app-misc/foo-1") ]))
+		# a changed file is only noticed after refresh() or the interval,
+		# and only the affected catpkgs are recomputed:
+		write(profile,">=sys-apps/portage-2.2\n# app-misc/foo unmasked\n")
+		self.assertFalse(m.visible(PkgAtom("app-misc/foo-1")))
+		self.assertTrue(m.refresh())
+		self.assertTrue(m.visible(PkgAtom("app-misc/foo-1")))
+		self.assertFalse(m.visible(PkgAtom("sys-apps/portage-2.2")))
+		self.assertFalse(m.refresh())
+
+	def testIncremental(self):
+		a = os.path.join(self.tmp,"a.mask")
+		b = os.path.join(self.tmp,"b.mask")
+		write(a,"sys-apps/portage\napp-misc/foo\n")
+		write(b,"-sys-apps/portage\napp-misc/bar\n")
+		g = MaskFilterGroup([ FilePath(a), FilePath(b) ])
+		self.assertEqual(g.catpkgs(),set([ ( "app-misc", "foo" ), ( "app-misc", "bar" ) ]))
+		write(b,"-*\napp-misc/bar # comment\n")
+		g = MaskFilterGroup([ FilePath(a), FilePath(b) ])
+		self.assertEqual(g.catpkgs(),set([ ( "app-misc", "bar" ) ]))
+
+if __name__ == "__main__":
+	unittest.main()
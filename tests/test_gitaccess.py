@@ -0,0 +1,139 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from access import FilePath
+from gitaccess import *
+
+def write(path,data=""):
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	a = open(path,"w")
+	try:
+		a.write(data)
+	finally:
+		a.close()
+
+def git(path,*args):
+	env = dict(os.environ)
+	env.update({ "GIT_AUTHOR_NAME" : "test", "GIT_AUTHOR_EMAIL" : "test@example.com", "GIT_COMMITTER_NAME" : "test", "GIT_COMMITTER_EMAIL" : "test@example.com" })
+	p = subprocess.Popen(( "git", "-C", path ) + args,stdout=subprocess.PIPE,env=env)
+	out = p.communicate()[0]
+	if p.returncode != 0:
+		raise RuntimeError("git %s failed" % " ".join(args))
+	return out
+
+def havegit():
+	try:
+		subprocess.Popen(( "git", "--version" ),stdout=subprocess.PIPE).communicate()
+	except OSError:
+		return False
+	return True
+
+@unittest.skipUnless(havegit(),"git is not installed")
+class GitObjectStoreTest(unittest.TestCase):
+
+	# Builds a repository with a few commits of slowly changing files, so
+	# that a full repack stores most blobs and trees as delta chains.
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.work = os.path.join(self.tmp,"work")
+		os.makedirs(self.work)
+		git(self.work,"init","-q")
+		lines = [ "line %s of a file that is long enough to be worth deltifying\n" % i for i in range(200) ]
+		for i in range(6):
+			lines[i*30] = "changed in commit %s\n" % i
+			write(os.path.join(self.work,"sys-apps/portage/portage-2.%s.ebuild" % i),"".join(lines))
+			write(os.path.join(self.work,"sys-apps/portage/Manifest"),"".join(lines[:100+i]))
+			write(os.path.join(self.work,"profiles/package.mask"),"".join(lines[i:]))
+			git(self.work,"add","-A")
+			git(self.work,"commit","-q","-m","commit %s" % i)
+			if i == 3:
+				git(self.work,"tag","-a","-m","old","old")
+		git(self.work,"tag","v1")
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def packed(self,name,ofs=True):
+		path = os.path.join(self.tmp,name)
+		subprocess.check_call(( "git", "clone", "-q", "--bare", "--no-local", self.work, path ))
+		git(path,"-c","repack.useDeltaBaseOffset=%s" % ( "true" if ofs else "false" ),"repack","-q","-a","-d","-f","--depth=50","--window=50")
+		git(path,"prune-packed")
+		return path
+
+	def check(self,path):
+		store = GitObjectStore(FilePath(path))
+		for line in git(path,"rev-list","--objects","--all").splitlines():
+			sha = line.split(" ",1)[0]
+			otype = git(path,"cat-file","-t",sha).strip()
+			self.assertEqual(store.read(sha),( otype, git(path,"cat-file",otype,sha) ))
+			self.assertEqual(store.size(sha),int(git(path,"cat-file","-s",sha)))
+		head = git(path,"rev-parse","HEAD").strip()
+		self.assertEqual(store.resolve("HEAD"),head)
+		self.assertEqual(store.resolve("v1"),head)
+		root = store.commit_tree("HEAD")
+		self.assertEqual(root,git(path,"rev-parse","HEAD^{tree}").strip())
+		self.assertEqual(sorted(store.tree(root).keys()),[ "profiles", "sys-apps" ])
+		name = "sys-apps/portage/portage-2.3.ebuild"
+		mode, sha = store.lookup(root,name)
+		self.assertEqual(mode,0100644)
+		self.assertEqual(sha,git(path,"rev-parse","HEAD:%s" % name).strip())
+		self.assertEqual(store.lookup(root,"sys-apps/missing"),None)
+		self.assertEqual(store.lookup(root,"%s/foo" % name),None)
+		# GitPath, at an older commit, through an annotated tag:
+		top = GitPath(store,"old")
+		self.assertEqual(top.adjpath("sys-apps").isdir(),True)
+		self.assertEqual(top.adjpath("sys-apps/portage").listdir(),set([ "Manifest" ] + [ "portage-2.%s.ebuild" % i for i in range(4) ]))
+		a = top.adjpath("profiles/package.mask")
+		self.assertEqual(a.open().read(),git(path,"show","old:profiles/package.mask"))
+		self.assertEqual(a.stat().st_size,len(a.open().read()))
+		self.assertEqual(top.adjpath("../profiles").exists(),False)
+		return store
+
+	def deltas(self,path):
+		# Returns the number of deltified objects in path's pack.
+		count = 0
+		packdir = os.path.join(path,"objects/pack")
+		for name in os.listdir(packdir):
+			if name.endswith(".idx"):
+				for line in git(path,"verify-pack","-v",os.path.join(packdir,name)).splitlines():
+					if len(line.split()) == 7:
+						count += 1
+		return count
+
+	def testLoose(self):
+		self.assertEqual(os.path.isdir(os.path.join(self.work,".git/objects/pack")),True)
+		self.check(os.path.join(self.work,".git"))
+
+	def testPacked(self):
+		path = self.packed("ofs.git")
+		self.assertNotEqual(self.deltas(path),0)
+		self.check(path)
+
+	def testRefDelta(self):
+		path = self.packed("ref.git",ofs=False)
+		self.assertNotEqual(self.deltas(path),0)
+		self.check(path)
+
+	def testSmallBaseCache(self):
+		# delta bases are re-read when the cache is thrown away.
+		path = self.packed("small.git")
+		store = GitObjectStore(FilePath(path))
+		store.basecache = 2
+		name = "sys-apps/portage/portage-2.0.ebuild"
+		root = store.commit_tree("HEAD")
+		self.assertEqual(store.read(store.lookup(root,name)[1])[1],git(path,"show","HEAD:%s" % name))
+		self.assertEqual(len(store._bases) <= 2,True)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from access import FilePath
+from portsmod import *
+
+def write(path,data=""):
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	a = open(path,"w")
+	try:
+		a.write(data)
+	finally:
+		a.close()
+
+class EClassListTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		for tree, eclasses in ( ( "tree", [ "eutils", "toolchain" ] ), ( "overlay", [ "eutils", "multilib" ] ) ):
+			write(os.path.join(self.tmp,tree,"profiles","categories"),"sys-apps\n")
+			for eclass in eclasses:
+				write(os.path.join(self.tmp,tree,"eclass","%s.eclass" % eclass))
+		self.repo = PortageRepository(FilePath(os.path.join(self.tmp,"tree")))
+		self.overlay = PortageRepository(FilePath(os.path.join(self.tmp,"overlay")),overlay=True)
+		self.repo.eclass_overlays = [ self.overlay ]
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def testQuery(self):
+		self.assertEqual(self.repo.getList(EClassAtom,[ EClassAtom("eutils") ]),set([ EClassAtom("eutils") ]))
+		self.assertEqual(self.repo.getList(EClassAtom,[ "multilib", "toolchain", "missing" ]),set([ EClassAtom("multilib"), EClassAtom("toolchain") ]))
+		self.assertEqual(self.repo.getList(EClassAtom,[ "multilib" ],recurse=False),set())
+
+	def testAll(self):
+		names = [ "eutils", "multilib", "toolchain" ]
+		self.assertEqual(self.repo.getList(EClassAtom,None),set(EClassAtom(name) for name in names))
+		# eutils is in both repositories, but is only listed once:
+		self.assertEqual(len(list(self.repo.iterList(EClassAtom))),3)
+
+	def testOwner(self):
+		self.assertEqual(self.repo.getRef(EClassAtom("eutils")).repo,self.overlay)
+		self.assertEqual(self.repo.getRef(EClassAtom("toolchain")).repo,self.repo)
+
+if __name__ == "__main__":
+	unittest.main()
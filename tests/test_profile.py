@@ -0,0 +1,100 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from access import FilePath
+from profile import *
+
+def write(path,data=""):
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	a = open(path,"w")
+	try:
+		a.write(data)
+	finally:
+		a.close()
+
+class PortageProfileTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.profiles = os.path.join(self.tmp,"profiles")
+		self.tick = time.time() - 1000
+		write(os.path.join(self.profiles,"base","package.mask"),"sys-apps/foo\nsys-apps/bar\n")
+		write(os.path.join(self.profiles,"child","parent"),"../base\n")
+		write(os.path.join(self.profiles,"child","package.mask"),"-sys-apps/foo\n")
+		write(os.path.join(self.profiles,"extra","package.mask"),"-*\napp-misc/baz\n")
+		for name in ( "base", "child", "extra" ):
+			self.touch(name)
+
+	def tearDown(self):
+		PortageProfile.clear()
+		shutil.rmtree(self.tmp)
+
+	def touch(self,name):
+		# gives a changed directory or file a distinct mtime, however
+		# coarse the filesystem's timestamps are:
+		self.tick += 10
+		os.utime(os.path.join(self.profiles,name),( self.tick, self.tick ))
+
+	def profile(self,name):
+		return PortageProfile(FilePath(name,base_path=self.profiles))
+
+	def names(self,paths):
+		return [ path.path for path in paths ]
+
+	def testCascade(self):
+		child = self.profile("child")
+		self.assertTrue(child is self.profile("child"))
+		self.assertEqual(child.parents,[ self.profile("base") ])
+		self.assertEqual(self.names(child["package.mask"]),[ "base/package.mask", "child/package.mask" ])
+		self.assertEqual(child.package_mask,( "sys-apps/bar", ))
+		self.assertEqual([ profile.path.path for profile in child.ancestors() ],[ "base", "child" ])
+
+	def testInvalidate(self):
+		child = self.profile("child")
+		self.assertEqual(self.names(child["use.mask"]),[])
+		# a file added to an ancestor:
+		write(os.path.join(self.profiles,"base","use.mask"),"doc\n")
+		self.touch("base")
+		self.assertEqual(self.names(child["use.mask"]),[ "base/use.mask" ])
+		self.assertEqual(child.use_mask,( "doc", ))
+		# a parent added:
+		write(os.path.join(self.profiles,"child","parent"),"../base\n../extra\n")
+		self.touch("child/parent")
+		self.assertEqual(child.parents,[ self.profile("base"), self.profile("extra") ])
+		self.assertEqual(self.names(child["package.mask"]),[ "base/package.mask", "extra/package.mask", "child/package.mask" ])
+		self.assertEqual(child.package_mask,( "app-misc/baz", ))
+		# a file removed:
+		os.unlink(os.path.join(self.profiles,"child","package.mask"))
+		self.touch("child")
+		self.assertEqual(self.names(child["package.mask"]),[ "base/package.mask", "extra/package.mask" ])
+
+	def testSnapshot(self):
+		snapshot = ProfileSnapshot(FilePath(os.path.join(self.tmp,"profile.snapshot")))
+		child = self.profile("child")
+		expected = self.names(child["package.mask"])
+		snapshot.save(child)
+		PortageProfile.clear()
+		child = snapshot.load(FilePath("child",base_path=self.profiles))
+		self.assertNotEqual(child,None)
+		stamps = child._stamps
+		self.assertEqual(self.names(child["package.mask"]),expected)
+		# the snapshot's stamps are used, so nothing was reread:
+		self.assertTrue(child._stamps is stamps)
+		self.assertEqual(child.package_mask,( "sys-apps/bar", ))
+		write(os.path.join(self.profiles,"child","use.mask"),"doc\n")
+		self.touch("child")
+		self.assertEqual(snapshot.load(),None)
+		self.assertEqual(self.names(child["use.mask"]),[ "child/use.mask" ])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from access import FilePath
+from regen import *
+
+ebuild_sh = os.path.join(os.path.dirname(os.path.abspath(__file__)),"files","ebuild.sh")
+
+def write(path,data=""):
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	a = open(path,"w")
+	try:
+		a.write(data)
+	finally:
+		a.close()
+
+class RegenTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.tree = os.path.join(self.tmp,"tree")
+		write(os.path.join(self.tree,"profiles","categories"),"app-misc\n")
+		write(os.path.join(self.tree,"eclass","base.eclass"),'HOMEPAGE="http://example.org/"\n')
+		write(os.path.join(self.tree,"eclass","eutils.eclass"),'inherit base\nIUSE="nls"\n')
+		write(os.path.join(self.tree,"app-misc","foo","foo-1.0-r1.ebuild"),'EAPI=2\ninherit eutils\nDESCRIPTION="${P} ${PV} ${PR}"\nSLOT="0"\n')
+		write(os.path.join(self.tree,"app-misc","bar","bar-2.ebuild"),'SLOT="2"\n')
+		write(os.path.join(self.tree,"app-misc","broken","broken-1.ebuild"),"exit 1\n")
+		# no version, so not a valid ebuild name:
+		write(os.path.join(self.tree,"app-misc","baz","baz.ebuild"),'SLOT="0"\n')
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def regenerator(self):
+		return MetadataRegenerator(PortageRepository(FilePath(self.tree)),ebuild_sh=ebuild_sh,jobs=2)
+
+	def testRegen(self):
+		count, failed = self.regenerator().run()
+		self.assertEqual(count,2)
+		self.assertEqual(sorted(pkgatom.atom for pkgatom in failed),[ "app-misc/baz", "app-misc/broken-1" ])
+		repo = PortageRepository(FilePath(self.tree))
+		self.assertEqual(repo.getMetadata(PkgAtom("app-misc/foo-1.0-r1"),[ "DESCRIPTION", "SLOT", "EAPI", "INHERITED", "IUSE", "HOMEPAGE" ]),
+			{ "DESCRIPTION" : "foo-1.0 1.0 r1", "SLOT" : "0", "EAPI" : "2", "INHERITED" : "eutils base", "IUSE" : "nls", "HOMEPAGE" : "http://example.org/" })
+		self.assertEqual(repo.getMetadata(PkgAtom("app-misc/bar-2"),[ "SLOT", "EAPI", "INHERITED" ]),{ "SLOT" : "2", "EAPI" : "0", "INHERITED" : "" })
+		self.assertEqual(repo.getMetadata(PkgAtom("app-misc/broken-1")),None)
+		self.assertTrue(os.path.exists(os.path.join(self.tree,"metadata","regen.state")))
+
+	def testStale(self):
+		self.regenerator().run()
+		self.assertEqual(sorted(pkgatom.atom for pkgatom in self.regenerator().stale()),[ "app-misc/baz", "app-misc/broken-1" ])
+		# base is inherited through eutils:
+		write(os.path.join(self.tree,"eclass","base.eclass"),'HOMEPAGE="http://example.com/foo/"\n')
+		r = self.regenerator()
+		self.assertEqual(sorted(pkgatom.atom for pkgatom in r.stale()),[ "app-misc/baz", "app-misc/broken-1", "app-misc/foo-1.0-r1" ])
+		r.run()
+		self.assertEqual(PortageRepository(FilePath(self.tree)).getMetadata(PkgAtom("app-misc/foo-1.0-r1"),[ "HOMEPAGE" ]),{ "HOMEPAGE" : "http://example.com/foo/" })
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from access import FilePath
+from scanner import DirectoryScanner
+
+def write(path,data=""):
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	a = open(path,"w")
+	try:
+		a.write(data)
+	finally:
+		a.close()
+
+class SlowPath(FilePath):
+
+	# A FilePath whose directory reads take delay seconds, and which
+	# records the order in which the reads finish.
+
+	finished = []
+	lock = threading.Lock()
+
+	def __init__(self,path,delay):
+		FilePath.__init__(self,path)
+		self.delay = delay
+
+	def _done(self):
+		SlowPath.lock.acquire()
+		SlowPath.finished.append(self.path)
+		SlowPath.lock.release()
+
+	def listdir(self):
+		time.sleep(self.delay)
+		try:
+			return FilePath.listdir(self)
+		finally:
+			self._done()
+
+	def scandir(self):
+		time.sleep(self.delay)
+		try:
+			return FilePath.scandir(self)
+		finally:
+			self._done()
+
+class BrokenPath(FilePath):
+
+	def listdir(self):
+		raise ValueError("broken")
+
+class DirectoryScannerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.names = [ "cat%s" % i for i in range(8) ]
+		for i, name in enumerate(self.names):
+			for j in range(i):
+				write(os.path.join(self.tmp,name,"file%s" % j))
+			os.makedirs(os.path.join(self.tmp,name,"dir"))
+		SlowPath.finished = []
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def jobs(self,missing=()):
+		# the first directories are the slowest to read.
+		out = []
+		for i, name in enumerate(self.names):
+			path = os.path.join(self.tmp,name)
+			if name in missing:
+				path += ".missing"
+			out.append(( name, SlowPath(path,0.02 * ( len(self.names) - i )) ))
+		return out
+
+	def expected(self,missing=()):
+		out = []
+		for i, name in enumerate(self.names):
+			if name in missing:
+				out.append(( name, None ))
+			else:
+				out.append(( name, set([ "dir" ] + [ "file%s" % j for j in range(i) ]) ))
+		return out
+
+	def testOrder(self):
+		s = DirectoryScanner(threads=8)
+		try:
+			out = [ ( key, set(result) ) for key, result in s.scan(self.jobs()) ]
+		finally:
+			s.close()
+		self.assertEqual(out,self.expected())
+		# the reads really did finish out of order:
+		self.assertNotEqual(SlowPath.finished,sorted(SlowPath.finished))
+
+	def testWindow(self):
+		# with a window smaller than the number of jobs, results are
+		# still returned in order.
+		s = DirectoryScanner(threads=4,window=2)
+		try:
+			out = [ ( key, set(result) ) for key, result in s.scan(self.jobs()) ]
+		finally:
+			s.close()
+		self.assertEqual(out,self.expected())
+
+	def testMissing(self):
+		missing = ( "cat0", "cat3", "cat7" )
+		for threads in ( 1, 4 ):
+			s = DirectoryScanner(threads=threads)
+			try:
+				out = [ ( key, result if result == None else set(result) ) for key, result in s.scan(self.jobs(missing)) ]
+			finally:
+				s.close()
+			self.assertEqual(out,self.expected(missing))
+
+	def testDirOnly(self):
+		s = DirectoryScanner(threads=4)
+		try:
+			out = list(s.scan(self.jobs(( "cat1", )),dironly=True))
+		finally:
+			s.close()
+		self.assertEqual(out,[ ( name, None if name == "cat1" else [ "dir" ] ) for name in self.names ])
+
+	def testError(self):
+		s = DirectoryScanner(threads=2)
+		try:
+			jobs = self.jobs()
+			jobs.insert(2,( "broken", BrokenPath(self.tmp) ))
+			out = []
+			try:
+				for key, result in s.scan(jobs):
+					out.append(key)
+			except ValueError:
+				pass
+			else:
+				self.fail("ValueError not raised")
+			self.assertEqual(out,self.names[:2])
+			# the scanner is still usable afterwards:
+			self.assertEqual(len(list(s.scan(self.jobs()))),len(self.names))
+		finally:
+			s.close()
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,102 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import json
+import zlib
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from access import FilePath
+from portsmod import PkgAtom
+from sqliterepo import SQLiteMetadataCache
+from slurry import *
+
+class SlurryTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.server = self.cache("server")
+		for n in range(5):
+			self.server.set(PkgAtom("sys-apps/foo%d-1.0" % n),{ "SLOT" : "0", "DESCRIPTION" : "foo %d" % n })
+		self.server.commit()
+		self.publisher = SlurryPublisher(FilePath(os.path.join(self.tmp,"pub")))
+		self.client = self.cache("client")
+		self.sync = SlurrySync(self.client,DirectoryTransport(FilePath(os.path.join(self.tmp,"pub"))))
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def cache(self,name):
+		return SQLiteMetadataCache(FilePath(os.path.join(self.tmp,"%s-core.sqlite" % name)),FilePath(os.path.join(self.tmp,"%s-desc.sqlite" % name)))
+
+	def assertSynced(self):
+		self.assertEqual(list(self.client.entries()),list(self.server.entries()))
+
+	def testFullSync(self):
+		head = self.publisher.publish(self.server)
+		changes, deletes, size = self.sync.sync()
+		self.assertEqual(( changes, deletes ),( 5, 0 ))
+		self.assertEqual(self.sync.head(),head)
+		self.assertSynced()
+		self.assertEqual(self.client.get("sys-apps","foo3-1.0",[ "DESCRIPTION" ]),{ "DESCRIPTION" : "foo 3" })
+		self.assertEqual(self.sync.sync(),None)
+
+	def testDeltaSync(self):
+		self.publisher.publish(self.server)
+		self.sync.sync()
+		self.server.set(PkgAtom("sys-apps/foo1-1.0"),{ "SLOT" : "1" })
+		self.server.set(PkgAtom("sys-apps/bar-2.0"),{ "SLOT" : "0" })
+		self.server.delete(PkgAtom("sys-apps/foo2-1.0"))
+		self.server.delete(PkgAtom("sys-apps/foo3-1.0"))
+		self.server.commit()
+		head = self.publisher.publish(self.server)
+		full = os.path.getsize(os.path.join(self.tmp,"pub","cache","%s.slurry" % head))
+		changes, deletes, size = self.sync.sync()
+		self.assertEqual(( changes, deletes ),( 2, 2 ))
+		self.assertNotEqual(size,full)
+		self.assertEqual(self.sync.head(),head)
+		self.assertSynced()
+		self.assertFalse(self.client.has("sys-apps","foo2-1.0"))
+
+	def testRollback(self):
+		self.publisher.publish(self.server)
+		self.sync.sync()
+		before = list(self.client.entries())
+		head = self.sync.head()
+		self.server.delete(PkgAtom("sys-apps/foo0-1.0"))
+		self.server.commit()
+		new = self.publisher.publish(self.server)
+		path = os.path.join(self.tmp,"pub","cache","%s-%s.slurry" % ( head, new ))
+		a = open(path,"rb")
+		changeset = json.loads(zlib.decompress(a.read()))
+		a.close()
+		changeset["to"] = "0" * 40
+		a = open(path,"wb")
+		a.write(zlib.compress(json.dumps(changeset)))
+		a.close()
+		self.assertRaises(SlurryError,self.sync.sync)
+		self.assertEqual(list(self.client.entries()),before)
+		self.assertEqual(self.sync.head(),head)
+
+	def testPrune(self):
+		self.publisher.keep = 2
+		heads = []
+		for n in range(4):
+			self.server.set(PkgAtom("sys-apps/new%d-1.0" % n),{ "SLOT" : "0" })
+			self.server.commit()
+			heads.append(self.publisher.publish(self.server))
+		# the full changesets and manifests of the last two heads, and
+		# the changesets from the two heads before the current one:
+		expected = set([ "%s.slurry" % heads[2], "%s.manifest" % heads[2], "%s.slurry" % heads[3], "%s.manifest" % heads[3],
+			"%s-%s.slurry" % ( heads[1], heads[3] ), "%s-%s.slurry" % ( heads[2], heads[3] ) ])
+		self.assertEqual(set(os.listdir(os.path.join(self.tmp,"pub","cache"))),expected)
+		changes, deletes, size = self.sync.sync()
+		self.assertEqual(changes,9)
+		self.assertSynced()
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from access import FilePath
+from portsmod import *
+from treeindex import TreeIndex
+
+def write(path,data=""):
+	parent = os.path.dirname(path)
+	if not os.path.isdir(parent):
+		os.makedirs(parent)
+	a = open(path,"w")
+	try:
+		a.write(data)
+	finally:
+		a.close()
+
+class TreeIndexTest(unittest.TestCase):
+
+	# Directory mtimes are set by hand, so that a change "within the same
+	# mtime tick" can be simulated by restoring the old mtime.
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.tree = os.path.join(self.tmp,"tree")
+		self.idx = os.path.join(self.tmp,"tree.idx")
+		self.old = time.time() - 3600
+		self.add("portage-2.1")
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def add(self,pf,mtime=None):
+		# adds an ebuild to sys-apps/portage, then sets the mtime of the
+		# package directory to mtime (default: an hour ago.)
+		write(os.path.join(self.tree,"sys-apps/portage/%s.ebuild" % pf))
+		if mtime == None:
+			mtime = self.old
+		os.utime(os.path.join(self.tree,"sys-apps/portage"),( mtime, mtime ))
+		os.utime(os.path.join(self.tree,"sys-apps"),( self.old, self.old ))
+
+	def index(self):
+		return PortageRepository(FilePath(self.tree),index=FilePath(self.idx)).index
+
+	def testSettled(self):
+		# an old mtime is trusted: a change that keeps the mtime isn't seen.
+		index = self.index()
+		self.assertEqual(index.catpkgs("sys-apps"),[ "portage" ])
+		self.assertEqual(index.ebuilds("sys-apps","portage"),[ "portage-2.1" ])
+		self.add("portage-2.2")
+		self.assertEqual(index.ebuilds("sys-apps","portage"),[ "portage-2.1" ])
+		# but a new mtime is:
+		self.add("portage-2.3",self.old + 1)
+		self.assertEqual(sorted(index.ebuilds("sys-apps","portage")),[ "portage-2.1", "portage-2.2", "portage-2.3" ])
+
+	def testSettleWindow(self):
+		# a directory modified within the settle window is rescanned
+		# until it settles, even if its mtime doesn't change.
+		now = time.time()
+		self.add("portage-2.1",now)
+		index = self.index()
+		self.assertEqual(index.ebuilds("sys-apps","portage"),[ "portage-2.1" ])
+		self.add("portage-2.2",now)
+		self.assertEqual(sorted(index.ebuilds("sys-apps","portage")),[ "portage-2.1", "portage-2.2" ])
+		index.settle = 0
+		index.ebuilds("sys-apps","portage")
+		self.add("portage-2.3",now)
+		self.assertEqual(sorted(index.ebuilds("sys-apps","portage")),[ "portage-2.1", "portage-2.2" ])
+
+	def testReload(self):
+		index = self.index()
+		self.assertEqual(index.ebuilds("sys-apps","portage"),[ "portage-2.1" ])
+		self.assertEqual(index.dirty,True)
+		index.save()
+		self.assertEqual(index.dirty,False)
+		# the reloaded index trusts the saved mtime:
+		self.add("portage-2.2")
+		index = self.index()
+		self.assertEqual(index.ebuilds("sys-apps","portage"),[ "portage-2.1" ])
+		self.assertEqual(index.dirty,False)
+		# and notices a new one:
+		self.add("portage-2.3",self.old + 1)
+		index = self.index()
+		self.assertEqual(sorted(index.ebuilds("sys-apps","portage")),[ "portage-2.1", "portage-2.2", "portage-2.3" ])
+		self.assertEqual(index.dirty,True)
+		# removed directories are dropped:
+		shutil.rmtree(os.path.join(self.tree,"sys-apps/portage"))
+		os.utime(os.path.join(self.tree,"sys-apps"),( self.old + 1, self.old + 1 ))
+		self.assertEqual(index.ebuilds("sys-apps","portage"),[])
+		self.assertEqual(index.catpkgs("sys-apps"),[])
+
+	def testReloadWithinSettleWindow(self):
+		# an entry saved while its directory was still settling is
+		# rescanned after a reload.
+		now = time.time()
+		self.add("portage-2.1",now)
+		index = self.index()
+		self.assertEqual(index.ebuilds("sys-apps","portage"),[ "portage-2.1" ])
+		index.save()
+		self.add("portage-2.2",now)
+		index = self.index()
+		self.assertEqual(sorted(index.ebuilds("sys-apps","portage")),[ "portage-2.1", "portage-2.2" ])
+
+	def testVersion(self):
+		index = self.index()
+		index.ebuilds("sys-apps","portage")
+		index.save()
+		TreeIndex.version += 1
+		try:
+			self.add("portage-2.2")
+			index = self.index()
+			self.assertEqual(sorted(index.ebuilds("sys-apps","portage")),[ "portage-2.1", "portage-2.2" ])
+			self.assertEqual(index.dirty,True)
+		finally:
+			TreeIndex.version -= 1
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python2
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+
+from versions import *
+
+class VersionOrderTest(unittest.TestCase):
+
+	def ordered(self,vers):
+		# each version in vers must sort before the next one.
+		for a, b in zip(vers,vers[1:]):
+			self.assertEqual(vercmp(a,b) < 0,True,"%s < %s" % ( a, b ))
+			self.assertEqual(vercmp(b,a) > 0,True,"%s > %s" % ( b, a ))
+		self.assertEqual(sorted(reversed(vers),cmp=vercmp),vers)
+
+	def testSuffixes(self):
+		self.ordered([ "1.0_alpha", "1.0_alpha1", "1.0_alpha2", "1.0_beta", "1.0_beta3", "1.0_pre1", "1.0_rc1", "1.0_rc10", "1.0", "1.0_p", "1.0_p1", "1.0_p2" ])
+		# suffixes are compared one after the other:
+		self.ordered([ "1.0_alpha_rc1", "1.0_alpha", "1.0_alpha_p1", "1.0_beta", "1.0_p1_alpha", "1.0_p1", "1.0_p1_p1" ])
+
+	def testRevisions(self):
+		self.ordered([ "1.0_rc1-r5", "1.0", "1.0-r1", "1.0-r2", "1.0-r10", "1.0a", "1.0.1" ])
+		self.assertEqual(vercmp("1.0","1.0-r0"),0)
+		self.assertEqual(version_key("1.0","r3")[4],3)
+		self.assertEqual(version_key("1.0",None)[4],0)
+
+	def testLetters(self):
+		self.ordered([ "1.0", "1.0a", "1.0b", "1.0z", "1.0.1", "1.1" ])
+		self.ordered([ "1.0a_rc1", "1.0a", "1.0a_p1", "1.0b_alpha" ])
+
+	def testComponents(self):
+		self.ordered([ "1", "1.0", "1.0.0", "1.1", "1.2", "1.10", "2", "10" ])
+		self.assertEqual(vercmp("010","10"),0)
+
+	def testLeadingZeros(self):
+		# components after the first are compared as strings with
+		# trailing zeros stripped if either starts with "0":
+		self.ordered([ "1.001", "1.01", "1.1" ])
+		self.ordered([ "1.0", "1.01", "1.011", "1.02", "1.1" ])
+		self.assertEqual(vercmp("1.0","1.00"),0)
+		self.assertEqual(vercmp("1.010","1.01"),0)
+		self.assertEqual(vercmp("1.09","1.1") < 0,True)
+		self.assertEqual(vercmp("1.09","1.10") < 0,True)
+
+	def testInvalid(self):
+		for ver in ( "", "a", "1.", ".1", "1..0", "1.0ab", "1.0_gamma", "1.0-r", "1.0-rc1", "1.0_rc-1" ):
+			self.assertEqual(version_key(ver),None,ver)
+		self.assertEqual(vercmp("1.0","1.0_gamma"),None)
+
+class SplitTest(unittest.TestCase):
+
+	def testPkgsplit(self):
+		self.assertEqual(pkgsplit("portage-2.2_rc67-r1"),( "portage", "2.2_rc67", "r1" ))
+		self.assertEqual(pkgsplit("portage-2.2"),( "portage", "2.2", "r0" ))
+		self.assertEqual(pkgsplit("font-adobe-100dpi-1.0.0"),( "font-adobe-100dpi", "1.0.0", "r0" ))
+		self.assertEqual(pkgsplit("gtk+-2.18.9-r1"),( "gtk+", "2.18.9", "r1" ))
+		self.assertEqual(pkgsplit("foo-r1-1.0"),( "foo-r1", "1.0", "r0" ))
+		for pf in ( "portage", "portage-", "portage-r1", "-1.0", "portage-1.0-r", "portage-x1.0", "por tage-1.0" ):
+			self.assertEqual(pkgsplit(pf),None,pf)
+
+	def testCatpkgsplit(self):
+		self.assertEqual(catpkgsplit("sys-apps/portage-2.2_rc67-r1"),( "sys-apps", "portage", "2.2_rc67", "r1" ))
+		self.assertEqual(catpkgsplit("dev-lang/python-2.6.5"),( "dev-lang", "python", "2.6.5", "r0" ))
+		for cpv in ( "portage-2.2", "/portage-2.2", "sys-apps/portage", "sys-apps/" ):
+			self.assertEqual(catpkgsplit(cpv),None,cpv)
+
+class PrefixTest(unittest.TestCase):
+
+	vers = [ "2.1", "2.2_alpha", "2.2_rc1", "2.2_rc67", "2.2_rc67-r1", "2.2", "2.2-r1", "2.2b", "2.2b_p1", "2.2.1", "2.2.1_rc1", "2.20", "2.21", "3.0" ]
+
+	def matches(self,ver):
+		test = prefix_test(ver)
+		out = []
+		for v in self.vers:
+			pv, sep, pr = v.partition("-")
+			if test(version_key(pv,pr or "r0")):
+				out.append(v)
+		return out
+
+	def testPrefix(self):
+		self.assertEqual(self.matches("2"),[ v for v in self.vers if v != "3.0" ])
+		self.assertEqual(self.matches("2.2"),[ "2.2_alpha", "2.2_rc1", "2.2_rc67", "2.2_rc67-r1", "2.2", "2.2-r1", "2.2b", "2.2b_p1", "2.2.1", "2.2.1_rc1" ])
+		self.assertEqual(self.matches("2.2b"),[ "2.2b", "2.2b_p1" ])
+		self.assertEqual(self.matches("2.2_rc"),[ "2.2_rc1", "2.2_rc67", "2.2_rc67-r1" ])
+		self.assertEqual(self.matches("2.2_rc67"),[ "2.2_rc67", "2.2_rc67-r1" ])
+		self.assertEqual(self.matches("2.2_rc67-r1"),[ "2.2_rc67-r1" ])
+		self.assertEqual(self.matches("2.2.1"),[ "2.2.1", "2.2.1_rc1" ])
+		self.assertEqual(prefix_test("2.2_gamma"),None)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/python2
+
+# Copyright 2010 Daniel Robbins, Funtoo Technologies, LLC.
+#
+# FUNTOO TECHNOLOGIES INTERNAL SOURCE CODE
+# ALPHA - DO NOT RELEASE - NOT FOR DISTRIBUTION
+#
+# The unauthorized reproduction or distribution of this copyrighted work is
+# illegal, and may result in civil or criminal liability.
+
+import stat
+import time
+
+class TreeIndex(object):
+
+	# TreeIndex is a persistent, on-disk index of the categories, catpkgs
+	# and ebuilds of a single PortageRepository. Walking a full Portage
+	# tree means tens of thousands of listdir() and isdir() calls, so
+	# instead we record the contents of each category and package
+	# directory along with the directory's mtime. Adding or removing an
+	# entry in a directory updates the directory's mtime, so a warm query
+	# only needs a single stat() of each directory involved, and only the
+	# directories that actually changed get rescanned.
+	#
+	# The index is stored in a single marshal-format file, one per
+	# repository (overlays have their own index.) Its layout is:
+	#
+	# { "version" : 1, "cats" : { cat : [ mtime, { pkg : [ mtime, [ pf, ... ] ] } ] } }
+	#
+	# A package entry of None means that the package directory has been
+	# seen but not yet scanned. An mtime of None means "always rescan".
+	# For paths with contentstamps, such as a GitPath, the directory's
+	# stamp() (its tree SHA1) is recorded in place of the mtime.
+	#
+	# Use it like this:
+	#
+	# a = PortageRepository(FilePath("/usr/portage"),index=FilePath("/var/cache/funports/portage.idx"))
+	#
+	# PortageRepository will consult the index and call save() as needed.
+
+	version = 1
+
+	# Directories modified within this many seconds of a scan are not
+	# trusted, since a further change within the same mtime tick would
+	# otherwise go unnoticed:
+
+	settle = 2
+
+	def __repr__(self):
+		return "TreeIndex(%s)" % self.path.diskpath
+
+	def __init__(self,repository,path):
+		# self.path is a FilePath pointing to the index file itself.
+		self.repository = repository
+		self.path = path
+		self.dirty = False
+		self._cats = None
+
+	def _load(self):
+		self._cats = {}
+		data = self.path.loadmarshal(self.version)
+		if data != None:
+			self._cats = data["cats"]
+		elif self.path.exists():
+			# unreadable, truncated or old index - start from scratch:
+			self.dirty = True
+
+	def _mtime(self,path):
+		# Returns the mtime of path if it is a directory, otherwise None.
+		# For paths with contentstamps (such as GitPath, whose
+		# directories have no mtime), the stamp is used instead.
+		if path.contentstamps:
+			if not path.isdir():
+				return None
+			return path.stamp()
+		st = path.stat()
+		if st == None or not stat.S_ISDIR(st.st_mode):
+			return None
+		return st.st_mtime
+
+	def _stamp(self,mtime):
+		# Returns the mtime to record for a freshly scanned directory.
+		# Content stamps can be trusted immediately.
+		if type(mtime) == tuple:
+			return mtime
+		if time.time() - mtime < self.settle:
+			return None
+		return mtime
+
+	def catpkgs(self,cat):
+
+		# Returns a list of package names in category cat. The category
+		# directory is only rescanned if its mtime has changed, and
+		# entries for packages that still exist are carried over.
+
+		if self._cats == None:
+			self._load()
+		catpath = self.repository.path.adjpath(cat)
+		mtime = self._mtime(catpath)
+		entry = self._cats.get(cat)
+		if mtime == None:
+			if entry != None:
+				del self._cats[cat]
+				self.dirty = True
+			return []
+		if entry == None or entry[0] != mtime:
+			if entry == None:
+				old = {}
+			else:
+				old = entry[1]
+			pkgs = {}
+			for pkg, isdir in catpath.scandir():
+				if not isdir:
+					continue
+				if pkg in old:
+					pkgs[pkg] = old[pkg]
+				else:
+					pkgs[pkg] = None
+			entry = self._cats[cat] = [ self._stamp(mtime), pkgs ]
+			self.dirty = True
+		return entry[1].keys()
+
+	def ebuilds(self,cat,pkg):
+
+		# Returns a list of ebuild names (minus the ".ebuild" suffix,
+		# i.e. "portage-2.2_rc67-r1") in cat/pkg, rescanning the
+		# package directory only if its mtime has changed.
+
+		if self._cats == None:
+			self._load()
+		pkgpath = self.repository.path.adjpath("%s/%s" % ( cat, pkg ))
+		mtime = self._mtime(pkgpath)
+		centry = self._cats.get(cat)
+		if centry == None:
+			entry = None
+		else:
+			entry = centry[1].get(pkg)
+		if mtime == None:
+			if entry != None:
+				del centry[1][pkg]
+				self.dirty = True
+			return []
+		if entry == None or entry[0] != mtime:
+			pfs = []
+			for file in pkgpath.listdir():
+				if file[-7:] == ".ebuild":
+					pfs.append(file[:-7])
+			entry = [ self._stamp(mtime), pfs ]
+			if centry == None:
+				# we haven't scanned the category yet, so make sure
+				# it gets scanned when it's first needed:
+				centry = self._cats[cat] = [ None, {} ]
+			centry[1][pkg] = entry
+			self.dirty = True
+		return entry[1]
+
+	def invalidate(self):
+		# Throw away all indexed data. The index file is rewritten on
+		# the next save().
+		self._cats = {}
+		self.dirty = True
+
+	def save(self):
+
+		# Writes the index back to disk if anything changed. The new
+		# index is renamed into place (see FilePath.atomicwrite()) so
+		# that concurrent readers never see a partial index.
+
+		if not self.dirty or self._cats == None:
+			return
+		self.path.savemarshal(self.version,{ "cats" : self._cats })
+		self.dirty = False
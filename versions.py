@@ -0,0 +1,161 @@
+#!/usr/bin/python2
+
+# Copyright 2010 Daniel Robbins, Funtoo Technologies, LLC.
+#
+# FUNTOO TECHNOLOGIES INTERNAL SOURCE CODE
+# ALPHA - DO NOT RELEASE - NOT FOR DISTRIBUTION
+#
+# The unauthorized reproduction or distribution of this copyrighted work is
+# illegal, and may result in civil or criminal liability.
+
+import re
+
+# This module implements package version splitting and comparison, following
+# the version rules of the Package Manager Specification (PMS). It replaces
+# our use of portage.versions so that PkgAtoms can be used without the
+# official Portage sources installed.
+
+# Rather than comparing two version strings directly, version_key() turns a
+# version into a tuple that sorts in PMS order. Version keys are computed
+# once (PkgAtom does this when it's created), after which sorting versions
+# or picking the best version is a plain tuple comparison.
+
+# A version looks like this:
+#
+# 1.2.3b_alpha4_p5-r6
+#
+# numeric components: "1", "2", "3" -- letter: "b" -- suffixes: "_alpha4",
+# "_p5" -- revision: "r6". Each part maps onto a field of the version key:
+#
+# ( 1, ( (1,2), (1,3) ), "b", ( (0,4), (5,5), (4,0) ), 6 )
+#
+# The first numeric component is compared as an integer. Subsequent
+# components are compared as integers, unless either starts with "0", in
+# which case they are compared as strings with trailing zeroes stripped.
+# A component with a leading zero always sorts before one without (as a
+# string, it starts with "0"), so we encode them as (0, stripped string)
+# and all others as (1, integer). More components means a greater version,
+# which falls out of comparing the nested tuples.
+#
+# Suffixes are ordered _alpha < _beta < _pre < _rc < (none) < _p. The
+# suffix list is terminated with (4,0), the rank of "no suffix", so that
+# 1.0_p1 > 1.0 > 1.0_rc1 also falls out of tuple comparison.
+
+_suffix_rank = { "alpha" : 0, "beta" : 1, "pre" : 2, "rc" : 3, "p" : 5 }
+_suffix_end = ( 4, 0 )
+
+_version = re.compile(r"^(\d+)((?:\.\d+)*)([a-z]?)((?:_(?:alpha|beta|pre|rc|p)\d*)*)$")
+_suffix = re.compile(r"_(alpha|beta|pre|rc|p)(\d*)")
+_revision = re.compile(r"^r(\d+)$")
+_pkgname = re.compile(r"^[A-Za-z0-9+_][A-Za-z0-9+_.-]*$")
+
+def version_key(pv,pr="r0"):
+
+	# Returns a sortable key for version pv (i.e. "2.2_rc67") and revision
+	# pr (i.e. "r1"), or None if pv is not a valid version.
+
+	match = _version.match(pv)
+	if match == None:
+		return None
+	first, rest, letter, suffixes = match.groups()
+	comps = []
+	for comp in rest[1:].split(".") if rest else []:
+		if comp[0] == "0":
+			comps.append(( 0, comp.rstrip("0") ))
+		else:
+			comps.append(( 1, int(comp) ))
+	sufs = []
+	for name, num in _suffix.findall(suffixes):
+		sufs.append(( _suffix_rank[name], int(num or 0) ))
+	sufs.append(_suffix_end)
+	if pr:
+		rev = int(pr[1:])
+	else:
+		rev = 0
+	return ( int(first), tuple(comps), letter, tuple(sufs), rev )
+
+def vercmp(a,b):
+
+	# Compares two version strings (optionally including a revision, i.e.
+	# "1.0-r1") and returns a negative, zero or positive integer like
+	# cmp(). Returns None if either version is invalid.
+
+	keys = []
+	for ver in ( a, b ):
+		pr = "r0"
+		pos = ver.rfind("-")
+		if pos != -1 and _revision.match(ver[pos+1:]):
+			ver, pr = ver[:pos], ver[pos+1:]
+		keys.append(version_key(ver,pr))
+	if None in keys:
+		return None
+	return cmp(keys[0],keys[1])
+
+def prefix_test(ver):
+
+	# Returns a function that takes a version key and returns True if the
+	# version begins with the components of version ver (optionally
+	# including a revision), as "=sys-apps/portage-2.2*" requires: 2.2,
+	# 2.2.1, 2.2b and 2.2_rc1 match, but 2.20 doesn't. A trailing suffix
+	# without a number (i.e. "2.2_rc") matches that suffix with any number.
+	# Returns None if ver is invalid.
+
+	pr = None
+	pos = ver.rfind("-")
+	if pos != -1 and _revision.match(ver[pos+1:]):
+		ver, pr = ver[:pos], ver[pos+1:]
+	key = version_key(ver,pr or "r0")
+	if key == None:
+		return None
+	if pr != None:
+		return lambda vkey: vkey == key
+	written = _suffix.findall(_version.match(ver).group(4))
+	if written:
+		sufs = key[3][:-1]
+		if written[-1][1]:
+			return lambda vkey: vkey[:3] == key[:3] and vkey[3][:len(sufs)] == sufs
+		# compare the rank of the last suffix only:
+		return lambda vkey: vkey[:3] == key[:3] and vkey[3][:len(sufs)-1] == sufs[:-1] and vkey[3][len(sufs)-1][0] == sufs[-1][0]
+	if key[2]:
+		return lambda vkey: vkey[:3] == key[:3]
+	return lambda vkey: vkey[0] == key[0] and vkey[1][:len(key[1])] == key[1]
+
+def pkgsplit(pf):
+
+	# Splits a package name and version such as "portage-2.2_rc67-r1" into
+	# ( "portage", "2.2_rc67", "r1" ). The revision is "r0" if none is
+	# specified. Returns None if pf does not contain a valid version.
+
+	parts = pf.split("-")
+	if len(parts) < 2:
+		return None
+	pr = "r0"
+	if _revision.match(parts[-1]):
+		if len(parts) < 3:
+			return None
+		pr = parts.pop()
+	pv = parts.pop()
+	if _version.match(pv) == None:
+		return None
+	pkg = "-".join(parts)
+	if _pkgname.match(pkg) == None:
+		return None
+	return ( pkg, pv, pr )
+
+def catpkgsplit(cpv):
+
+	# Splits "sys-apps/portage-2.2_rc67-r1" into ( "sys-apps", "portage",
+	# "2.2_rc67", "r1" ). This is compatible with
+	# portage.versions.catpkgsplit(). Returns None if cpv is invalid.
+
+	cat, sep, pf = cpv.partition("/")
+	if not sep or not cat:
+		return None
+	split = pkgsplit(pf)
+	if split == None:
+		return None
+	return ( cat, ) + split
+
+if __name__ == "__main__":
+	vers = [ "1.0", "1.0-r1", "1.0_p1", "1.0_rc1", "1.0a", "1.01", "1.001", "1.1", "1.0.0", "1_alpha", "1_beta2_p3" ]
+	print sorted(vers, cmp=vercmp)